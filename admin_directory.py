@@ -0,0 +1,166 @@
+"""
+Справочник администраторов в памяти
+
+Админ-панель, список администраторов и проверки прав читаются из памяти,
+без запроса к базе данных. Список перечитывается из базы данных при
+изменениях через бота и периодически (на случай изменений из других
+процессов).
+
+Имена пользователей администраторов, добавленных по ID, неизвестны, пока
+администратор не напишет боту. Фоновая задача запрашивает их через get_chat
+пачками в рамках общего лимита запросов к Telegram и кэширует результат
+на время TTL.
+
+Справочник читается на потоке цикла событий, а меняется и в потоках
+asyncio.to_thread (add, remove, reload). Изменения идут под блокировкой
+вместе с чтением из базы, а список с множеством ID заменяются целиком одним
+присваиванием, поэтому читатель видит либо старый, либо новый снимок, и
+перечитывание, начатое до добавления администратора, не затирает его.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from telegram.error import TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Имя, которое сохраняется для администратора, добавленного по ID
+UNKNOWN_USERNAME = "Неизвестно"
+
+
+class AdminDirectory:
+    """Кэш списка администраторов и их имен пользователей"""
+
+    def __init__(self, db, username_ttl: float = 24 * 3600, batch_size: int = 20):
+        """
+        Args:
+            db: База данных (Database)
+            username_ttl: Через сколько секунд имя пользователя запрашивается заново
+            batch_size: Сколько имен запрашивать за один проход
+        """
+        self.db = db
+        self.username_ttl = username_ttl
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        # Список администраторов и множество их ID (None - еще не загружены)
+        self._snapshot: Optional[Tuple[List[Dict], FrozenSet[int]]] = None
+        # Когда имя пользователя было запрошено: user_id -> time.monotonic()
+        self._resolved_at: Dict[int, float] = {}
+
+    def _load(self):
+        """Прочитать список из базы данных и заменить снимок (под self._lock)"""
+        admins = self.db.get_all_admins()
+        self._snapshot = (admins, frozenset(admin['user_id'] for admin in admins))
+
+    def _current(self) -> Tuple[List[Dict], FrozenSet[int]]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reload()
+            snapshot = self._snapshot
+        return snapshot
+
+    def reload(self):
+        """Перечитать список администраторов из базы данных"""
+        with self._lock:
+            self._load()
+
+    def admins(self) -> List[Dict]:
+        """Список администраторов в порядке добавления (не изменять)"""
+        return self._current()[0]
+
+    def is_admin(self, user_id: int) -> bool:
+        """Проверить, является ли пользователь администратором"""
+        return user_id in self._current()[1]
+
+    @staticmethod
+    def display_name(admin: Dict) -> str:
+        """Имя администратора для вывода: @username или «Неизвестно»"""
+        username = admin.get('username')
+        if not username or username == UNKNOWN_USERNAME:
+            return UNKNOWN_USERNAME
+        return f"@{username}"
+
+    def add(self, user_id: int, username: Optional[str] = None,
+            added_by: Optional[int] = None) -> bool:
+        """Добавить администратора (см. Database.add_admin)"""
+        with self._lock:
+            success = self.db.add_admin(user_id, username, added_by)
+            if success:
+                self._load()
+        return success
+
+    def remove(self, user_id: int, removed_by: Optional[int] = None) -> bool:
+        """Удалить администратора (см. Database.remove_admin)"""
+        with self._lock:
+            success = self.db.remove_admin(user_id, removed_by)
+            if success:
+                self._load()
+                self._resolved_at.pop(user_id, None)
+        return success
+
+    def note_username(self, user_id: int, username: Optional[str]):
+        """Запомнить имя пользователя администратора, который сам написал боту"""
+        if not username or not self.is_admin(user_id):
+            return
+        with self._lock:
+            self._resolved_at[user_id] = time.monotonic()
+            admins, ids = self._snapshot
+            if any(admin['user_id'] == user_id and admin['username'] != username for admin in admins):
+                self.db.update_admin_usernames([(user_id, username)])
+                self._snapshot = ([
+                    dict(admin, username=username) if admin['user_id'] == user_id else admin
+                    for admin in admins
+                ], ids)
+
+    def _due_for_refresh(self) -> List[Dict]:
+        """Администраторы, чьи имена неизвестны или устарели"""
+        now = time.monotonic()
+        due = []
+        for admin in self.admins():
+            resolved_at = self._resolved_at.get(admin['user_id'])
+            if resolved_at is not None and now - resolved_at < self.username_ttl:
+                continue
+            if resolved_at is None and admin['username'] not in (None, UNKNOWN_USERNAME):
+                # Имя уже известно из базы данных - считаем его свежим
+                self._resolved_at[admin['user_id']] = now
+                continue
+            due.append(admin)
+        return due[:self.batch_size]
+
+    async def backfill_usernames(self, outbox):
+        """
+        Запросить недостающие имена пользователей через get_chat
+        
+        Args:
+            outbox: Очередь исходящих запросов (Outbox) с лимитами Telegram
+        """
+        await asyncio.to_thread(self.reload)
+        due = self._due_for_refresh()
+        if not due:
+            return
+
+        async def resolve(admin: Dict):
+            user_id = admin['user_id']
+            self._resolved_at[user_id] = time.monotonic()
+            try:
+                chat = await outbox.request("get_chat", chat_id=user_id)
+            except TelegramError as e:
+                # Пользователь еще не писал боту - попробуем после истечения TTL
+                logger.debug(f"Не удалось получить данные пользователя {user_id}: {e}")
+                return None
+            metrics.inc("admin_usernames_resolved")
+            if chat.username and chat.username != admin['username']:
+                return (user_id, chat.username)
+            return None
+
+        results = await asyncio.gather(*(resolve(admin) for admin in due))
+        updates = [result for result in results if result]
+        if updates:
+            await asyncio.to_thread(self.db.update_admin_usernames, updates)
+            await asyncio.to_thread(self.reload)
+            logger.info(f"Обновлены имена администраторов: {len(updates)}")
@@ -0,0 +1,124 @@
+"""
+Журнал аудита
+
+Каждая изменяющая операция (кто, что, над чем, было/стало, когда) попадает
+в журнал audit_log. Операции не пишут в журнал сами: запись ставится в
+буфер в памяти, а фоновая задача сбрасывает буфер в базу данных пачками
+одной транзакцией. Так аудит не добавляет отдельных коммитов (и fsync)
+к каждой операции.
+
+Время записи фиксируется в момент операции, а не в момент сброса.
+Операции базы данных выполняются в пуле потоков, поэтому буфер защищен
+блокировкой, а фоновая задача будится через call_soon_threadsafe.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Запись журнала: (user_id, action, target, before, after, created_at)
+AuditEntry = Tuple[Optional[int], str, Optional[str], Optional[str], Optional[str], str]
+
+
+class AuditLog:
+    """Буферизованная запись журнала аудита"""
+
+    def __init__(self, writer: Callable[[List[AuditEntry]], None],
+                 batch_size: int = 100, flush_interval: float = 1.0):
+        """
+        Args:
+            writer: Функция записи пачки в базу данных (Database.add_audit_entries)
+            batch_size: При каком размере буфера сбрасывать его, не дожидаясь интервала
+            flush_interval: Как часто (в секундах) сбрасывать буфер
+        """
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[AuditEntry] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._buffer_lock = threading.Lock()
+
+    def record(self, user_id: Optional[int], action: str, target=None, before=None, after=None):
+        """
+        Добавить запись в журнал (без обращения к базе данных)
+
+        Args:
+            user_id: ID пользователя, выполнившего операцию
+            action: Код операции (например, 'price')
+            target: Объект операции (наименование товара, ID администратора)
+            before: Значение до операции
+            after: Значение после операции
+        """
+        created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._buffer_lock:
+            self._buffer.append((
+                user_id, action,
+                None if target is None else str(target),
+                None if before is None else str(before),
+                None if after is None else str(after),
+                created_at
+            ))
+            full = len(self._buffer) >= self.batch_size
+        if full and self._wakeup is not None:
+            # record вызывается и из потоков пула (методы базы данных)
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self):
+        """Запустить фоновый сброс буфера (вызывается из работающего цикла событий)"""
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновый сброс и записать остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные записи в базу данных одной транзакцией"""
+        if not self._buffer:
+            return
+        if self._flush_lock is None:
+            self._write(self._take())
+            return
+        async with self._flush_lock:
+            entries = self._take()
+            if entries:
+                # Запись идет в отдельном потоке, чтобы не блокировать цикл событий
+                await asyncio.to_thread(self._write, entries)
+
+    def _take(self) -> List[AuditEntry]:
+        with self._buffer_lock:
+            entries, self._buffer = self._buffer, []
+        return entries
+
+    def _write(self, entries: List[AuditEntry]):
+        try:
+            self.writer(entries)
+            metrics.inc("audit_entries_written", len(entries))
+        except Exception as e:
+            # Не теряем записи: вернем их в начало буфера до следующей попытки
+            logger.error(f"Не удалось записать журнал аудита ({len(entries)} записей): {e}")
+            with self._buffer_lock:
+                self._buffer[:0] = entries
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
@@ -0,0 +1,50 @@
+"""
+Распознавание штрихкодов на фотографиях
+
+Декодирование выполняется локально (без внешних сервисов) через pyzbar и
+Pillow. Это необязательные зависимости: если они не установлены, бот
+продолжает работать, а штрихкод можно ввести вручную.
+"""
+import io
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def decoder_available() -> bool:
+    """Проверить, установлены ли библиотеки для распознавания"""
+    try:
+        import PIL.Image  # noqa: F401
+        import pyzbar.pyzbar  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def decode_barcode(image_bytes: bytes) -> Optional[str]:
+    """
+    Распознать первый штрихкод на изображении
+    
+    Args:
+        image_bytes: Содержимое файла изображения
+        
+    Returns:
+        Код из штрихкода или None, если ничего не найдено
+    """
+    from PIL import Image
+    from pyzbar import pyzbar
+    
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # Штрихкоды лучше распознаются на изображении в оттенках серого
+        results = pyzbar.decode(image.convert("L"))
+    except Exception as e:
+        logger.warning(f"Не удалось распознать изображение: {e}")
+        return None
+    
+    for result in results:
+        code = result.data.decode("utf-8", errors="ignore").strip()
+        if code:
+            return code
+    return None
@@ -0,0 +1,115 @@
+"""
+Замер листания истории кассы
+
+Заполняет кассу заданным числом операций и печатает задержку
+get_cashbox_history: первая страница и глубокая страница (по ключу
+последней строки предыдущей страницы, как листает бот), то же с отбором по
+типу операции, и для сравнения глубокая страница через OFFSET.
+
+    python benchmarks/cashbox_history.py --rows 1000000 --page 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+TYPES = ("sale", "sale", "sale", "income", "expense")
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def measure(call, repeats):
+    """Задержки call(), отсортированные по возрастанию"""
+    latencies = []
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    return latencies
+
+
+def report(title, latencies):
+    print(
+        f"{title}: медиана {percentile(latencies, 0.5) * 1000:.3f} мс, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.3f} мс"
+    )
+
+
+def cursor_for_page(conn, page, limit, transaction_type=None):
+    """ID последней операции страницы page - 1 (курсор, с которым бот открывает страницу page)"""
+    where, params = ("WHERE transaction_type = ?", (transaction_type,)) if transaction_type else ("", ())
+    return conn.execute(f"""
+        SELECT id FROM cashbox {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1 OFFSET ?
+    """, (*params, (page - 1) * limit - 1)).fetchone()[0]
+
+
+def offset_page(db, page, limit):
+    """Та же страница через OFFSET"""
+    conn = db.get_connection()
+    rows = conn.execute("""
+        SELECT * FROM cashbox
+        ORDER BY created_at DESC, id DESC
+        LIMIT ? OFFSET ?
+    """, (limit, (page - 1) * limit)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page", type=int, default=10_000, help="Номер глубокой страницы")
+    parser.add_argument("--limit", type=int, default=10, help="Операций на странице")
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--db", help="Файл базы (по умолчанию - временный)")
+    args = parser.parse_args()
+
+    db = Database(args.db or os.path.join(tempfile.mkdtemp(), "cashbox.db"))
+    conn = db.get_connection()
+    rng = random.Random(1)
+    started_at = datetime(2020, 1, 1)
+    conn.executemany(
+        "INSERT INTO cashbox (amount, transaction_type, description, created_at) VALUES (?, ?, ?, ?)",
+        ((rng.randint(100, 100_000), rng.choice(TYPES), "Операция",
+          (started_at + timedelta(seconds=row * 60)).strftime("%Y-%m-%d %H:%M:%S"))
+         for row in range(args.rows))
+    )
+    conn.commit()
+    print(f"операций в кассе: {conn.execute('SELECT COUNT(*) FROM cashbox').fetchone()[0]}, "
+          f"страница {args.limit} строк")
+
+    before_id = cursor_for_page(conn, args.page, args.limit)
+    sale_before_id = cursor_for_page(conn, args.page, args.limit, "sale")
+    conn.close()
+
+    report("страница 1", measure(lambda: db.get_cashbox_history(args.limit), args.repeats))
+    report(f"страница {args.page}", measure(
+        lambda: db.get_cashbox_history(args.limit, before_id=before_id), args.repeats
+    ))
+    report("продажи, страница 1", measure(
+        lambda: db.get_cashbox_history(args.limit, transaction_type="sale"), args.repeats
+    ))
+    report(f"продажи, страница {args.page}", measure(
+        lambda: db.get_cashbox_history(args.limit, transaction_type="sale", before_id=sale_before_id), args.repeats
+    ))
+    report(f"страница {args.page} через OFFSET", measure(
+        lambda: offset_page(db, args.page, args.limit), max(1, args.repeats // 10)
+    ))
+
+    assert offset_page(db, args.page, args.limit) == db.get_cashbox_history(args.limit, before_id=before_id)
+
+
+if __name__ == "__main__":
+    main()
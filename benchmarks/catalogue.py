@@ -0,0 +1,116 @@
+"""
+Замер списка товаров: словари на каждый вызов против каталога в памяти
+
+Для каталога из заданного числа товаров сравнивает:
+- прежний путь get_all_products: SELECT всей таблицы и dict на каждую строку
+  при каждом вызове;
+- записи Product со __slots__, прочитанные из базы (без каталога);
+- Catalogue: первое построение, повторный вызов без изменений и вызов после
+  изменения одного товара.
+
+Печатается время вызова (медиана) и память: сколько выделяет один вызов
+(пик tracemalloc) и сколько занимает результат.
+
+    python benchmarks/catalogue.py --products 50000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database, Product  # noqa: E402
+
+
+def dict_products(db):
+    """get_all_products до каталога: новый dict на каждую строку при каждом вызове"""
+    conn = db.get_connection()
+    rows = conn.execute("SELECT * FROM products ORDER BY name").fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def slotted_products(db):
+    """Записи Product из базы, без каталога"""
+    conn = db.get_connection()
+    conn.row_factory = Product.row_factory
+    products = conn.execute(f"SELECT {Product.COLUMNS} FROM products ORDER BY name").fetchall()
+    conn.close()
+    return products
+
+
+def timed(call, repeats):
+    """Медиана времени вызова (секунды)"""
+    durations = []
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - begin)
+    return statistics.median(durations)
+
+
+def allocated(call):
+    """Пик выделенной за вызов памяти и размер результата, который остается после вызова (байты)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = call()
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return peak, retained
+
+
+def report(title, seconds, memory=None):
+    line = f"  {title}: {seconds * 1000:.2f} мс"
+    if memory is not None:
+        peak, retained = memory
+        line += f", выделено за вызов {peak / 2 ** 20:.1f} МБ, результат {max(retained, 0) / 2 ** 20:.1f} МБ"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "catalogue.db")
+    db = Database(path)
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO products (name, quantity, price, sku) VALUES (?, ?, ?, ?)",
+        ((f"Товар {i:06d}", i % 500, 100 + i, f"46{i:011d}") for i in range(args.products))
+    )
+    conn.commit()
+    conn.close()
+
+    print(f"{args.products} товаров, медиана {args.repeats} вызовов")
+    report("словари на каждый вызов", timed(lambda: dict_products(db), args.repeats),
+           allocated(lambda: dict_products(db)))
+    report("записи Product без каталога", timed(lambda: slotted_products(db), args.repeats),
+           allocated(lambda: slotted_products(db)))
+
+    # Первое построение - на свежих экземплярах, чтобы каталог собирался с нуля
+    report("каталог, первое построение", timed(Database(path).get_all_products, 1),
+           allocated(Database(path).get_all_products))
+    db.get_all_products()
+    report("каталог, без изменений", timed(db.get_all_products, args.repeats), allocated(db.get_all_products))
+
+    names = [f"Товар {i:06d}" for i in range(0, args.products, max(1, args.products // args.repeats))]
+    durations = []
+    for n, name in enumerate(names[:args.repeats]):
+        db.update_product_price(name, 200 + n)
+        begin = time.perf_counter()
+        db.get_all_products()
+        durations.append(time.perf_counter() - begin)
+    report("каталог, после изменения одного товара", statistics.median(durations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Замер прогноза спроса
+
+Заполняет базу заданным числом товаров и продажами за заданное число
+дней (в каждый день товар продается с вероятностью --sale-share) и
+печатает время:
+- get_daily_sales (и для сравнения - того же запроса с GROUP BY по товару
+  и дню);
+- построения матрицы и расчета прогноза (sales_matrix + forecast_arrays);
+- полного пересчета DemandForecaster.refresh.
+
+    python benchmarks/forecast.py --products 10000 --days 730
+
+Полный объем (10 000 товаров x 730 дней, около 2.9 млн продаж)
+заполняется около минуты; для быстрой проверки можно уменьшить
+--products и --days. Для замера нужен NumPy.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, time as day_start, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from forecast import DemandForecaster, forecast_arrays, sales_matrix  # noqa: E402
+
+
+def grouped_daily_sales(db, date_from, days):
+    """get_daily_sales с группировкой в SQLite (вариант, от которого отказались)"""
+    start_at = datetime.combine(date_from, day_start.min, timezone.utc)
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute("""
+        SELECT product_id, (CAST(strftime('%s', created_at) AS INTEGER) - ?) / 86400 AS day, SUM(quantity)
+        FROM sales
+        WHERE created_at >= ? AND created_at < ?
+        GROUP BY product_id, day
+    """, (int(start_at.timestamp()), db._utc_timestamp(start_at),
+          db._utc_timestamp(start_at + timedelta(days=days))))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def timed(title, call):
+    begin = time.perf_counter()
+    result = call()
+    print(f"  {title}: {time.perf_counter() - begin:.2f} с")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--sale-share", type=float, default=0.4, help="Вероятность продажи товара за день")
+    parser.add_argument("--db", help="Файл базы (по умолчанию - временный)")
+    args = parser.parse_args()
+
+    db = Database(args.db or os.path.join(tempfile.mkdtemp(), "forecast.db"))
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO products (name, quantity, price) VALUES (?, ?, 100)",
+        ((f"Товар {i}", i % 300) for i in range(args.products))
+    )
+    rng = random.Random(1)
+    date_from = datetime.now(timezone.utc).date() - timedelta(days=args.days)
+    start = datetime.combine(date_from, day_start.min)
+    conn.executemany(
+        "INSERT INTO sales (product_id, quantity, price, amount, created_at) VALUES (?, ?, 100, ?, ?)",
+        ((product_id, quantity, quantity * 100,
+          (start + timedelta(days=day, seconds=rng.randrange(86400))).strftime("%Y-%m-%d %H:%M:%S"))
+         for day in range(args.days)
+         for product_id in range(1, args.products + 1)
+         if rng.random() < args.sale_share
+         for quantity in (rng.randint(1, 5),))
+    )
+    conn.commit()
+    print(f"{args.products} товаров x {args.days} дней, "
+          f"строк продаж: {conn.execute('SELECT COUNT(*) FROM sales').fetchone()[0]}")
+    conn.close()
+
+    sales = timed("get_daily_sales", lambda: db.get_daily_sales(date_from, args.days))
+    timed("то же с GROUP BY", lambda: grouped_daily_sales(db, date_from, args.days))
+
+    products = db.get_all_products()
+    # NumPy импортируется при первом расчете - импорт в замер не входит
+    sales_matrix([], [], 1)
+
+    def compute():
+        matrix = sales_matrix([product.id for product in products], sales, args.days)
+        return forecast_arrays(matrix, [product.quantity for product in products], 28, 0.3, 21)
+
+    timed("матрица + прогноз", compute)
+    forecaster = DemandForecaster(db, history_days=args.days)
+    timed("полный пересчет", forecaster.refresh)
+    print(f"  товаров к дозаказу: {forecaster.reorder_count()}")
+
+
+if __name__ == "__main__":
+    main()
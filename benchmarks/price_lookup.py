@@ -0,0 +1,96 @@
+"""
+Замер поиска текущей цены при продаже
+
+Заполняет историю цен заданным числом строк по случайным товарам и
+печатает время поиска текущей цены (тот же запрос, что в sell_product):
+с покрывающим индексом idx_prices_product и без него, а также задержку
+sell_product целиком.
+
+    python benchmarks/price_lookup.py --prices 1000000 --products 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def measure(call, arguments):
+    """Задержки вызовов call(argument), отсортированные по возрастанию"""
+    latencies = []
+    for argument in arguments:
+        begin = time.perf_counter()
+        call(argument)
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    return latencies
+
+
+def report(title, latencies):
+    print(
+        f"{title}: медиана {percentile(latencies, 0.5) * 1000:.3f} мс, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.3f} мс ({len(latencies)} вызовов)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prices", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--db", help="Файл базы (по умолчанию - временный)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "prices.db")
+    db = Database(path)
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO products (name, quantity, price) VALUES (?, ?, 100)",
+        ((f"Товар {i}", 1_000_000) for i in range(args.products))
+    )
+    rng = random.Random(1)
+    started_at = datetime(2020, 1, 1)
+    conn.executemany(
+        "INSERT INTO prices (product_id, price, valid_from) VALUES (?, ?, ?)",
+        ((rng.randint(1, args.products), rng.randint(100, 100_000),
+          (started_at + timedelta(seconds=row)).strftime("%Y-%m-%d %H:%M:%S.000"))
+         for row in range(args.prices))
+    )
+    conn.commit()
+    total = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+    print(f"строк в prices: {total}, товаров: {args.products}")
+
+    plan = conn.execute("""
+        EXPLAIN QUERY PLAN
+        SELECT price FROM prices WHERE product_id = ? ORDER BY valid_from DESC, id DESC LIMIT 1
+    """, (1,)).fetchall()
+    print("план:", "; ".join(row['detail'] for row in plan))
+
+    cursor = conn.cursor()
+    product_ids = [rng.randint(1, args.products) for _ in range(args.lookups)]
+    report("текущая цена с индексом", measure(lambda product_id: db._current_price(cursor, product_id), product_ids))
+
+    names = [f"Товар {product_id - 1}" for product_id in product_ids[:1000]]
+    report("sell_product целиком", measure(lambda name: db.sell_product(name, 1), names))
+
+    # Для сравнения - тот же запрос без индекса (полный просмотр таблицы).
+    # Индекс удаляется из файла базы, поэтому база для замера - отдельная
+    conn.execute("DROP INDEX idx_prices_product")
+    report("текущая цена без индекса", measure(
+        lambda product_id: db._current_price(cursor, product_id), product_ids[:50]
+    ))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
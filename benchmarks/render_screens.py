@@ -0,0 +1,113 @@
+"""
+Замер сборки экрана списка товаров
+
+Сравнивает прежний цикл show_products_list (конкатенация текста, новые
+кнопки на каждый товар, проверка администратора на каждый товар) с
+render.products_list для администратора: с пустым кэшем строк кнопок и с
+прогретым. Перед замером проверяется, что текст и клавиатура (to_dict())
+совпадают. Проверка администратора здесь - поиск в множестве, как в
+кэше AdminDirectory.
+
+    python benchmarks/render_screens.py --products 1000
+
+Для замера нужна python-telegram-bot.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+import render  # noqa: E402
+from database import Product  # noqa: E402
+from money import format_money  # noqa: E402
+
+ADMINS = frozenset({100})
+
+
+def is_admin(user_id):
+    return user_id in ADMINS
+
+
+def old_products_list(products, user_id):
+    """Экран списка товаров так, как его собирал show_products_list до render"""
+    text = "📦 Список товаров:\n\n"
+    keyboard = []
+
+    for product in products:
+        text += (
+            f"• {product.name}\n"
+            f"  Количество: {product.quantity} | "
+            f"Цена: {format_money(product.price)} руб.\n\n"
+        )
+        product_name_encoded = product.name.replace(" ", "_")
+        keyboard.append([
+            InlineKeyboardButton(
+                f"📦 {product.name}",
+                callback_data=f"product_view_{product_name_encoded}"
+            )
+        ])
+        admin = is_admin(user_id)
+        if admin:
+            keyboard.append([
+                InlineKeyboardButton("📝 Кол-во", callback_data=f"product_qty_{product_name_encoded}"),
+                InlineKeyboardButton("💵 Цена", callback_data=f"product_price_{product_name_encoded}"),
+                InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{product_name_encoded}")
+            ])
+        else:
+            keyboard.append([
+                InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{product_name_encoded}")
+            ])
+
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_main")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def new_products_list(products, user_id):
+    """Экран списка товаров так, как его собирает show_products_list сейчас"""
+    return render.products_list(products, is_admin(user_id), footer=render.back_row("back_main"))
+
+
+def timed(call, repeats, before=None):
+    """Медиана времени вызова (секунды); before() вызывается перед каждым замером вне времени"""
+    durations = []
+    for _ in range(repeats):
+        if before is not None:
+            before()
+        begin = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - begin)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    products = [
+        Product(i, f"Товар номер {i:05d}", i % 500, 10_000 + i * 7, None, "2026-01-01 00:00:00", i)
+        for i in range(1, args.products + 1)
+    ]
+    user_id = next(iter(ADMINS))
+
+    old_text, old_markup = old_products_list(products, user_id)
+    new_text, new_markup = new_products_list(products, user_id)
+    assert old_text == new_text and old_markup.to_dict() == new_markup.to_dict()
+
+    print(f"экран списка из {args.products} товаров для администратора, медиана {args.repeats} сборок")
+    old = timed(lambda: old_products_list(products, user_id), args.repeats)
+    cold = timed(lambda: new_products_list(products, user_id), args.repeats, before=render.product_rows.cache_clear)
+    warm = timed(lambda: new_products_list(products, user_id), args.repeats)
+    print(f"  прежний цикл: {old * 1000:.1f} мс")
+    print(f"  render.products_list, пустой кэш: {cold * 1000:.1f} мс")
+    print(f"  render.products_list, прогретый кэш: {warm * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Замер массового изменения цен
+
+Заполняет склад заданным числом товаров (каждый десятый - "Молоко ...")
+и печатает время:
+- preview_reprice и bulk_reprice по правилу для всех товаров;
+- bulk_reprice с отбором по наименованию (десятая часть товаров);
+- для сравнения - того же числа изменений по одному через
+  update_product_price.
+
+Время bulk_reprice включает триггеры сводки склада и запись истории цен.
+
+    python benchmarks/reprice.py --products 100000 --rule "+7% ~1" --single 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from reprice import parse_reprice_rule  # noqa: E402
+
+
+def timed(call, repeats):
+    """Медиана времени вызова (секунды) и результат последнего вызова"""
+    durations = []
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        result = call()
+        durations.append(time.perf_counter() - begin)
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--rule", default="+7% ~1")
+    parser.add_argument("--single", type=int, default=1000, help="Сколько цен изменить по одной")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    db = Database(os.path.join(tempfile.mkdtemp(), "reprice.db"))
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO products (name, quantity, price) VALUES (?, ?, ?)",
+        ((f"Молоко {i:06d}" if i % 10 == 0 else f"Товар {i:06d}", i % 500, 10_000 + i)
+         for i in range(args.products))
+    )
+    conn.commit()
+    conn.close()
+    rule = parse_reprice_rule(args.rule)
+    print(f"{args.products} товаров, правило: {rule.describe()}, медиана {args.repeats} запусков")
+
+    seconds, preview = timed(lambda: db.preview_reprice(rule), args.repeats)
+    print(f"  preview_reprice: {seconds * 1000:.0f} мс ({preview['count']} цен)")
+    seconds, count = timed(lambda: db.bulk_reprice(rule), args.repeats)
+    print(f"  bulk_reprice: {seconds * 1000:.0f} мс ({count} цен)")
+    seconds, count = timed(lambda: db.bulk_reprice(rule, name_filter="молоко"), args.repeats)
+    print(f"  bulk_reprice с отбором: {seconds * 1000:.0f} мс ({count} цен)")
+
+    names = [f"Товар {i:06d}" for i in range(1, args.products) if i % 10][:args.single]
+    begin = time.perf_counter()
+    for n, name in enumerate(names):
+        db.update_product_price(name, 20_000 + n)
+    seconds = time.perf_counter() - begin
+    print(f"  update_product_price по одной: {seconds * 1000:.0f} мс ({len(names)} цен)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Замер холодного запуска бота
+
+Каждый прогон - новый процесс Python, который импортирует bot и открывает
+базу данных (как при перезапуске службы), а в версиях с прогнозом спроса и
+настройкой HTTP-клиента выполняет то же, что main() до запуска опроса:
+проверку NumPy и создание двух клиентов Bot API. Печатаются медианы: время
+всего процесса, импорта bot, открытия Database и подготовки main(). База
+создается первым прогоном в отдельной временной папке и дальше открывается
+уже существующей.
+
+Чтобы сравнить «до и после», укажите рабочие копии разных версий:
+
+    git worktree add /tmp/before <коммит>
+    python benchmarks/startup.py --tree /tmp/before
+    python benchmarks/startup.py
+
+Для замера нужны зависимости бота (python-telegram-bot, python-dotenv).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Код одного прогона. В старых версиях база открывается при импорте bot,
+# в новых - в main(), поэтому она открывается отдельно, если bot.db пуст.
+# Модулей forecast и transport в старых версиях нет
+PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import bot
+imported = time.perf_counter()
+if getattr(bot, "db", None) is None:
+    from database import Database
+    Database()
+opened = time.perf_counter()
+if os.path.exists(os.path.join(sys.argv[1], "forecast.py")):
+    from forecast import numpy_available
+    numpy_available()
+if os.path.exists(os.path.join(sys.argv[1], "transport.py")):
+    from transport import build_request
+    build_request()
+    build_request(pool_size=1)
+prepared = time.perf_counter()
+print(json.dumps({"import": imported - started, "database": opened - imported, "main": prepared - opened}))
+"""
+
+
+def run_once(tree: str, workdir: str) -> dict:
+    env = dict(os.environ, BOT_TOKEN="")
+    begin = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, tree], cwd=workdir, env=env,
+        capture_output=True, text=True
+    )
+    total = time.perf_counter() - begin
+    if result.returncode:
+        raise SystemExit(result.stderr)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process"] = total
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tree", default=ROOT, help="Рабочая копия бота (по умолчанию - эта)")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    tree = os.path.abspath(args.tree)
+    workdir = tempfile.mkdtemp()
+    # Первый прогон создает базу и байткод, в замер не входит
+    run_once(tree, workdir)
+    runs = [run_once(tree, workdir) for _ in range(args.runs)]
+
+    print(f"{tree}: {args.runs} запусков, медиана")
+    for key, title in (("process", "процесс целиком"), ("import", "import bot"),
+                       ("database", "открытие базы"), ("main", "подготовка main()")):
+        print(f"  {title}: {statistics.median(run[key] for run in runs) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Нагрузочный замер журнала движения товара
+
+Проводит заданное число движений (приход / продажа) по случайным товарам
+через Database и печатает задержку одного движения (медиана, p99, максимум),
+число снимков остатков и время восстановления остатка get_stock_at.
+
+    python benchmarks/stock_journal.py --moves 1000000 --products 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--moves", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--db", help="Файл базы (по умолчанию - временный)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "journal.db")
+    db = Database(path)
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO products (name, quantity, price) VALUES (?, ?, 100)",
+        ((f"Товар {i}", 1_000_000) for i in range(args.products))
+    )
+    conn.commit()
+    conn.close()
+
+    rng = random.Random(1)
+    latencies = []
+    started = time.perf_counter()
+    for move in range(args.moves):
+        name = f"Товар {rng.randrange(args.products)}"
+        begin = time.perf_counter()
+        if move % 2:
+            db.add_product_quantity(name, 1)
+        else:
+            db.sell_product(name, 1)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    conn = db.get_connection()
+    snapshots = conn.execute("SELECT COUNT(*) FROM stock_snapshots").fetchone()[0]
+    conn.close()
+
+    names = [f"Товар {rng.randrange(args.products)}" for _ in range(200)]
+    begin = time.perf_counter()
+    for name in names:
+        db.get_stock_at(name, "2999-01-01 00:00:00")
+    stock_at = (time.perf_counter() - begin) / len(names)
+
+    print(f"{args.moves} движений по {args.products} товарам за {elapsed:.1f} с")
+    print(
+        f"задержка движения: медиана {percentile(latencies, 0.5) * 1000:.3f} мс, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.3f} мс, максимум {latencies[-1] * 1000:.1f} мс"
+    )
+    print(f"строк в stock_snapshots: {snapshots}")
+    print(f"get_stock_at: {stock_at * 1000:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
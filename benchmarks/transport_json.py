@@ -0,0 +1,127 @@
+"""
+Замер JSON-кодека клиента Bot API: стандартный json против orjson
+
+Разбор: синтетические ответы getUpdates (половина - сообщения, половина -
+нажатия кнопок с клавиатурой) разбираются так, как это делает клиент
+(parse_json_payload HTTPXRequest и FastJSONRequest), затем из каждого
+обновления строится Update.de_json. Печатается процессорное время на одно
+обновление.
+
+Кодирование: параметры запроса с клавиатурой экрана списка товаров
+(render.products_list) кодируются так, как их отправляет клиент
+(RequestData.json_parameters стандартным json и через orjson).
+
+    python benchmarks/transport_json.py --payloads 20 --batch 100 --products 1000
+
+Для замера нужны python-telegram-bot и orjson.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot, Update  # noqa: E402
+from telegram.request import HTTPXRequest, RequestData  # noqa: E402
+from telegram.request._requestparameter import RequestParameter  # noqa: E402
+
+import render  # noqa: E402
+import transport  # noqa: E402
+from database import Product  # noqa: E402
+
+CHAT = {"id": 100, "type": "private", "first_name": "Кассир", "username": "cashier"}
+USER = {"id": 100, "is_bot": False, "first_name": "Кассир", "username": "cashier", "language_code": "ru"}
+
+
+def keyboard(rng):
+    return {"inline_keyboard": [
+        [{"text": f"📦 Товар {n}", "callback_data": f"product_view_Товар_{n}"}]
+        for n in rng.sample(range(10_000), 10)
+    ]}
+
+
+def update(rng, update_id):
+    message = {
+        "message_id": update_id, "date": 1767225600 + update_id, "chat": CHAT, "from": USER,
+        "text": rng.choice(["Молоко 3.2% 2", "Хлеб бородинский", "/products", "Сколько осталось сыра?"]),
+    }
+    if update_id % 2:
+        return {"update_id": update_id, "message": message}
+    message["reply_markup"] = keyboard(rng)
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": USER, "chat_instance": "1", "data": "sell_qty_Молоко_1", "message": message,
+    }}
+
+
+def build_payloads(count, batch, rng):
+    """Ответы getUpdates в байтах, как их получает клиент"""
+    return [
+        json.dumps(
+            {"ok": True, "result": [update(rng, n * batch + i) for i in range(batch)]}, ensure_ascii=False
+        ).encode()
+        for n in range(count)
+    ]
+
+
+def parse(payloads, parse_json_payload, bot=None):
+    for payload in payloads:
+        result = parse_json_payload(payload)["result"]
+        if bot is not None:
+            for data in result:
+                Update.de_json(data, bot)
+
+
+def cpu(call, repeats):
+    """Наименьшее процессорное время вызова (секунды)"""
+    best = None
+    for _ in range(repeats):
+        begin = time.process_time()
+        call()
+        elapsed = time.process_time() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", type=int, default=20, help="Ответов getUpdates")
+    parser.add_argument("--batch", type=int, default=100, help="Обновлений в ответе")
+    parser.add_argument("--products", type=int, default=1000, help="Товаров в клавиатуре для кодирования")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    if transport.orjson is None:
+        sys.exit("orjson не установлен")
+
+    payloads = build_payloads(args.payloads, args.batch, random.Random(1))
+    updates = args.payloads * args.batch
+    bot = Bot("123456:BENCHMARK")
+    print(f"{updates} обновлений, {sum(map(len, payloads)) // 1024} КБ")
+    codecs = (("json", HTTPXRequest.parse_json_payload), ("orjson", transport.FastJSONRequest.parse_json_payload))
+    for name, parse_json_payload in codecs:
+        parsed = cpu(lambda: parse(payloads, parse_json_payload), args.repeats)
+        built = cpu(lambda: parse(payloads, parse_json_payload, bot), args.repeats)
+        print(f"  {name}: разбор {parsed / updates * 1e6:.1f} мкс, "
+              f"разбор + Update.de_json {built / updates * 1e6:.0f} мкс на обновление")
+
+    products = [
+        Product(i, f"Товар номер {i:05d}", i % 500, 10_000 + i * 7, None, "2026-01-01 00:00:00", i)
+        for i in range(1, args.products + 1)
+    ]
+    text, markup = render.products_list(products, admin=True, footer=render.back_row("back_main"))
+    data = RequestData([
+        RequestParameter.from_input("chat_id", 100),
+        RequestParameter.from_input("text", text),
+        RequestParameter.from_input("reply_markup", markup),
+    ])
+    print(f"клавиатура списка из {args.products} товаров:")
+    for name, request_data in (("json", data), ("orjson", transport._OrjsonRequestData(data))):
+        encoded = request_data.json_parameters["reply_markup"]
+        seconds = cpu(lambda: request_data.json_parameters, args.repeats * 10)
+        print(f"  {name}: {seconds * 1000:.1f} мс, {len(encoded.encode()) // 1024} КБ")
+
+
+if __name__ == "__main__":
+    main()
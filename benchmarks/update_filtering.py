@@ -0,0 +1,155 @@
+"""
+Замер стоимости входящих обновлений с фильтрацией allowed_updates и без нее
+
+Строит ответ getUpdates, как в оживленной группе: среди обновлений есть
+нужные боту (сообщения, нажатия кнопок, inline-запросы) и ненужные (правки,
+реакции, вступления в чат, посты канала). Для каждого обновления считается
+процессорное время того, что делает бот при получении: разбор JSON,
+Update.de_json и подбор обработчика (check_update обработчиков из
+bot.register_handlers, сами обработчики не вызываются).
+
+Без фильтрации (Update.ALL_TYPES) бот получает все обновления, с фильтрацией
+(get_allowed_updates) Telegram присылает только нужные типы. Печатается
+процессорное время на одно полученное и на одно полезное обновление.
+
+    python benchmarks/update_filtering.py --updates 20000 --relevant-share 0.2
+
+Для замера нужна python-telegram-bot.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import bot  # noqa: E402
+
+GROUP = {"id": -1001234567890, "type": "supergroup", "title": "Склад, смена"}
+CHANNEL = {"id": -1009876543210, "type": "channel", "title": "Новости склада"}
+
+
+def user(rng):
+    user_id = rng.randint(1, 10 ** 9)
+    return {"id": user_id, "is_bot": False, "first_name": "Кассир", "username": f"user{user_id}"}
+
+
+def message(rng, update_id, chat=GROUP, text=None):
+    return {
+        "message_id": update_id, "date": 1767225600 + update_id, "chat": chat, "from": user(rng),
+        "text": text or rng.choice(["Молоко 3.2% 2", "Хлеб", "/products", "Сколько осталось сыра?"]),
+    }
+
+
+def keyboard():
+    return {"inline_keyboard": [[{"text": f"📦 Товар {n}", "callback_data": f"product_{n}"}] for n in range(10)]}
+
+
+# Нужные боту типы обновлений
+def relevant_update(rng, update_id):
+    kind = rng.choice(["message", "message", "callback_query", "inline_query"])
+    if kind == "message":
+        return {"update_id": update_id, "message": message(rng, update_id)}
+    if kind == "callback_query":
+        pressed = message(rng, update_id, chat={"id": 100, "type": "private", "first_name": "Кассир"})
+        pressed["reply_markup"] = keyboard()
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user(rng), "chat_instance": "1", "data": "sell_qty_Молоко_1",
+            "message": pressed,
+        }}
+    return {"update_id": update_id, "inline_query": {
+        "id": str(update_id), "from": user(rng), "query": "молоко", "offset": "",
+    }}
+
+
+# Типы, которые бот не обрабатывает
+def irrelevant_update(rng, update_id):
+    kind = rng.choice(["edited_message", "message_reaction", "chat_member", "channel_post"])
+    if kind == "edited_message":
+        edited = message(rng, update_id)
+        edited["edit_date"] = edited["date"] + 5
+        return {"update_id": update_id, "edited_message": edited}
+    if kind == "message_reaction":
+        return {"update_id": update_id, "message_reaction": {
+            "chat": GROUP, "message_id": update_id - 1, "date": 1767225600, "user": user(rng),
+            "old_reaction": [], "new_reaction": [{"type": "emoji", "emoji": "👍"}],
+        }}
+    if kind == "chat_member":
+        member = user(rng)
+        return {"update_id": update_id, "chat_member": {
+            "chat": GROUP, "from": member, "date": 1767225600,
+            "old_chat_member": {"user": member, "status": "left"},
+            "new_chat_member": {"user": member, "status": "member"},
+        }}
+    return {"update_id": update_id, "channel_post": message(rng, update_id, chat=CHANNEL, text="Поставка в 10:00")}
+
+
+def build_payloads(updates, relevant_share, batch, rng):
+    """Ответы getUpdates по batch обновлений: (без фильтрации, с фильтрацией)"""
+    stream = [
+        relevant_update(rng, update_id) if rng.random() < relevant_share else irrelevant_update(rng, update_id)
+        for update_id in range(1, updates + 1)
+    ]
+    relevant = [update for update in stream if set(update) & {"message", "callback_query", "inline_query"}]
+
+    def responses(items):
+        return [json.dumps({"ok": True, "result": items[i:i + batch]}) for i in range(0, len(items), batch)]
+
+    return responses(stream), responses(relevant), len(relevant)
+
+
+def process(payloads, handlers, application):
+    """Разобрать ответы и подобрать обработчик каждому обновлению; вернуть число обновлений"""
+    count = 0
+    for payload in payloads:
+        for data in json.loads(payload)["result"]:
+            update = Update.de_json(data, application.bot)
+            for handler in handlers:
+                if handler.check_update(update):
+                    break
+            count += 1
+    return count
+
+
+def measure(payloads, handlers, application, repeats):
+    best = None
+    for _ in range(repeats):
+        begin = time.process_time()
+        count = process(payloads, handlers, application)
+        elapsed = time.process_time() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20_000, help="Сколько обновлений приходит без фильтрации")
+    parser.add_argument("--relevant-share", type=float, default=0.2, help="Доля нужных боту обновлений")
+    parser.add_argument("--batch", type=int, default=100, help="Обновлений в одном ответе getUpdates")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    application = Application.builder().token("123456:BENCHMARK").updater(None).build()
+    bot.register_handlers(application)
+    handlers = [handler for group in sorted(application.handlers) for handler in application.handlers[group]]
+    print(f"allowed_updates: {', '.join(bot.get_allowed_updates(application))}")
+
+    unfiltered, filtered, useful = build_payloads(args.updates, args.relevant_share, args.batch, random.Random(1))
+    all_cpu, received = measure(unfiltered, handlers, application, args.repeats)
+    filtered_cpu, _ = measure(filtered, handlers, application, args.repeats)
+
+    print(f"{received} обновлений, из них нужных боту: {useful}")
+    for title, cpu, count in (("без фильтрации", all_cpu, received), ("с фильтрацией", filtered_cpu, useful)):
+        print(
+            f"  {title}: получено {count}, процессор {cpu * 1000:.0f} мс, "
+            f"{cpu / count * 1e6:.0f} мкс на полученное, {cpu / useful * 1e6:.0f} мкс на полезное"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,46 @@
 """
 Телеграм-бот для управления складом
 """
+import time
+
+# Отсчет времени запуска начинается до тяжелых импортов
+STARTED_AT = time.perf_counter()
+
 import os
+import asyncio
 import logging
-from typing import List
-from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
     ContextTypes,
     filters
 )
-from database import Database
+from database import Product
+from storage import Storage, open_storage
+from admin_directory import AdminDirectory, UNKNOWN_USERNAME
+from outbox import Outbox
+from audit import AuditLog
+from update_processor import PerUserUpdateProcessor
+import metrics
+from money import format_money, parse_money
+import render
+from reprice import RepriceRule, parse_reprice_rule
+
+if TYPE_CHECKING:
+    # Модуль прогноза импортируется в main() (см. numpy_available)
+    from forecast import DemandForecaster
 
 # Настройка логирования (должна быть до load_dotenv для корректной обработки ошибок)
 logging.basicConfig(
@@ -22,28 +48,91 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# httpx пишет в лог каждый запрос getUpdates
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# Загрузка переменных окружения
-try:
-    # Явно указываем путь к .env файлу
-    env_path = os.path.join(os.path.dirname(__file__), '.env')
-    if os.path.exists(env_path):
-        load_dotenv(env_path)
-        logger.info(f"Файл .env загружен из: {env_path}")
-    else:
-        load_dotenv()  # Пробуем загрузить из текущей директории
-        logger.info("Попытка загрузить .env из текущей директории")
-except Exception as e:
-    logger.warning(f"Не удалось загрузить .env файл: {e}")
-    logger.info("Продолжаю работу с переменными окружения системы")
 
-# Инициализация базы данных
-db = Database()
+def load_environment():
+    """Загрузка переменных окружения из .env"""
+    from dotenv import load_dotenv
+    
+    try:
+        # Явно указываем путь к .env файлу
+        env_path = os.path.join(os.path.dirname(__file__), '.env')
+        if os.path.exists(env_path):
+            load_dotenv(env_path)
+            logger.debug(f"Файл .env загружен из: {env_path}")
+        else:
+            load_dotenv()  # Пробуем загрузить из текущей директории
+            logger.debug("Попытка загрузить .env из текущей директории")
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить .env файл: {e}")
+        logger.info("Продолжаю работу с переменными окружения системы")
+
+
+# База данных (создается в main() после загрузки переменных окружения).
+# Методы хранилища синхронные и ждут диск и блокировки SQLite, поэтому
+# обработчики вызывают их через asyncio.to_thread: пока запрос одного
+# пользователя ждет базу, цикл событий обрабатывает обновления остальных.
+db: Optional[Storage] = None
+
+# Справочник администраторов в памяти (создается в main() вместе с базой данных)
+admin_directory: Optional[AdminDirectory] = None
+
+# Журнал аудита с записью пачками (создается в main() вместе с базой данных)
+audit_log: Optional[AuditLog] = None
+
+# Часовой пояс, по которому закрывается день кассы (задается в main())
+report_tz = timezone.utc
+
+# Прогноз спроса (создается в main(), None - NumPy не установлен)
+forecaster: Optional["DemandForecaster"] = None
+
+# Очередь исходящих сообщений (лимиты Telegram, склейка правок, повторы)
+outbox = Outbox()
+
+
+async def edit_message(query, text: str, reply_markup=None):
+    """Отредактировать сообщение с кнопками через очередь отправки"""
+    if query.message is None:
+        # Сообщения inline-режима недоступны по chat_id, редактируем напрямую
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+    outbox.edit_message_text(query.message.chat_id, query.message.message_id, text, reply_markup)
+
+
+async def reply(update: Update, text: str, reply_markup=None):
+    """Ответить пользователю через очередь отправки"""
+    outbox.send_message(update.message.chat_id, text, reply_markup)
+
+
+def callback_idempotency_key(query) -> str:
+    """
+    Ключ идемпотентности нажатия кнопки
+    
+    Двойное нажатие приходит двумя callback-запросами с разными ID, но с одной
+    и той же версией сообщения (дата последней правки) и одними данными
+    кнопки, поэтому оба нажатия и повторная доставка обновления дают один
+    ключ. После продажи сообщение правится, и следующее нажатие - новый ключ.
+    У сообщений inline-режима версия неизвестна, для них ключ - ID запроса
+    (защита только от повторной доставки).
+    """
+    message = query.message
+    if message is None:
+        return f"cb:{query.id}"
+    version = int((getattr(message, "edit_date", None) or message.date).timestamp())
+    return f"cb:{message.chat_id}:{message.message_id}:{version}:{query.data}"
+
+
+def message_idempotency_key(update: Update) -> str:
+    """Ключ идемпотентности текстового сообщения (повторная доставка того же сообщения)"""
+    return f"msg:{update.message.chat_id}:{update.message.message_id}"
+
 
 # Функция проверки прав администратора
 def is_admin(user_id: int) -> bool:
     """Проверить, является ли пользователь администратором"""
-    return db.is_admin(user_id)
+    return admin_directory.is_admin(user_id)
 
 
 # === Команды бота ===
@@ -52,11 +141,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user_id = update.message.from_user.id
     admin = is_admin(user_id)
+    if admin:
+        await asyncio.to_thread(admin_directory.note_username, user_id, update.message.from_user.username)
     
     keyboard = [
         [InlineKeyboardButton("📦 Товары", callback_data="menu_products")],
         [InlineKeyboardButton("💰 Касса", callback_data="menu_cashbox")],
-        [InlineKeyboardButton("📊 Список товаров", callback_data="list_products")]
+        [InlineKeyboardButton("📊 Список товаров", callback_data="list_products")],
+        [InlineKeyboardButton("📂 Категории", callback_data="cat_root")]
     ]
     
     if admin:
@@ -65,7 +157,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     role_text = "👑 Администратор" if admin else "👤 Пользователь"
-    await update.message.reply_text(
+    await reply(update,
         f"🏪 Добро пожаловать в систему управления складом!\n\n"
         f"Ваша роль: {role_text}\n\n"
         f"Выберите действие:",
@@ -81,8 +173,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Главное меню
 /help - Справка
 /products - Список всех товаров
+/categories - Товары по категориям
 /cashbox - Баланс кассы
+/history - История кассы, например /history sale 2024-05-01 2024-05-31
 /admin - Добавить первого администратора
+/scan - Найти товар по штрихкоду
+/dashboard - Сводка склада (только админы)
+/audit - Журнал изменений (только админы)
+/reprice - Массовое изменение цен, например /reprice +7% ~1 (только админы)
+/zreport - Итоги дня кассы, например /zreport 2024-05-31 (только админы)
+/forecast - Прогноз спроса и дозаказ, например /forecast Молоко (только админы)
 
 🔧 Функции бота:
 • Добавление товаров (только админы)
@@ -91,7 +191,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Продажа товаров (все пользователи)
 • Управление кассой
     """
-    await update.message.reply_text(help_text)
+    await reply(update, help_text)
 
 
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -99,34 +199,34 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     
     # Проверяем, есть ли уже админы
-    admins = db.get_all_admins()
+    admins = admin_directory.admins()
     
     if len(admins) == 0:
         # Первый пользователь становится админом
-        username = update.message.from_user.username or "Неизвестно"
-        if db.add_admin(user_id, username):
-            await update.message.reply_text(
+        username = update.message.from_user.username or UNKNOWN_USERNAME
+        if await asyncio.to_thread(admin_directory.add, user_id, username, user_id):
+            await reply(update,
                 f"✅ Вы стали первым администратором!\n"
                 f"Ваш ID: {user_id}\n\n"
                 f"Теперь вы можете управлять товарами и добавлять других администраторов."
             )
         else:
-            await update.message.reply_text("❌ Ошибка при добавлении администратора")
+            await reply(update, "❌ Ошибка при добавлении администратора")
     else:
         # Если админы уже есть, проверяем права
         if is_admin(user_id):
             keyboard = [
                 [InlineKeyboardButton("⚙️ Админ-панель", callback_data="admin_panel")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                render.MAIN_MENU_ROW
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            await reply(update,
                 "👑 Вы уже являетесь администратором!\n\n"
                 "Используйте админ-панель для управления.",
                 reply_markup=reply_markup
             )
         else:
-            await update.message.reply_text(
+            await reply(update,
                 "❌ Доступ запрещен!\n\n"
                 "Для добавления администраторов обратитесь к существующему администратору."
             )
@@ -134,54 +234,396 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def products_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /products"""
-    products = db.get_all_products()
+    products = await asyncio.to_thread(db.get_all_products)
     user_id = update.message.from_user.id
     admin = is_admin(user_id)
     
     if not products:
-        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("📦 Товары не найдены", reply_markup=reply_markup)
+        reply_markup = render.MAIN_MENU_MARKUP
+        await reply(update, "📦 Товары не найдены", reply_markup=reply_markup)
         return
     
-    text = "📦 Список товаров:\n\n"
-    keyboard = []
+    text, reply_markup = render.products_list(products, admin, footer=render.MAIN_MENU_ROW)
+    await reply(update, text, reply_markup=reply_markup)
+
+
+async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /scan - поиск товара по штрихкоду"""
+    user_id = update.message.from_user.id
     
-    for product in products:
-        text += (
-            f"• {product['name']}\n"
-            f"  Количество: {product['quantity']} | "
-            f"Цена: {product['price']:.2f} руб.\n\n"
+    # Код можно передать сразу: /scan 4601234567890
+    if context.args:
+        await handle_code_input(update, "scan", " ".join(context.args))
+        return
+    
+    user_states[user_id] = "scan"
+    reply_markup = render.MAIN_MENU_MARKUP
+    await reply(update,
+        "🔎 Поиск товара по штрихкоду\n\n"
+        "Введите штрихкод или артикул, либо отправьте фото штрихкода.\n\n"
+        "Пример: 4601234567890",
+        reply_markup=reply_markup
+    )
+
+
+# Подписи счетчиков для команды /metrics
+METRIC_LABELS = {
+    'messages_sent': "Отправлено сообщений",
+    'edits_skipped_unchanged': "Пропущено правок без изменений",
+    'edits_coalesced': "Склеено правок",
+    'retry_after': "Ответов 429 от Telegram",
+    'audit_entries_written': "Записей в журнале аудита",
+    'idempotent_replays': "Повторов операций без изменений",
+    'inline_queries': "Inline-запросов",
+    'search_cache_hits': "Ответов поиска из кэша",
+    'product_cache_hits': "Товаров из кэша",
+    'product_cache_misses': "Товаров прочитано из БД",
+    'db_lock_retries': "Повторов операций при блокировке БД",
+    'db_lock_wait_ms': "Ожидание блокировок БД, мс",
+    'db_lock_failures': "Операций, не дождавшихся блокировки БД",
+}
+
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /metrics - счетчики работы бота (только админы)"""
+    user_id = update.message.from_user.id
+    if not is_admin(user_id):
+        await reply(update, "❌ Доступ запрещен!")
+        return
+    
+    counters = metrics.snapshot()
+    if not counters:
+        await reply(update, "📈 Счетчики пока пусты")
+        return
+    
+    text = "📈 Счетчики с момента запуска:\n\n"
+    for name, value in sorted(counters.items()):
+        text += f"• {METRIC_LABELS.get(name, name)}: {value}\n"
+    await reply(update, text)
+
+
+async def dashboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /dashboard - сводка по складу (только админы)"""
+    if not is_admin(update.message.from_user.id):
+        await reply(update, "❌ Доступ запрещен!")
+        return
+    
+    text, reply_markup = await asyncio.to_thread(build_dashboard)
+    await reply(update, text, reply_markup=reply_markup)
+
+
+# Подписи операций журнала аудита
+AUDIT_ACTIONS = {
+    'product_add': "Добавлен товар",
+    'quantity': "Количество",
+    'receipt': "Приход",
+    'sale': "Продажа",
+    'price': "Цена",
+    'sku': "Штрихкод",
+    'cash_income': "Пополнение кассы",
+    'cash_expense': "Снятие из кассы",
+    'admin_add': "Добавлен администратор",
+    'admin_remove': "Удален администратор",
+    'reprice': "Массовое изменение цен",
+    'category': "Категория",
+}
+
+# Операции, значения которых - денежные суммы в копейках
+AUDIT_MONEY_ACTIONS = {'price', 'cash_income', 'cash_expense'}
+
+
+def format_audit_entry(entry: dict) -> str:
+    """Строка журнала аудита: время, пользователь, операция, было -> стало"""
+    def value(raw):
+        if raw is None:
+            return "—"
+        if entry['action'] in AUDIT_MONEY_ACTIONS:
+            return f"{format_money(int(raw))} руб."
+        return raw
+    
+    line = f"{entry['created_at']} · {entry['user_id'] or '—'} · {AUDIT_ACTIONS.get(entry['action'], entry['action'])}"
+    if entry['target']:
+        line += f" · {entry['target']}"
+    if entry['before'] is not None or entry['after'] is not None:
+        line += f": {value(entry['before'])} → {value(entry['after'])}"
+    return line
+
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработчик команды /audit - журнал изменений (только админы)
+    
+    /audit - последние операции, /audit <ID> - операции пользователя,
+    /audit <товар> - операции над товаром.
+    """
+    if not is_admin(update.message.from_user.id):
+        await reply(update, "❌ Доступ запрещен!")
+        return
+    
+    # Сначала дописываем буфер, чтобы в выборку попали последние операции
+    await audit_log.flush()
+    
+    argument = " ".join(context.args).strip()
+    if argument.isdigit():
+        entries = await asyncio.to_thread(db.get_audit_log, user_id=int(argument))
+        title = f"📜 Журнал изменений пользователя {argument}"
+    elif argument:
+        entries = await asyncio.to_thread(db.get_audit_log, target=argument)
+        title = f"📜 Журнал изменений: {argument}"
+    else:
+        entries = await asyncio.to_thread(db.get_audit_log)
+        title = "📜 Журнал изменений"
+    
+    if not entries:
+        await reply(update, f"{title}\n\nЗаписей нет")
+        return
+    
+    text = f"{title}\n\n" + "\n".join(format_audit_entry(entry) for entry in entries)
+    await reply(update, text)
+
+
+def format_daily_close(report: dict) -> str:
+    """Текст Z-отчета по итогам дня"""
+    return (
+        f"🧾 Итоги дня {report['day']}\n\n"
+        f"Продаж: {report['sales_count']}\n"
+        f"Выручка: {format_money(report['revenue'])} руб.\n"
+        f"Пополнения: {format_money(report['deposits'])} руб.\n"
+        f"Снятия: {format_money(report['withdrawals'])} руб.\n\n"
+        f"Остаток на начало дня: {format_money(report['opening_balance'])} руб.\n"
+        f"Остаток на конец дня: {format_money(report['closing_balance'])} руб."
+    )
+
+
+# Ожидающие подтверждения массовые изменения цен:
+# user_id -> (правило, часть наименования, ID категории)
+pending_reprices: Dict[int, Tuple[RepriceRule, Optional[str], Optional[int]]] = {}
+
+
+async def reprice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработчик команды /reprice - массовое изменение цен (только админы)
+    
+    /reprice <правило> [| часть наименования], например /reprice +7% ~1 | молоко,
+    или /reprice <правило> | #Категория / Подкатегория - товары категории.
+    Сначала показывается предпросмотр, цены меняются после подтверждения.
+    """
+    user_id = update.message.from_user.id
+    if not is_admin(user_id):
+        await reply(update, "❌ Доступ запрещен!")
+        return
+    
+    rule_text, _, name_filter = " ".join(context.args).partition("|")
+    name_filter = name_filter.strip() or None
+    category_id = None
+    if name_filter and name_filter.startswith("#"):
+        category_id = await asyncio.to_thread(db.find_category, parse_category_path(name_filter[1:]))
+        if category_id is None:
+            await reply(update, f"❌ Категория «{name_filter[1:].strip()}» не найдена")
+            return
+        name_filter = None
+    try:
+        rule = parse_reprice_rule(rule_text)
+    except ValueError as e:
+        await reply(update,
+            f"❌ {e}\n\n"
+            "Формат: /reprice <правило> [| часть наименования]\n"
+            "• +7% / -5% - изменить на процент\n"
+            "• +10 / -2.50 - изменить на сумму в рублях\n"
+            "• ~1 / ~10 / ~0.10 - округлить до суммы\n\n"
+            "• | #Категория - только товары категории\n\n"
+            "Пример: /reprice +7% ~1 | молоко"
         )
-        product_name_encoded = product['name'].replace(" ", "_")
-        keyboard.append([
-            InlineKeyboardButton(
-                f"📦 {product['name']}",
-                callback_data=f"product_view_{product_name_encoded}"
-            )
-        ])
-        # Кнопки быстрого доступа (только для админов - изменение, все - продажа)
-        if admin:
-            keyboard.append([
-                InlineKeyboardButton("📝 Кол-во", callback_data=f"product_qty_{product_name_encoded}"),
-                InlineKeyboardButton("💵 Цена", callback_data=f"product_price_{product_name_encoded}"),
-                InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{product_name_encoded}")
-            ])
-        else:
-            keyboard.append([
-                InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{product_name_encoded}")
-            ])
+        return
     
-    keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    preview = await asyncio.to_thread(db.preview_reprice, rule, name_filter, category_id=category_id)
+    text = f"💲 Изменение цен: {rule.describe()}\n"
+    if category_id is not None:
+        category_path = await asyncio.to_thread(db.get_category_path, category_id)
+        text += f"Категория: {' / '.join(category_path)}\n"
+    if name_filter:
+        text += f"Товары: наименование содержит «{name_filter}»\n"
+    text += f"\nИзменится цен: {preview['count']}\n"
+    if not preview['count']:
+        await reply(update, text)
+        return
     
-    await update.message.reply_text(text, reply_markup=reply_markup)
+    text += "\nНапример:\n"
+    for sample in preview['samples']:
+        text += f"• {sample['name']}: {format_money(sample['price'])} → {format_money(sample['new_price'])} руб.\n"
+    
+    pending_reprices[user_id] = (rule, name_filter, category_id)
+    keyboard = [[
+        InlineKeyboardButton("✅ Применить", callback_data="reprice_apply"),
+        InlineKeyboardButton("❌ Отмена", callback_data="reprice_cancel")
+    ]]
+    await reply(update, text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def handle_reprice_action(query, data: str):
+    """Подтверждение или отмена массового изменения цен"""
+    user_id = query.from_user.id
+    reply_markup = render.MAIN_MENU_MARKUP
+    
+    # Правило забирается один раз: повторное нажатие ничего не меняет
+    pending = pending_reprices.pop(user_id, None)
+    if data == "reprice_cancel":
+        await edit_message(query, "❌ Изменение цен отменено", reply_markup=reply_markup)
+        return
+    if pending is None or not is_admin(user_id):
+        await edit_message(query, "ℹ️ Нет изменения цен, ожидающего подтверждения", reply_markup=reply_markup)
+        return
+    
+    rule, name_filter, category_id = pending
+    count = await asyncio.to_thread(db.bulk_reprice, rule, name_filter, user_id, category_id)
+    await edit_message(query,
+        f"✅ Цены изменены: {rule.describe()}\n"
+        f"Изменено товаров: {count}",
+        reply_markup=reply_markup
+    )
+
+
+def get_daily_report(day: date) -> Optional[dict]:
+    """Итоги дня: готовые из daily_close или посчитанные сейчас, если день пропущен"""
+    report = db.get_daily_close(day)
+    if report is None and day < datetime.now(report_tz).date():
+        report = db.close_day(day, report_tz)
+    return report
+
+
+async def zreport_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /zreport - итоги дня кассы (только админы)"""
+    if not is_admin(update.message.from_user.id):
+        await reply(update, "❌ Доступ запрещен!")
+        return
+    
+    if context.args:
+        try:
+            day = date.fromisoformat(context.args[0])
+        except ValueError:
+            await reply(update, "❌ Укажите дату в формате ГГГГ-ММ-ДД, например /zreport 2024-05-31")
+            return
+    else:
+        day = datetime.now(report_tz).date() - timedelta(days=1)
+    
+    report = await asyncio.to_thread(get_daily_report, day)
+    if report is None:
+        await reply(update, f"🧾 День {day.isoformat()} еще не закрыт")
+        return
+    await reply(update, format_daily_close(report))
+
+
+def format_forecast(forecast) -> str:
+    """Строки прогноза по товару"""
+    days_left = f"{forecast.days_left:.0f} дн." if forecast.days_left is not None else "продаж нет"
+    return (
+        f"• {forecast.name}: заказать {forecast.reorder} шт.\n"
+        f"  Остаток {forecast.stock}, продаж в день ~{forecast.smoothed:.1f} "
+        f"(среднее {forecast.moving_average:.1f}), хватит на {days_left}\n\n"
+    )
+
+
+async def forecast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработчик команды /forecast - прогноз спроса и дозаказ (только админы)
+    
+    /forecast - товары, которые пора дозаказать; /forecast <товар> - прогноз по товару
+    """
+    if not is_admin(update.message.from_user.id):
+        await reply(update, "❌ Доступ запрещен!")
+        return
+    if forecaster is None:
+        await reply(update, "❌ Прогноз недоступен: не установлен NumPy (pip install numpy)")
+        return
+    if forecaster.computed_at is None:
+        await reply(update, "⏳ Прогноз еще считается, попробуйте через минуту")
+        return
+    
+    header = (
+        f"📈 Прогноз спроса на {forecaster.computed_at:%d.%m.%Y %H:%M} "
+        f"(запас на {forecaster.lead_time + forecaster.cover_days} дн.)\n\n"
+    )
+    name = " ".join(context.args).strip()
+    if name:
+        forecast = forecaster.get(name)
+        if forecast is None:
+            await reply(update, f"❌ Товар '{name}' не найден в прогнозе")
+            return
+        await reply(update, header + format_forecast(forecast))
+        return
+    
+    suggestions = forecaster.reorder_list()
+    if not suggestions:
+        await reply(update, header + "✅ Дозаказ не нужен: остатков хватает")
+        return
+    text = header + f"Дозаказать товаров: {forecaster.reorder_count()}, сначала самые срочные:\n\n"
+    text += "".join(format_forecast(forecast) for forecast in suggestions)
+    await reply(update, text)
+
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработчик команды /history - история кассы с отбором
+    
+    /history [sale|income|expense] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]
+    """
+    args = list(context.args)
+    transaction_type = None
+    if args and args[0] in CASHBOX_HISTORY_FILTERS:
+        transaction_type = None if args[0] == "all" else args[0]
+        args = args[1:]
+    try:
+        dates = [date.fromisoformat(arg) for arg in args[:2]]
+    except ValueError:
+        await reply(update,
+            "❌ Формат: /history [sale|income|expense] [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД]\n\n"
+            "Пример: /history sale 2024-05-01 2024-05-31"
+        )
+        return
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    
+    text, reply_markup = await asyncio.to_thread(build_cashbox_history, transaction_type, date_from, date_to)
+    await reply(update, text, reply_markup=reply_markup)
 
 
 async def cashbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /cashbox"""
-    balance = db.get_cashbox_balance()
-    await update.message.reply_text(f"💰 Баланс кассы: {balance:.2f} руб.")
+    balance = await asyncio.to_thread(db.get_cashbox_balance)
+    await reply(update, f"💰 Баланс кассы: {format_money(balance)} руб.")
+
+
+# === Inline-режим ===
+
+# Сколько секунд Telegram может отдавать сохраненный ответ на тот же запрос
+INLINE_CACHE_TIME = 10
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Поиск товаров в inline-режиме: @бот мол
+    
+    Запросы приходят на каждое нажатие клавиши, поэтому ответ собирается из
+    индекса каталога в памяти, без запросов к таблице товаров.
+    """
+    query = update.inline_query
+    metrics.inc("inline_queries")
+    # Поиск может обновить каталог из базы данных
+    products = await asyncio.to_thread(db.catalogue.search, query.query)
+    results = [
+        InlineQueryResultArticle(
+            id=str(product.id),
+            title=product.name,
+            description=f"{format_money(product.price)} руб. · {product.quantity} шт.",
+            input_message_content=InputTextMessageContent(
+                f"📦 {product.name}\n"
+                f"💵 Цена: {format_money(product.price)} руб.\n"
+                f"📊 В наличии: {product.quantity} шт."
+            )
+        )
+        for product in products
+    ]
+    await query.answer(results, cache_time=INLINE_CACHE_TIME)
 
 
 # === Обработчики callback-запросов ===
@@ -199,6 +641,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_cashbox_menu(query)
     elif data == "list_products":
         await show_products_list(query)
+    elif data.startswith("cat_"):
+        await show_category(query, data)
     elif data.startswith("product_view_"):
         # Просмотр конкретного товара
         product_name = data.replace("product_view_", "").replace("_", " ")
@@ -211,41 +655,44 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         product_name_encoded = "_".join(parts[:-1])
         product_name = product_name_encoded.replace("_", " ")
         
-        success, total_price = db.sell_product(product_name, quantity)
+        success, total_price = await asyncio.to_thread(
+            db.sell_product, product_name, quantity, query.from_user.id,
+            idempotency_key=callback_idempotency_key(query)
+        )
         if success:
-            balance = db.get_cashbox_balance()
+            balance = await asyncio.to_thread(db.get_cashbox_balance)
             keyboard = [
                 [InlineKeyboardButton("🛒 Продать еще", callback_data=f"product_sell_{product_name_encoded}")],
                 [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
                 [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                render.MAIN_MENU_ROW
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            await edit_message(query,
                 f"✅ Товар продан:\n"
                 f"Товар: {product_name}\n"
                 f"Количество: {quantity} шт.\n"
-                f"Сумма: {total_price:.2f} руб.\n"
-                f"💰 Баланс кассы: {balance:.2f} руб.",
+                f"Сумма: {format_money(total_price)} руб.\n"
+                f"💰 Баланс кассы: {format_money(balance)} руб.",
                 reply_markup=reply_markup
             )
         else:
-            product = db.get_product(product_name)
+            product = await asyncio.to_thread(db.get_product, product_name)
             keyboard = [
                 [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
                 [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                render.MAIN_MENU_ROW
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             if not product:
-                await query.edit_message_text(
+                await edit_message(query,
                     f"❌ Товар '{product_name}' не найден",
                     reply_markup=reply_markup
                 )
             else:
-                await query.edit_message_text(
+                await edit_message(query,
                     f"❌ Недостаточно товара на складе.\n"
-                    f"Доступно: {product['quantity']} шт.",
+                    f"Доступно: {product.quantity} шт.",
                     reply_markup=reply_markup
                 )
     elif data.startswith("sell_custom_"):
@@ -255,15 +702,11 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = query.from_user.id
         user_states[user_id] = f"sell_product_{product_name}"
         
-        product = db.get_product(product_name)
-        available = product['quantity'] if product else 0
+        product = await asyncio.to_thread(db.get_product, product_name)
+        available = product.quantity if product else 0
         
-        nav_keyboard = [
-            [InlineKeyboardButton("◀️ Назад к выбору", callback_data=f"product_sell_{product_name_encoded}")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-        ]
-        nav_markup = InlineKeyboardMarkup(nav_keyboard)
-        await query.edit_message_text(
+        nav_markup = render.nav_markup(f"product_sell_{product_name_encoded}", "◀️ Назад к выбору")
+        await edit_message(query,
             f"🛒 Продажа товара: {product_name}\n\n"
             f"Доступно: {available} шт.\n"
             f"Введите количество для продажи:\n\n"
@@ -274,12 +717,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Быстрое изменение количества товара - проверка прав
         user_id = query.from_user.id
         if not is_admin(user_id):
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="list_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            reply_markup = render.nav_markup("list_products")
+            await edit_message(query,
                 "❌ Доступ запрещен!\n\n"
                 "Эта функция доступна только администраторам.",
                 reply_markup=reply_markup
@@ -287,12 +726,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         product_name = data.replace("product_qty_", "").replace("_", " ")
         user_states[user_id] = f"update_quantity_{product_name}"
-        nav_keyboard = [
-            [InlineKeyboardButton("◀️ Назад к товару", callback_data=f"product_view_{data.replace('product_qty_', '')}")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-        ]
-        nav_markup = InlineKeyboardMarkup(nav_keyboard)
-        await query.edit_message_text(
+        nav_markup = render.nav_markup(f"product_view_{data.replace('product_qty_', '')}", "◀️ Назад к товару")
+        await edit_message(query,
             f"📝 Изменение количества товара: {product_name}\n\n"
             f"Введите новое количество:\n\n"
             f"Пример: 15",
@@ -302,12 +737,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Быстрое изменение цены товара - проверка прав
         user_id = query.from_user.id
         if not is_admin(user_id):
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="list_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            reply_markup = render.nav_markup("list_products")
+            await edit_message(query,
                 "❌ Доступ запрещен!\n\n"
                 "Эта функция доступна только администраторам.",
                 reply_markup=reply_markup
@@ -315,12 +746,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         product_name = data.replace("product_price_", "").replace("_", " ")
         user_states[user_id] = f"update_price_{product_name}"
-        nav_keyboard = [
-            [InlineKeyboardButton("◀️ Назад к товару", callback_data=f"product_view_{data.replace('product_price_', '')}")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-        ]
-        nav_markup = InlineKeyboardMarkup(nav_keyboard)
-        await query.edit_message_text(
+        nav_markup = render.nav_markup(f"product_view_{data.replace('product_price_', '')}", "◀️ Назад к товару")
+        await edit_message(query,
             f"💵 Изменение цены товара: {product_name}\n\n"
             f"Введите новую цену:\n\n"
             f"Пример: 55.00",
@@ -329,21 +756,21 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data.startswith("product_sell_"):
         # Показать кнопки выбора количества для продажи
         product_name = data.replace("product_sell_", "").replace("_", " ")
-        product = db.get_product(product_name)
+        product = await asyncio.to_thread(db.get_product, product_name)
         
         if not product:
             keyboard = [
                 [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                [InlineKeyboardButton("◀️ Назад", callback_data="back_main")]
+                render.back_row("back_main")
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            await edit_message(query,
                 f"❌ Товар '{product_name}' не найден",
                 reply_markup=reply_markup
             )
             return
         
-        available = product['quantity']
+        available = product.quantity
         product_name_encoded = product_name.replace(" ", "_")
         
         # Создаем кнопки с вариантами количества
@@ -365,26 +792,77 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         quantity_buttons.append([InlineKeyboardButton("✏️ Другое количество", callback_data=f"sell_custom_{product_name_encoded}")])
         
         # Кнопки навигации
-        quantity_buttons.append([
-            InlineKeyboardButton("◀️ Назад к товару", callback_data=f"product_view_{product_name_encoded}"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")
-        ])
+        quantity_buttons.append(render.nav_row(f"product_view_{product_name_encoded}", "◀️ Назад к товару"))
         
         reply_markup = InlineKeyboardMarkup(quantity_buttons)
         
-        await query.edit_message_text(
+        await edit_message(query,
             f"🛒 Продажа товара: {product_name}\n\n"
             f"📊 Доступно: {available} шт.\n"
-            f"💵 Цена: {product['price']:.2f} руб./шт.\n\n"
+            f"💵 Цена: {format_money(product.price)} руб./шт.\n\n"
             f"Выберите количество:",
             reply_markup=reply_markup
         )
+    elif data.startswith("product_moves_"):
+        product_name = data.replace("product_moves_", "").replace("_", " ")
+        await show_product_moves(query, product_name)
+    elif data.startswith("product_prices_"):
+        product_name = data.replace("product_prices_", "").replace("_", " ")
+        await show_price_history(query, product_name)
+    elif data.startswith("product_sku_"):
+        # Назначение штрихкода товару - проверка прав
+        user_id = query.from_user.id
+        product_name_encoded = data.replace("product_sku_", "")
+        if not is_admin(user_id):
+            reply_markup = render.nav_markup(f"product_view_{product_name_encoded}")
+            await edit_message(query,
+                "❌ Доступ запрещен!\n\n"
+                "Эта функция доступна только администраторам.",
+                reply_markup=reply_markup
+            )
+            return
+        product_name = product_name_encoded.replace("_", " ")
+        user_states[user_id] = f"update_sku_{product_name}"
+        nav_markup = render.nav_markup(f"product_view_{product_name_encoded}", "◀️ Назад к товару")
+        await edit_message(query,
+            f"🏷 Штрихкод товара: {product_name}\n\n"
+            f"Введите штрихкод или артикул, либо отправьте фото штрихкода.\n"
+            f"Чтобы убрать штрихкод, отправьте «-».\n\n"
+            f"Пример: 4601234567890",
+            reply_markup=nav_markup
+        )
+    elif data.startswith("product_category_"):
+        # Перенос товара в категорию - проверка прав
+        user_id = query.from_user.id
+        product_name_encoded = data.replace("product_category_", "")
+        nav_markup = render.nav_markup(f"product_view_{product_name_encoded}", "◀️ Назад к товару")
+        if not is_admin(user_id):
+            await edit_message(query,
+                "❌ Доступ запрещен!\n\n"
+                "Эта функция доступна только администраторам.",
+                reply_markup=nav_markup
+            )
+            return
+        product_name = product_name_encoded.replace("_", " ")
+        user_states[user_id] = f"set_category_{product_name}"
+        await edit_message(query,
+            f"📂 Категория товара: {product_name}\n\n"
+            f"Введите категорию; подкатегории разделяются «/». "
+            f"Недостающие категории будут созданы.\n"
+            f"Чтобы убрать товар из категории, отправьте «-».\n\n"
+            f"Пример: Молочные продукты / Сыры",
+            reply_markup=nav_markup
+        )
     elif data.startswith("product_"):
         await handle_product_action(query, data)
     elif data.startswith("cashbox_"):
         await handle_cashbox_action(query, data)
+    elif data.startswith("reprice_"):
+        await handle_reprice_action(query, data)
     elif data == "admin_panel":
         await show_admin_panel(query)
+    elif data == "dashboard":
+        await show_dashboard(query)
     elif data.startswith("admin_add_"):
         await handle_admin_add(query, data)
     elif data.startswith("admin_remove_"):
@@ -393,33 +871,21 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_main_menu(query)
 
 
-async def show_product_detail(query, product_name: str):
-    """Показать детальную информацию о товаре с кнопками действий"""
-    product = db.get_product(product_name)
-    user_id = query.from_user.id
-    admin = is_admin(user_id)
-    
-    if not product:
-        keyboard = [
-            [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_main")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            f"❌ Товар '{product_name}' не найден",
-            reply_markup=reply_markup
-        )
-        return
-    
+def build_product_detail(product: Product, admin: bool):
+    """Собрать текст и кнопки карточки товара"""
     text = (
-        f"📦 Товар: {product['name']}\n\n"
-        f"📊 Количество: {product['quantity']}\n"
-        f"💵 Цена: {product['price']:.2f} руб.\n"
-        f"💰 Общая стоимость: {product['quantity'] * product['price']:.2f} руб.\n"
+        f"📦 Товар: {product.name}\n\n"
+        f"📊 Количество: {product.quantity}\n"
+        f"💵 Цена: {format_money(product.price)} руб.\n"
+        f"💰 Общая стоимость: {format_money(product.quantity * product.price)} руб.\n"
     )
+    if product.sku:
+        text += f"🏷 Штрихкод: {product.sku}\n"
+    if product.category_id:
+        text += f"📂 Категория: {' / '.join(db.get_category_path(product.category_id))}\n"
     
     # Кнопки для быстрых действий с товаром
-    product_name_encoded = product['name'].replace(" ", "_")
+    product_name_encoded = product.name.replace(" ", "_")
     keyboard = []
     
     # Только админы могут изменять количество и цену
@@ -428,6 +894,14 @@ async def show_product_detail(query, product_name: str):
             InlineKeyboardButton("📝 Изменить количество", callback_data=f"product_qty_{product_name_encoded}"),
             InlineKeyboardButton("💵 Изменить цену", callback_data=f"product_price_{product_name_encoded}")
         ])
+        keyboard.append([
+            InlineKeyboardButton("📜 Движение товара", callback_data=f"product_moves_{product_name_encoded}"),
+            InlineKeyboardButton("📈 История цен", callback_data=f"product_prices_{product_name_encoded}")
+        ])
+        keyboard.append([
+            InlineKeyboardButton("🏷 Штрихкод", callback_data=f"product_sku_{product_name_encoded}"),
+            InlineKeyboardButton("📂 Категория", callback_data=f"product_category_{product_name_encoded}")
+        ])
     
     # Все могут продавать
     keyboard.append([
@@ -438,9 +912,111 @@ async def show_product_detail(query, product_name: str):
         InlineKeyboardButton("📦 Список товаров", callback_data="list_products"),
         InlineKeyboardButton("◀️ Назад", callback_data="back_main")
     ])
-    reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(text, reply_markup=reply_markup)
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def show_product_detail(query, product_name: str):
+    """Показать детальную информацию о товаре с кнопками действий"""
+    product = await asyncio.to_thread(db.get_product, product_name)
+    user_id = query.from_user.id
+    
+    if not product:
+        keyboard = [
+            [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
+            render.back_row("back_main")
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await edit_message(query,
+            f"❌ Товар '{product_name}' не найден",
+            reply_markup=reply_markup
+        )
+        return
+    
+    text, reply_markup = await asyncio.to_thread(build_product_detail, product, is_admin(user_id))
+    await edit_message(query, text, reply_markup=reply_markup)
+
+
+# Подписи типов движения товара
+STOCK_MOVE_TYPES = {
+    'initial': "Начальный остаток",
+    'receipt': "Приход",
+    'sale': "Продажа",
+    'correction': "Корректировка",
+}
+
+
+async def show_product_moves(query, product_name: str):
+    """Показать журнал движения товара (только для админов)"""
+    user_id = query.from_user.id
+    product_name_encoded = product_name.replace(" ", "_")
+    
+    if not is_admin(user_id):
+        reply_markup = render.back_markup(f"product_view_{product_name_encoded}")
+        await edit_message(query,
+            "❌ Доступ запрещен!\n\n"
+            "Эта функция доступна только администраторам.",
+            reply_markup=reply_markup
+        )
+        return
+    
+    moves = await asyncio.to_thread(db.get_stock_moves, product_name, 10)
+    reply_markup = render.nav_markup(f"product_view_{product_name_encoded}", "◀️ Назад к товару")
+    
+    if not moves:
+        await edit_message(query,
+            f"📜 Движение товара {product_name} отсутствует",
+            reply_markup=reply_markup
+        )
+        return
+    
+    text = f"📜 Движение товара: {product_name}\n\n"
+    for move in moves:
+        delta = move['delta']
+        sign = "+" if delta > 0 else ""
+        move_type = STOCK_MOVE_TYPES.get(move['move_type'], move['move_type'])
+        author = f" (ID: {move['user_id']})" if move['user_id'] else ""
+        text += (
+            f"{sign}{delta} шт. - {move_type}{author}\n"
+            f"  {move['created_at']}\n\n"
+        )
+    
+    await edit_message(query, text, reply_markup=reply_markup)
+
+
+async def show_price_history(query, product_name: str):
+    """Показать историю цен товара (только для админов)"""
+    user_id = query.from_user.id
+    product_name_encoded = product_name.replace(" ", "_")
+    
+    if not is_admin(user_id):
+        reply_markup = render.back_markup(f"product_view_{product_name_encoded}")
+        await edit_message(query,
+            "❌ Доступ запрещен!\n\n"
+            "Эта функция доступна только администраторам.",
+            reply_markup=reply_markup
+        )
+        return
+    
+    prices = await asyncio.to_thread(db.get_price_history, product_name, 10)
+    reply_markup = render.nav_markup(f"product_view_{product_name_encoded}", "◀️ Назад к товару")
+    
+    if not prices:
+        await edit_message(query,
+            f"📈 История цен товара {product_name} пуста",
+            reply_markup=reply_markup
+        )
+        return
+    
+    text = f"📈 История цен: {product_name}\n\n"
+    for record in prices:
+        author = f" (ID: {record['user_id']})" if record['user_id'] else ""
+        text += (
+            f"{format_money(record['price'])} руб.{author}\n"
+            f"  с {record['valid_from'][:19]}\n\n"
+        )
+    
+    await edit_message(query, text, reply_markup=reply_markup)
 
 
 async def show_main_menu(query):
@@ -453,7 +1029,8 @@ async def show_main_menu(query):
     keyboard = [
         [InlineKeyboardButton("📦 Товары", callback_data="menu_products")],
         [InlineKeyboardButton("💰 Касса", callback_data="menu_cashbox")],
-        [InlineKeyboardButton("📊 Список товаров", callback_data="list_products")]
+        [InlineKeyboardButton("📊 Список товаров", callback_data="list_products")],
+        [InlineKeyboardButton("📂 Категории", callback_data="cat_root")]
     ]
     
     if admin:
@@ -462,7 +1039,7 @@ async def show_main_menu(query):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     role_text = "👑 Администратор" if admin else "👤 Пользователь"
-    await query.edit_message_text(
+    await edit_message(query,
         f"🏪 Главное меню\n\nВаша роль: {role_text}\n\nВыберите действие:",
         reply_markup=reply_markup
     )
@@ -485,12 +1062,12 @@ async def show_products_menu(query):
     
     # Все могут продавать
     keyboard.append([InlineKeyboardButton("🛒 Продать товар", callback_data="product_sell")])
-    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_main")])
+    keyboard.append(render.back_row("back_main"))
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     role_text = "👑 Администратор" if admin else "👤 Пользователь"
-    await query.edit_message_text(
+    await edit_message(query,
         f"📦 Управление товарами\n\nВаша роль: {role_text}\n\nВыберите действие:",
         reply_markup=reply_markup
     )
@@ -502,18 +1079,20 @@ async def show_cashbox_menu(query):
     user_id = query.from_user.id
     user_states.pop(user_id, None)
     
-    balance = db.get_cashbox_balance()
+    balance = await asyncio.to_thread(db.get_cashbox_balance)
     
     keyboard = [
         [InlineKeyboardButton("➕ Пополнить", callback_data="cashbox_add")],
         [InlineKeyboardButton("➖ Снять", callback_data="cashbox_withdraw")],
-        [InlineKeyboardButton("📜 История", callback_data="cashbox_history")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="back_main")]
+        [InlineKeyboardButton("📜 История", callback_data="cashbox_history")]
     ]
+    if is_admin(user_id):
+        keyboard.append([InlineKeyboardButton("🧾 Итоги вчера", callback_data="cashbox_zreport")])
+    keyboard.append(render.back_row("back_main"))
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(
-        f"💰 Управление кассой\n\nТекущий баланс: {balance:.2f} руб.\n\nВыберите действие:",
+    await edit_message(query,
+        f"💰 Управление кассой\n\nТекущий баланс: {format_money(balance)} руб.\n\nВыберите действие:",
         reply_markup=reply_markup
     )
 
@@ -523,18 +1102,15 @@ async def show_admin_panel(query):
     user_id = query.from_user.id
     
     if not is_admin(user_id):
-        keyboard = [
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_main")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
+        reply_markup = render.BACK_MAIN_MARKUP
+        await edit_message(query,
             "❌ Доступ запрещен!\n\n"
             "Эта функция доступна только администраторам.",
             reply_markup=reply_markup
         )
         return
     
-    admins = db.get_all_admins()
+    admins = admin_directory.admins()
     text = "⚙️ Админ-панель\n\n"
     text += f"👑 Администраторов: {len(admins)}\n\n"
     
@@ -544,16 +1120,54 @@ async def show_admin_panel(query):
     if admins:
         text += "Список администраторов:\n"
         for admin in admins:
-            username = admin.get('username', 'Неизвестно')
-            text += f"• ID: {admin['user_id']} (@{username})\n"
+            text += f"• ID: {admin['user_id']} ({admin_directory.display_name(admin)})\n"
     
+    keyboard.append([InlineKeyboardButton("📊 Сводка склада", callback_data="dashboard")])
     keyboard.append([InlineKeyboardButton("➕ Добавить админа", callback_data="admin_add_menu")])
     if len(admins) > 1:  # Нельзя удалить последнего админа
         keyboard.append([InlineKeyboardButton("➖ Удалить админа", callback_data="admin_remove_menu")])
-    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_main")])
+    keyboard.append(render.back_row("back_main"))
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(text, reply_markup=reply_markup)
+    await edit_message(query, text, reply_markup=reply_markup)
+
+
+def build_dashboard():
+    """Собрать текст и кнопки сводки по складу"""
+    summary = db.get_inventory_summary()
+    top_products = db.get_top_value_products(5)
+    
+    text = (
+        "📊 Сводка склада\n\n"
+        f"📦 Наименований: {summary['product_count']}\n"
+        f"📊 Единиц товара: {summary['total_quantity']}\n"
+        f"💰 Стоимость остатков: {format_money(summary['total_value'])} руб.\n"
+        f"❗️ Нет в наличии: {summary['out_of_stock']}\n"
+    )
+    if top_products:
+        text += "\n🏆 Самые дорогие остатки:\n"
+        for product in top_products:
+            text += f"• {product.name}: {format_money(product.quantity * product.price)} руб.\n"
+    
+    keyboard = [
+        [InlineKeyboardButton("🔄 Обновить", callback_data="dashboard")],
+        render.back_row("admin_panel")
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def show_dashboard(query):
+    """Показать сводку по складу (только для админов)"""
+    if not is_admin(query.from_user.id):
+        reply_markup = render.BACK_MAIN_MARKUP
+        await edit_message(query,
+            "❌ Доступ запрещен!",
+            reply_markup=reply_markup
+        )
+        return
+    
+    text, reply_markup = await asyncio.to_thread(build_dashboard)
+    await edit_message(query, text, reply_markup=reply_markup)
 
 
 async def handle_admin_add(query, data: str):
@@ -561,25 +1175,22 @@ async def handle_admin_add(query, data: str):
     user_id = query.from_user.id
     
     if not is_admin(user_id):
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_main")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
+        reply_markup = render.BACK_MAIN_MARKUP
+        await edit_message(query,
             "❌ Доступ запрещен!",
             reply_markup=reply_markup
         )
         return
     
     if data == "admin_add_menu":
-        await query.edit_message_text(
+        await edit_message(query,
             "➕ Добавление администратора\n\n"
             "Отправьте ID пользователя Telegram, которого хотите сделать администратором.\n\n"
             "Для получения ID пользователя:\n"
             "1. Попросите пользователя написать боту @userinfobot\n"
             "2. Или используйте @getidsbot\n\n"
             "Введите ID пользователя:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")]
-            ])
+            reply_markup=render.back_markup("admin_panel")
         )
         user_states[user_id] = "admin_add"
         return
@@ -590,20 +1201,18 @@ async def handle_admin_remove(query, data: str):
     user_id = query.from_user.id
     
     if not is_admin(user_id):
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_main")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
+        reply_markup = render.BACK_MAIN_MARKUP
+        await edit_message(query,
             "❌ Доступ запрещен!",
             reply_markup=reply_markup
         )
         return
     
     if data == "admin_remove_menu":
-        admins = db.get_all_admins()
+        admins = admin_directory.admins()
         if len(admins) <= 1:
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            reply_markup = render.back_markup("admin_panel")
+            await edit_message(query,
                 "❌ Нельзя удалить последнего администратора!",
                 reply_markup=reply_markup
             )
@@ -614,40 +1223,36 @@ async def handle_admin_remove(query, data: str):
         
         for admin in admins:
             if admin['user_id'] != user_id:  # Нельзя удалить себя
-                username = admin.get('username', 'Неизвестно')
                 keyboard.append([
                     InlineKeyboardButton(
-                        f"👤 ID: {admin['user_id']} (@{username})",
+                        f"👤 ID: {admin['user_id']} ({admin_directory.display_name(admin)})",
                         callback_data=f"admin_remove_{admin['user_id']}"
                     )
                 ])
         
-        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")])
+        keyboard.append(render.back_row("admin_panel"))
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        await edit_message(query, text, reply_markup=reply_markup)
     elif data.startswith("admin_remove_"):
         admin_id = int(data.replace("admin_remove_", ""))
         
         if admin_id == user_id:
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            reply_markup = render.back_markup("admin_panel")
+            await edit_message(query,
                 "❌ Нельзя удалить самого себя!",
                 reply_markup=reply_markup
             )
             return
         
-        if db.remove_admin(admin_id):
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+        if await asyncio.to_thread(admin_directory.remove, admin_id, user_id):
+            reply_markup = render.back_markup("admin_panel")
+            await edit_message(query,
                 f"✅ Администратор (ID: {admin_id}) удален",
                 reply_markup=reply_markup
             )
         else:
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
+            reply_markup = render.back_markup("admin_panel")
+            await edit_message(query,
                 "❌ Администратор не найден",
                 reply_markup=reply_markup
             )
@@ -655,54 +1260,155 @@ async def handle_admin_remove(query, data: str):
 
 async def show_products_list(query):
     """Показать список товаров с кнопками"""
-    products = db.get_all_products()
+    products = await asyncio.to_thread(db.get_all_products)
     
     if not products:
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_main")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
+        reply_markup = render.BACK_MAIN_MARKUP
+        await edit_message(query,
             "📦 Товары не найдены",
             reply_markup=reply_markup
         )
         return
     
-    text = "📦 Список товаров:\n\n"
+    admin = is_admin(query.from_user.id)
+    text, reply_markup = render.products_list(products, admin, footer=render.back_row("back_main"))
+    await edit_message(query, text, reply_markup=reply_markup)
+
+
+def parse_category_path(text: str) -> List[str]:
+    """Разобрать путь категории «Молочные продукты / Сыры» в список наименований"""
+    return [name.strip() for name in text.split("/") if name.strip()]
+
+
+def build_category_screen(data: str, admin: bool):
+    """
+    Собрать экран категории: подкатегории со счетчиками и товары категории
+    
+    Экран читает только одну категорию: ее подкатегории (по индексу parent_id)
+    и ее собственные товары (по индексу category_id), а не весь каталог.
+    
+    Args:
+        data: cat_root (верхний уровень), cat_none (без категории) или cat_<id>
+        admin: Показывать ли кнопки администратора
+    """
+    key = data.replace("cat_", "")
+    category = None
+    if key == "root":
+        children = db.get_child_categories(None)
+        products = []
+        text = "📂 Категории\n\n"
+        back = "back_main"
+    elif key == "none":
+        children = []
+        products = db.get_category_products(None)
+        text = "📂 Без категории\n\n"
+        back = "cat_root"
+    else:
+        category = db.get_category(int(key))
+        if category is None:
+            return "❌ Категория не найдена", InlineKeyboardMarkup(
+                [[InlineKeyboardButton("📂 Категории", callback_data="cat_root")]]
+            )
+        children = db.get_child_categories(category['id'])
+        products = db.get_category_products(category['id'])
+        text = (
+            f"📂 {' / '.join(db.get_category_path(category['id']))}\n"
+            f"Товаров (с подкатегориями): {category['product_count']}\n\n"
+        )
+        back = f"cat_{category['parent_id']}" if category['parent_id'] else "cat_root"
+    
     keyboard = []
+    for child in children:
+        keyboard.append([InlineKeyboardButton(
+            f"📂 {child['name']} ({child['product_count']})",
+            callback_data=f"cat_{child['id']}"
+        )])
+    if key == "root":
+        uncategorized = db.count_uncategorized_products()
+        if uncategorized:
+            keyboard.append([InlineKeyboardButton(f"📦 Без категории ({uncategorized})", callback_data="cat_none")])
+        if not children and not uncategorized:
+            text += "Товары не найдены"
+        elif not children:
+            text += "Категорий пока нет"
+            if admin:
+                text += " - назначьте категорию в карточке товара"
     
     for product in products:
-        # Добавляем информацию о товаре в текст
         text += (
-            f"• {product['name']}\n"
-            f"  Количество: {product['quantity']} | "
-            f"Цена: {product['price']:.2f} руб.\n\n"
+            f"• {product.name}\n"
+            f"  Количество: {product.quantity} | "
+            f"Цена: {format_money(product.price)} руб.\n"
         )
-        # Добавляем кнопки для каждого товара
-        product_name_encoded = product['name'].replace(" ", "_")
-        keyboard.append([
-            InlineKeyboardButton(
-                f"📦 {product['name']}",
-                callback_data=f"product_view_{product_name_encoded}"
-            )
-        ])
-        # Кнопки быстрого доступа (только для админов - изменение, все - продажа)
-        user_id = query.from_user.id
-        admin = is_admin(user_id)
-        if admin:
-            keyboard.append([
-                InlineKeyboardButton("📝 Кол-во", callback_data=f"product_qty_{product_name_encoded}"),
-                InlineKeyboardButton("💵 Цена", callback_data=f"product_price_{product_name_encoded}"),
-                InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{product_name_encoded}")
-            ])
-        else:
-            keyboard.append([
-                InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{product_name_encoded}")
-            ])
-    
-    # Добавляем кнопку "Назад"
-    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_main")])
+        keyboard.append([InlineKeyboardButton(
+            f"📦 {product.name}",
+            callback_data=f"product_view_{product.name.replace(' ', '_')}"
+        )])
+    if key != "root" and not children and not products:
+        text += "Пусто"
+    
+    keyboard.append(render.nav_row(back))
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def show_category(query, data: str):
+    """Показать экран категории"""
+    text, reply_markup = await asyncio.to_thread(build_category_screen, data, is_admin(query.from_user.id))
+    await edit_message(query, text, reply_markup=reply_markup)
+
+
+async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /categories - товары по категориям"""
+    text, reply_markup = await asyncio.to_thread(
+        build_category_screen, "cat_root", is_admin(update.message.from_user.id)
+    )
+    await reply(update, text, reply_markup=reply_markup)
+
+
+async def handle_category_input(update: Update, state: str, text: str):
+    """Обработать ввод категории товара"""
+    user_id = update.message.from_user.id
+    product_name = state.replace("set_category_", "")
+    product_name_encoded = product_name.replace(" ", "_")
+    keyboard = [
+        [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
+        render.MAIN_MENU_ROW
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(text, reply_markup=reply_markup)
+    if not is_admin(user_id):
+        user_states.pop(user_id, None)
+        await reply(update,
+            "❌ Доступ запрещен!\n\n"
+            "Эта функция доступна только администраторам.",
+            reply_markup=reply_markup
+        )
+        return
+    
+    if text == "-":
+        category_id = None
+    else:
+        names = parse_category_path(text)
+        if not names:
+            await reply(update, "❌ Введите категорию, например: Молочные продукты / Сыры", reply_markup=reply_markup)
+            return
+        category_id = await asyncio.to_thread(db.find_category, names, create=True)
+    
+    if await asyncio.to_thread(db.update_product_category, product_name, category_id, user_id):
+        user_states.pop(user_id, None)
+        if category_id:
+            category_text = " / ".join(await asyncio.to_thread(db.get_category_path, category_id))
+        else:
+            category_text = "не задана"
+        await reply(update,
+            f"✅ Категория обновлена:\n"
+            f"Товар: {product_name}\n"
+            f"Категория: {category_text}",
+            reply_markup=reply_markup
+        )
+    else:
+        user_states.pop(user_id, None)
+        await reply(update, f"❌ Товар '{product_name}' не найден", reply_markup=reply_markup)
 
 
 async def handle_product_action(query, data: str):
@@ -712,12 +1418,8 @@ async def handle_product_action(query, data: str):
     
     # Проверка прав для админских действий
     if data in ["product_add", "product_quantity", "product_price"] and not admin:
-        keyboard = [
-            [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
+        reply_markup = render.nav_markup("menu_products")
+        await edit_message(query,
             "❌ Доступ запрещен!\n\n"
             "Эта функция доступна только администраторам.",
             reply_markup=reply_markup
@@ -725,15 +1427,11 @@ async def handle_product_action(query, data: str):
         return
     
     # Кнопки навигации для всех действий
-    nav_keyboard = [
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-    ]
-    nav_markup = InlineKeyboardMarkup(nav_keyboard)
+    nav_markup = render.nav_markup("menu_products")
     
     if data == "product_add":
         user_states[user_id] = "add_product"
-        await query.edit_message_text(
+        await edit_message(query,
             "➕ Добавление товара\n\n"
             "Введите данные в формате:\n"
             "наименование товара , количество , цена\n\n"
@@ -742,138 +1440,144 @@ async def handle_product_action(query, data: str):
         )
         return
     
-    elif data == "product_quantity":
+    elif data in ("product_quantity", "product_price", "product_sell"):
         # Показать список товаров для выбора
-        products = db.get_all_products()
+        products = await asyncio.to_thread(db.get_all_products)
         
         if not products:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "❌ Товары не найдены",
-                reply_markup=reply_markup
-            )
+            await edit_message(query, "❌ Товары не найдены", reply_markup=nav_markup)
             return
         
-        text = "📝 Выберите товар для изменения количества:\n\n"
-        keyboard = []
-        
-        for product in products:
-            product_name_encoded = product['name'].replace(" ", "_")
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"📦 {product['name']} (текущее: {product['quantity']})",
-                    callback_data=f"product_qty_{product_name_encoded}"
-                )
-            ])
-        
-        keyboard.append([
-            InlineKeyboardButton("◀️ Назад", callback_data="menu_products"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")
-        ])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text + "Выберите товар из списка:",
-            reply_markup=reply_markup
-        )
-        return
-    
-    elif data == "product_price":
-        # Показать список товаров для выбора
-        products = db.get_all_products()
+        if data == "product_quantity":
+            text = "📝 Выберите товар для изменения количества:\n\n"
+            label = render.PICK_QUANTITY_LABEL
+        elif data == "product_price":
+            text = "💵 Выберите товар для изменения цены:\n\n"
+            label = render.PICK_PRICE_LABEL
+        else:
+            text = "🛒 Выберите товар для продажи:\n\n"
+            label = render.PICK_SELL_LABEL
+            # Показываем только товары с количеством > 0
+            products = [product for product in products if product.quantity > 0]
         
-        if not products:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "❌ Товары не найдены",
-                reply_markup=reply_markup
-            )
+        # callback_data кнопок совпадает с действием: product_qty_, product_price_, product_sell_
+        prefix = "product_qty_" if data == "product_quantity" else data + "_"
+        reply_markup = render.product_picker(products, label, prefix, "menu_products")
+        if reply_markup is None:
+            await edit_message(query, "❌ Нет товаров в наличии для продажи", reply_markup=nav_markup)
             return
         
-        text = "💵 Выберите товар для изменения цены:\n\n"
-        keyboard = []
-        
-        for product in products:
-            product_name_encoded = product['name'].replace(" ", "_")
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"📦 {product['name']} (текущая: {product['price']:.2f} руб.)",
-                    callback_data=f"product_price_{product_name_encoded}"
-                )
-            ])
-        
-        keyboard.append([
-            InlineKeyboardButton("◀️ Назад", callback_data="menu_products"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")
-        ])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
+        await edit_message(query,
             text + "Выберите товар из списка:",
             reply_markup=reply_markup
         )
         return
+
+
+# Отбор истории кассы по типу операции: код в callback_data -> подпись кнопки
+CASHBOX_HISTORY_FILTERS = {
+    'all': "Все",
+    'sale': "Продажи",
+    'income': "Пополнения",
+    'expense': "Снятия",
+}
+
+CASHBOX_HISTORY_PAGE_SIZE = 10
+
+
+def cashbox_history_callback(transaction_type: Optional[str], date_from: Optional[date],
+                             date_to: Optional[date], before_id: Optional[int] = None,
+                             after_id: Optional[int] = None) -> str:
+    """
+    callback_data страницы истории кассы
     
-    elif data == "product_sell":
-        # Показать список товаров для выбора
-        products = db.get_all_products()
-        
-        if not products:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "❌ Товары не найдены",
-                reply_markup=reply_markup
-            )
-            return
-        
-        text = "🛒 Выберите товар для продажи:\n\n"
-        keyboard = []
-        
-        for product in products:
-            if product['quantity'] > 0:  # Показываем только товары с количеством > 0
-                product_name_encoded = product['name'].replace(" ", "_")
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"📦 {product['name']} ({product['quantity']} шт.)",
-                        callback_data=f"product_sell_{product_name_encoded}"
-                    )
-                ])
-        
-        if not keyboard:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "❌ Нет товаров в наличии для продажи",
-                reply_markup=reply_markup
-            )
-            return
-        
-        keyboard.append([
-            InlineKeyboardButton("◀️ Назад", callback_data="menu_products"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")
-        ])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text + "Выберите товар из списка:",
-            reply_markup=reply_markup
+    Формат: cashbox_h_<тип>_<с>_<по>_<направление>_<id>, где даты - ГГГГММДД
+    или "-", направление - o (старее), n (новее) или "-" (первая страница).
+    """
+    date_from_text = date_from.strftime("%Y%m%d") if date_from else "-"
+    date_to_text = date_to.strftime("%Y%m%d") if date_to else "-"
+    if before_id is not None:
+        direction, cursor_id = "o", before_id
+    elif after_id is not None:
+        direction, cursor_id = "n", after_id
+    else:
+        direction, cursor_id = "-", 0
+    return f"cashbox_h_{transaction_type or 'all'}_{date_from_text}_{date_to_text}_{direction}_{cursor_id}"
+
+
+def parse_cashbox_history_callback(data: str) -> dict:
+    """Разобрать callback_data страницы истории кассы (см. cashbox_history_callback)"""
+    _, _, transaction_type, date_from_text, date_to_text, direction, cursor_id = data.split("_")
+    
+    def parse_date(text):
+        return None if text == "-" else datetime.strptime(text, "%Y%m%d").date()
+    
+    return {
+        'transaction_type': None if transaction_type == "all" else transaction_type,
+        'date_from': parse_date(date_from_text),
+        'date_to': parse_date(date_to_text),
+        'before_id': int(cursor_id) if direction == "o" else None,
+        'after_id': int(cursor_id) if direction == "n" else None,
+    }
+
+
+def build_cashbox_history(transaction_type: Optional[str] = None, date_from: Optional[date] = None,
+                          date_to: Optional[date] = None, before_id: Optional[int] = None,
+                          after_id: Optional[int] = None):
+    """Собрать страницу истории кассы с отбором и кнопками «старее / новее»"""
+    limit = CASHBOX_HISTORY_PAGE_SIZE
+    # Одна лишняя строка показывает, есть ли еще операции в направлении листания
+    history = db.get_cashbox_history(
+        limit + 1, transaction_type, date_from, date_to, report_tz,
+        before_id=before_id, after_id=after_id
+    )
+    if after_id is not None:
+        has_newer = len(history) > limit
+        history = history[-limit:]
+        has_older = True
+        if not history:
+            # Новее ничего нет - показываем первую страницу
+            return build_cashbox_history(transaction_type, date_from, date_to)
+    else:
+        has_older = len(history) > limit
+        history = history[:limit]
+        has_newer = before_id is not None
+    
+    text = "📜 История операций"
+    if transaction_type:
+        text += f" ({CASHBOX_HISTORY_FILTERS.get(transaction_type, transaction_type).lower()})"
+    if date_from or date_to:
+        period_from = date_from.isoformat() if date_from else "…"
+        period_to = date_to.isoformat() if date_to else "…"
+        text += f"\nПериод: {period_from} — {period_to}"
+    text += ":\n\n"
+    text += render.cashbox_lines(history) if history else "Операций нет"
+    
+    keyboard = [[
+        InlineKeyboardButton(
+            f"• {label}" if (code == "all" and not transaction_type) or code == transaction_type else label,
+            callback_data=cashbox_history_callback(None if code == "all" else code, date_from, date_to)
         )
-        return
+        for code, label in CASHBOX_HISTORY_FILTERS.items()
+    ]]
+    navigation = []
+    if has_older:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Старее",
+            callback_data=cashbox_history_callback(transaction_type, date_from, date_to,
+                                                   before_id=history[-1]['id'])
+        ))
+    if has_newer and history:
+        navigation.append(InlineKeyboardButton(
+            "Новее ➡️",
+            callback_data=cashbox_history_callback(transaction_type, date_from, date_to,
+                                                   after_id=history[0]['id'])
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append(render.back_row("menu_cashbox"))
+    
+    return text, InlineKeyboardMarkup(keyboard)
 
 
 async def handle_cashbox_action(query, data: str):
@@ -881,15 +1585,11 @@ async def handle_cashbox_action(query, data: str):
     user_id = query.from_user.id
     
     # Кнопки навигации для всех действий
-    nav_keyboard = [
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_cashbox")],
-        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-    ]
-    nav_markup = InlineKeyboardMarkup(nav_keyboard)
+    nav_markup = render.nav_markup("menu_cashbox")
     
     if data == "cashbox_add":
         user_states[user_id] = "cashbox_add"
-        await query.edit_message_text(
+        await edit_message(query,
             "➕ Пополнение кассы\n\n"
             "Введите сумму для пополнения:\n\n"
             "Пример: 1000.00",
@@ -899,7 +1599,7 @@ async def handle_cashbox_action(query, data: str):
     
     elif data == "cashbox_withdraw":
         user_states[user_id] = "cashbox_withdraw"
-        await query.edit_message_text(
+        await edit_message(query,
             "➖ Снятие из кассы\n\n"
             "Введите сумму для снятия:\n\n"
             "Пример: 500.00",
@@ -908,38 +1608,122 @@ async def handle_cashbox_action(query, data: str):
         return
     
     elif data == "cashbox_history":
-        history = db.get_cashbox_history(10)
-        
-        if not history:
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="menu_cashbox")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "📜 История операций пуста",
-                reply_markup=reply_markup
-            )
+        text, reply_markup = await asyncio.to_thread(build_cashbox_history)
+        await edit_message(query, text, reply_markup=reply_markup)
+    
+    elif data.startswith("cashbox_h_"):
+        text, reply_markup = await asyncio.to_thread(build_cashbox_history, **parse_cashbox_history_callback(data))
+        await edit_message(query, text, reply_markup=reply_markup)
+    
+    elif data == "cashbox_zreport":
+        if not is_admin(user_id):
+            await edit_message(query, "❌ Доступ запрещен!", reply_markup=nav_markup)
             return
         
-        text = "📜 История операций:\n\n"
-        for record in history:
-            amount = record['amount']
-            sign = "+" if amount > 0 else ""
-            text += (
-                f"{sign}{amount:.2f} руб. - {record['description']}\n"
-                f"  {record['created_at']}\n\n"
-            )
-        
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="menu_cashbox")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        # Итоги посчитаны заранее фоновой задачей - здесь только чтение по ключу
+        report = await asyncio.to_thread(get_daily_report, datetime.now(report_tz).date() - timedelta(days=1))
+        await edit_message(query, format_daily_close(report), reply_markup=nav_markup)
 
 
 # === Обработчики текстовых сообщений ===
 
-# Хранилище состояний пользователей (в продакшене использовать Redis или БД)
+# Хранилище состояний пользователей (в продакшене использовать Redis или БД).
+# Обновления одного пользователя обрабатываются по очереди (PerUserUpdateProcessor),
+# поэтому пошаговые сценарии ввода не перемешиваются.
 user_states = {}
 
 
+async def handle_code_input(update: Update, state: str, code: str):
+    """Обработать штрихкод: найти товар или назначить код товару"""
+    user_id = update.message.from_user.id
+    
+    if state == "scan":
+        # Поиск по уникальному индексу, затем выборка по первичному ключу
+        product_id = await asyncio.to_thread(db.get_product_id_by_sku, code)
+        product = await asyncio.to_thread(db.get_product_by_id, product_id) if product_id else None
+        if not product:
+            reply_markup = render.MAIN_MENU_MARKUP
+            await reply(update,
+                f"❌ Товар со штрихкодом {code} не найден\n\n"
+                f"Попробуйте еще раз или вернитесь в главное меню.",
+                reply_markup=reply_markup
+            )
+            return
+        
+        user_states.pop(user_id, None)
+        text, reply_markup = await asyncio.to_thread(build_product_detail, product, is_admin(user_id))
+        await reply(update, text, reply_markup=reply_markup)
+        return
+    
+    # Назначение штрихкода товару (только админы)
+    product_name = state.replace("update_sku_", "")
+    product_name_encoded = product_name.replace(" ", "_")
+    if not is_admin(user_id):
+        reply_markup = render.MAIN_MENU_MARKUP
+        await reply(update,
+            "❌ Доступ запрещен!\n\n"
+            "Эта функция доступна только администраторам.",
+            reply_markup=reply_markup
+        )
+        user_states.pop(user_id, None)
+        return
+    
+    sku = None if code == "-" else code
+    keyboard = [
+        [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
+        render.MAIN_MENU_ROW
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    if await asyncio.to_thread(db.update_product_sku, product_name, sku, user_id):
+        await reply(update,
+            f"✅ Штрихкод обновлен:\n"
+            f"Товар: {product_name}\n"
+            f"Штрихкод: {sku or 'не задан'}",
+            reply_markup=reply_markup
+        )
+        user_states.pop(user_id, None)
+    else:
+        await reply(update,
+            f"❌ Не удалось назначить штрихкод {code}.\n"
+            f"Возможно, он уже назначен другому товару.",
+            reply_markup=reply_markup
+        )
+
+
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик фотографий: распознавание штрихкода"""
+    user_id = update.message.from_user.id
+    state = user_states.get(user_id, None)
+    
+    # Фото ожидается только при поиске или назначении штрихкода
+    if not state or not (state == "scan" or state.startswith("update_sku_")):
+        return
+    
+    # Модуль распознавания нужен редко, поэтому загружается по требованию
+    import barcode_scanner
+    
+    if not barcode_scanner.decoder_available():
+        await reply(update,
+            "❌ Распознавание штрихкодов с фото не настроено на сервере.\n"
+            "Введите код вручную."
+        )
+        return
+    
+    photo_file = await update.message.photo[-1].get_file()
+    image_bytes = await photo_file.download_as_bytearray()
+    # Декодирование занимает заметное время, поэтому выполняется в отдельном потоке
+    code = await asyncio.to_thread(barcode_scanner.decode_barcode, bytes(image_bytes))
+    
+    if not code:
+        await reply(update,
+            "❌ Штрихкод на фото не найден.\n"
+            "Попробуйте сфотографировать ближе или введите код вручную."
+        )
+        return
+    
+    await handle_code_input(update, state, code)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений для ввода данных"""
     text = update.message.text.strip()
@@ -961,66 +1745,66 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if admin_id == user_id:
                 keyboard = [
                     [InlineKeyboardButton("⚙️ Админ-панель", callback_data="admin_panel")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                    render.MAIN_MENU_ROW
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
+                await reply(update,
                     "ℹ️ Вы уже являетесь администратором.\n"
                     "Для добавления другого администратора введите его ID.",
                     reply_markup=reply_markup
                 )
                 return
             
-            # Username будет "Неизвестно", так как мы не можем получить его по ID
-            # без того, чтобы пользователь сам написал боту
-            username = "Неизвестно"
-            
-            if db.add_admin(admin_id, username):
+            # Username пока неизвестен - его запросит фоновая задача
+            # (см. AdminDirectory.backfill_usernames)
+            if await asyncio.to_thread(admin_directory.add, admin_id, UNKNOWN_USERNAME, user_id):
                 keyboard = [
                     [InlineKeyboardButton("⚙️ Админ-панель", callback_data="admin_panel")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                    render.MAIN_MENU_ROW
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
+                await reply(update,
                     f"✅ Администратор добавлен!\n"
                     f"ID: {admin_id}\n\n"
-                    f"Примечание: Username будет обновлен, когда пользователь впервые напишет боту.",
+                    f"Примечание: Username появится в списке администраторов автоматически.",
                     reply_markup=reply_markup
                 )
             else:
                 keyboard = [
                     [InlineKeyboardButton("⚙️ Админ-панель", callback_data="admin_panel")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                    render.MAIN_MENU_ROW
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
+                await reply(update,
                     f"❌ Пользователь с ID {admin_id} уже является администратором",
                     reply_markup=reply_markup
                 )
             user_states.pop(user_id, None)
             return
         except ValueError:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="admin_panel")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = render.nav_markup("admin_panel")
+            await reply(update,
                 "❌ Неверный формат. Введите числовой ID пользователя.",
                 reply_markup=reply_markup
             )
             return
     
+    # Поиск товара по штрихкоду или назначение штрихкода
+    if state == "scan" or state.startswith("update_sku_"):
+        await handle_code_input(update, state, text)
+        return
+    
+    # Перенос товара в категорию
+    if state.startswith("set_category_"):
+        await handle_category_input(update, state, text)
+        return
+    
     # Обработка в зависимости от состояния
     if state == "add_product":
         # Проверка прав администратора
         if not is_admin(user_id):
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = render.nav_markup("menu_products")
+            await reply(update,
                 "❌ Доступ запрещен!\n\n"
                 "Эта функция доступна только администраторам.",
                 reply_markup=reply_markup
@@ -1034,41 +1818,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 try:
                     name, quantity, price = parts
                     quantity = int(quantity)
-                    price = float(price)
+                    price = parse_money(price)
                     
-                    if db.add_product(name, quantity, price):
+                    if await asyncio.to_thread(db.add_product, name, quantity, price, user_id):
                         keyboard = [
                             [InlineKeyboardButton("➕ Добавить еще", callback_data="product_add")],
                             [InlineKeyboardButton("📦 Товары", callback_data="menu_products")],
-                            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                            render.MAIN_MENU_ROW
                         ]
                         reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
+                        await reply(update,
                             f"✅ Товар добавлен:\n"
                             f"Название: {name}\n"
                             f"Количество: {quantity}\n"
-                            f"Цена: {price:.2f} руб.",
+                            f"Цена: {format_money(price)} руб.",
                             reply_markup=reply_markup
                         )
                     else:
-                        keyboard = [
-                            [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
+                        reply_markup = render.nav_markup("menu_products")
+                        await reply(update,
                             f"❌ Товар '{name}' уже существует",
                             reply_markup=reply_markup
                         )
                     user_states.pop(user_id, None)
                     return
                 except ValueError:
-                    keyboard = [
-                        [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
+                    reply_markup = render.nav_markup("menu_products")
+                    await reply(update,
                         "❌ Неверный формат. Используйте: наименование товара , количество , цена",
                         reply_markup=reply_markup
                     )
@@ -1084,15 +1860,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Быстрое изменение количества для конкретного товара
             try:
                 quantity = int(text)
-                if db.update_product_quantity(product_name, quantity):
+                if await asyncio.to_thread(db.update_product_quantity, product_name, quantity, user_id):
                     product_name_encoded = product_name.replace(" ", "_")
                     keyboard = [
                         [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
                         [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
+                    await reply(update,
                         f"✅ Количество обновлено:\n"
                         f"Товар: {product_name}\n"
                         f"Новое количество: {quantity}",
@@ -1101,22 +1877,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 else:
                     keyboard = [
                         [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
+                    await reply(update,
                         f"❌ Товар '{product_name}' не найден",
                         reply_markup=reply_markup
                     )
                 user_states.pop(user_id, None)
                 return
             except ValueError:
-                keyboard = [
-                    [InlineKeyboardButton("◀️ Назад", callback_data=f"product_view_{product_name.replace(' ', '_')}")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
+                reply_markup = render.nav_markup(f"product_view_{product_name.replace(' ', '_')}")
+                await reply(update,
                     "❌ Введите целое число",
                     reply_markup=reply_markup
                 )
@@ -1130,38 +1902,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         name, quantity = parts
                         quantity = int(quantity)
                         
-                        if db.update_product_quantity(name, quantity):
+                        if await asyncio.to_thread(db.update_product_quantity, name, quantity, user_id):
                             keyboard = [
                                 [InlineKeyboardButton("📝 Изменить еще", callback_data="product_quantity")],
                                 [InlineKeyboardButton("📦 Товары", callback_data="menu_products")],
-                                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                                render.MAIN_MENU_ROW
                             ]
                             reply_markup = InlineKeyboardMarkup(keyboard)
-                            await update.message.reply_text(
+                            await reply(update,
                                 f"✅ Количество обновлено:\n"
                                 f"Товар: {name}\n"
                                 f"Новое количество: {quantity}",
                                 reply_markup=reply_markup
                             )
                         else:
-                            keyboard = [
-                                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                            ]
-                            reply_markup = InlineKeyboardMarkup(keyboard)
-                            await update.message.reply_text(
+                            reply_markup = render.nav_markup("menu_products")
+                            await reply(update,
                                 f"❌ Товар '{name}' не найден",
                                 reply_markup=reply_markup
                             )
                         user_states.pop(user_id, None)
                         return
                     except ValueError:
-                        keyboard = [
-                            [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
+                        reply_markup = render.nav_markup("menu_products")
+                        await reply(update,
                             "❌ Неверный формат. Используйте: название | количество",
                             reply_markup=reply_markup
                         )
@@ -1170,12 +1934,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif state == "update_price" or (state and state.startswith("update_price_")):
         # Проверка прав администратора
         if not is_admin(user_id):
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = render.nav_markup("menu_products")
+            await reply(update,
                 "❌ Доступ запрещен!\n\n"
                 "Эта функция доступна только администраторам.",
                 reply_markup=reply_markup
@@ -1190,40 +1950,36 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if product_name:
             # Быстрое изменение цены для конкретного товара
             try:
-                price = float(text)
-                if db.update_product_price(product_name, price):
+                price = parse_money(text)
+                if await asyncio.to_thread(db.update_product_price, product_name, price, user_id):
                     product_name_encoded = product_name.replace(" ", "_")
                     keyboard = [
                         [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
                         [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
+                    await reply(update,
                         f"✅ Цена обновлена:\n"
                         f"Товар: {product_name}\n"
-                        f"Новая цена: {price:.2f} руб.",
+                        f"Новая цена: {format_money(price)} руб.",
                         reply_markup=reply_markup
                     )
                 else:
                     keyboard = [
                         [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
+                    await reply(update,
                         f"❌ Товар '{product_name}' не найден",
                         reply_markup=reply_markup
                     )
                 user_states.pop(user_id, None)
                 return
             except ValueError:
-                keyboard = [
-                    [InlineKeyboardButton("◀️ Назад", callback_data=f"product_view_{product_name.replace(' ', '_')}")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
+                reply_markup = render.nav_markup(f"product_view_{product_name.replace(' ', '_')}")
+                await reply(update,
                     "❌ Введите число (можно с точкой)",
                     reply_markup=reply_markup
                 )
@@ -1235,40 +1991,32 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if len(parts) == 2:
                     try:
                         name, price_str = parts
-                        price = float(price_str)
+                        price = parse_money(price_str)
                         
-                        if db.update_product_price(name, price):
+                        if await asyncio.to_thread(db.update_product_price, name, price, user_id):
                             keyboard = [
                                 [InlineKeyboardButton("💵 Изменить еще", callback_data="product_price")],
                                 [InlineKeyboardButton("📦 Товары", callback_data="menu_products")],
-                                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                                render.MAIN_MENU_ROW
                             ]
                             reply_markup = InlineKeyboardMarkup(keyboard)
-                            await update.message.reply_text(
+                            await reply(update,
                                 f"✅ Цена обновлена:\n"
                                 f"Товар: {name}\n"
-                                f"Новая цена: {price:.2f} руб.",
+                                f"Новая цена: {format_money(price)} руб.",
                                 reply_markup=reply_markup
                             )
                         else:
-                            keyboard = [
-                                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                            ]
-                            reply_markup = InlineKeyboardMarkup(keyboard)
-                            await update.message.reply_text(
+                            reply_markup = render.nav_markup("menu_products")
+                            await reply(update,
                                 f"❌ Товар '{name}' не найден",
                                 reply_markup=reply_markup
                             )
                         user_states.pop(user_id, None)
                         return
                     except ValueError:
-                        keyboard = [
-                            [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
+                        reply_markup = render.nav_markup("menu_products")
+                        await reply(update,
                             "❌ Неверный формат. Используйте: название | цена",
                             reply_markup=reply_markup
                         )
@@ -1284,55 +2032,54 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Быстрая продажа конкретного товара
             try:
                 quantity = int(text)
-                success, total_price = db.sell_product(product_name, quantity)
+                success, total_price = await asyncio.to_thread(
+                    db.sell_product, product_name, quantity, user_id,
+                    idempotency_key=message_idempotency_key(update)
+                )
                 if success:
-                    balance = db.get_cashbox_balance()
+                    balance = await asyncio.to_thread(db.get_cashbox_balance)
                     product_name_encoded = product_name.replace(" ", "_")
                     keyboard = [
                         [InlineKeyboardButton("🛒 Продать еще", callback_data=f"product_sell_{product_name_encoded}")],
                         [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
                         [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
+                    await reply(update,
                         f"✅ Товар продан:\n"
                         f"Товар: {product_name}\n"
                         f"Количество: {quantity}\n"
-                        f"Сумма: {total_price:.2f} руб.\n"
-                        f"Баланс кассы: {balance:.2f} руб.",
+                        f"Сумма: {format_money(total_price)} руб.\n"
+                        f"Баланс кассы: {format_money(balance)} руб.",
                         reply_markup=reply_markup
                     )
                 else:
-                    product = db.get_product(product_name)
+                    product = await asyncio.to_thread(db.get_product, product_name)
                     product_name_encoded = product_name.replace(" ", "_")
                     keyboard = [
                         [InlineKeyboardButton("📦 К товару", callback_data=f"product_view_{product_name_encoded}")],
                         [InlineKeyboardButton("📦 Список товаров", callback_data="list_products")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     if not product:
-                        await update.message.reply_text(
+                        await reply(update,
                             f"❌ Товар '{product_name}' не найден",
                             reply_markup=reply_markup
                         )
                     else:
-                        await update.message.reply_text(
+                        await reply(update,
                             f"❌ Недостаточно товара на складе.\n"
-                            f"Доступно: {product['quantity']}",
+                            f"Доступно: {product.quantity}",
                             reply_markup=reply_markup
                         )
                 user_states.pop(user_id, None)
                 return
             except ValueError:
                 product_name_encoded = product_name.replace(" ", "_")
-                keyboard = [
-                    [InlineKeyboardButton("◀️ Назад", callback_data=f"product_view_{product_name_encoded}")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
+                reply_markup = render.nav_markup(f"product_view_{product_name_encoded}")
+                await reply(update,
                     "❌ Введите целое число",
                     reply_markup=reply_markup
                 )
@@ -1346,50 +2093,45 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         name, quantity = parts
                         quantity = int(quantity)
                         
-                        success, total_price = db.sell_product(name, quantity)
+                        success, total_price = await asyncio.to_thread(
+                            db.sell_product, name, quantity, user_id,
+                            idempotency_key=message_idempotency_key(update)
+                        )
                         if success:
-                            balance = db.get_cashbox_balance()
+                            balance = await asyncio.to_thread(db.get_cashbox_balance)
                             keyboard = [
                                 [InlineKeyboardButton("🛒 Продать еще", callback_data="product_sell")],
                                 [InlineKeyboardButton("📦 Товары", callback_data="menu_products")],
-                                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                                render.MAIN_MENU_ROW
                             ]
                             reply_markup = InlineKeyboardMarkup(keyboard)
-                            await update.message.reply_text(
+                            await reply(update,
                                 f"✅ Товар продан:\n"
                                 f"Товар: {name}\n"
                                 f"Количество: {quantity}\n"
-                                f"Сумма: {total_price:.2f} руб.\n"
-                                f"Баланс кассы: {balance:.2f} руб.",
+                                f"Сумма: {format_money(total_price)} руб.\n"
+                                f"Баланс кассы: {format_money(balance)} руб.",
                                 reply_markup=reply_markup
                             )
                         else:
-                            product = db.get_product(name)
-                            keyboard = [
-                                [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                            ]
-                            reply_markup = InlineKeyboardMarkup(keyboard)
+                            product = await asyncio.to_thread(db.get_product, name)
+                            reply_markup = render.nav_markup("menu_products")
                             if not product:
-                                await update.message.reply_text(
+                                await reply(update,
                                     f"❌ Товар '{name}' не найден",
                                     reply_markup=reply_markup
                                 )
                             else:
-                                await update.message.reply_text(
+                                await reply(update,
                                     f"❌ Недостаточно товара на складе.\n"
-                                    f"Доступно: {product['quantity']}",
+                                    f"Доступно: {product.quantity}",
                                     reply_markup=reply_markup
                                 )
                         user_states.pop(user_id, None)
                         return
                     except ValueError:
-                        keyboard = [
-                            [InlineKeyboardButton("◀️ Назад", callback_data="menu_products")],
-                            [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
+                        reply_markup = render.nav_markup("menu_products")
+                        await reply(update,
                             "❌ Неверный формат. Используйте: название | количество",
                             reply_markup=reply_markup
                         )
@@ -1398,30 +2140,27 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif state == "cashbox_add":
         # Пополнение кассы: просто число
         try:
-            amount = float(text)
+            amount = parse_money(text)
             if amount > 0:
-                if db.add_cash(amount, "Пополнение через бота"):
-                    balance = db.get_cashbox_balance()
+                if await asyncio.to_thread(db.add_cash, amount, "Пополнение через бота", user_id,
+                                           idempotency_key=message_idempotency_key(update)):
+                    balance = await asyncio.to_thread(db.get_cashbox_balance)
                     keyboard = [
                         [InlineKeyboardButton("➕ Пополнить еще", callback_data="cashbox_add")],
                         [InlineKeyboardButton("💰 Касса", callback_data="menu_cashbox")],
-                        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                        render.MAIN_MENU_ROW
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
-                        f"✅ Касса пополнена на {amount:.2f} руб.\n"
-                        f"Новый баланс: {balance:.2f} руб.",
+                    await reply(update,
+                        f"✅ Касса пополнена на {format_money(amount)} руб.\n"
+                        f"Новый баланс: {format_money(balance)} руб.",
                         reply_markup=reply_markup
                     )
                     user_states.pop(user_id, None)
                     return
         except ValueError:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_cashbox")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = render.nav_markup("menu_cashbox")
+            await reply(update,
                 "❌ Введите положительное число",
                 reply_markup=reply_markup
             )
@@ -1430,36 +2169,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif state == "cashbox_withdraw":
         # Снятие из кассы: просто число
         try:
-            amount = float(text)
+            amount = parse_money(text)
             if amount > 0:
                 keyboard = [
                     [InlineKeyboardButton("💰 Касса", callback_data="menu_cashbox")],
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
+                    render.MAIN_MENU_ROW
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                if db.withdraw_cash(amount, "Снятие через бота"):
-                    balance = db.get_cashbox_balance()
-                    await update.message.reply_text(
-                        f"✅ Из кассы снято {amount:.2f} руб.\n"
-                        f"Новый баланс: {balance:.2f} руб.",
+                if await asyncio.to_thread(db.withdraw_cash, amount, "Снятие через бота", user_id,
+                                           idempotency_key=message_idempotency_key(update)):
+                    balance = await asyncio.to_thread(db.get_cashbox_balance)
+                    await reply(update,
+                        f"✅ Из кассы снято {format_money(amount)} руб.\n"
+                        f"Новый баланс: {format_money(balance)} руб.",
                         reply_markup=reply_markup
                     )
                 else:
-                    balance = db.get_cashbox_balance()
-                    await update.message.reply_text(
+                    balance = await asyncio.to_thread(db.get_cashbox_balance)
+                    await reply(update,
                         f"❌ Недостаточно средств в кассе.\n"
-                        f"Текущий баланс: {balance:.2f} руб.",
+                        f"Текущий баланс: {format_money(balance)} руб.",
                         reply_markup=reply_markup
                     )
                 user_states.pop(user_id, None)
                 return
         except ValueError:
-            keyboard = [
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_cashbox")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = render.nav_markup("menu_cashbox")
+            await reply(update,
                 "❌ Введите положительное число",
                 reply_markup=reply_markup
             )
@@ -1467,28 +2203,152 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Если состояние установлено, но формат не подошел - показываем ошибку
     # (это означает, что пользователь в состоянии ожидания ввода, но ввел неверные данные)
-    keyboard = [
-        [InlineKeyboardButton("◀️ Назад", callback_data="back_main")],
-        [InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
+    reply_markup = render.nav_markup("back_main")
+    await reply(update,
         "❌ Неверный формат данных.\n\n"
         "Используйте кнопки меню для выбора действия.",
         reply_markup=reply_markup
     )
 
 
+def env_int(name: str, default: int) -> int:
+    """Прочитать целое число из переменной окружения"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}={value!r}, используется {default}")
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Прочитать число с точкой из переменной окружения"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}={value!r}, используется {default}")
+        return default
+
+
+def register_handlers(application: Application):
+    """Зарегистрировать обработчики обновлений (по ним же вычисляется allowed_updates)"""
+    # Регистрация обработчиков команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("products", products_command))
+    application.add_handler(CommandHandler("categories", categories_command))
+    application.add_handler(CommandHandler("cashbox", cashbox_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("admin", admin_command))
+    application.add_handler(CommandHandler("scan", scan_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("dashboard", dashboard_command))
+    application.add_handler(CommandHandler("audit", audit_command))
+    application.add_handler(CommandHandler("zreport", zreport_command))
+    application.add_handler(CommandHandler("reprice", reprice_command))
+    application.add_handler(CommandHandler("forecast", forecast_command))
+    
+    # Регистрация обработчика кнопок
+    application.add_handler(CallbackQueryHandler(button_handler))
+    
+    # Поиск товаров в inline-режиме (включается у @BotFather командой /setinline)
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+    
+    # Регистрация обработчика текстовых сообщений
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Регистрация обработчика фотографий (распознавание штрихкодов)
+    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+
+
+# Какие типы обновлений нужны каждому виду обработчика
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: [Update.MESSAGE],
+    MessageHandler: [Update.MESSAGE],
+    CallbackQueryHandler: [Update.CALLBACK_QUERY],
+    InlineQueryHandler: [Update.INLINE_QUERY],
+}
+
+
+def get_allowed_updates(application: Application) -> List[str]:
+    """
+    Список типов обновлений, которые запрашиваются у Telegram
+    
+    Можно задать явно через ALLOWED_UPDATES (через запятую), иначе список
+    вычисляется по зарегистрированным обработчикам, чтобы Telegram не присылал
+    обновления, которые бот все равно не обрабатывает.
+    """
+    configured = os.getenv("ALLOWED_UPDATES")
+    if configured:
+        return [t.strip() for t in configured.split(",") if t.strip()]
+    
+    allowed = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            update_types = HANDLER_UPDATE_TYPES.get(type(handler))
+            if update_types is None:
+                logger.warning(f"Неизвестный тип обработчика {type(handler).__name__}, запрашиваются все обновления")
+                return Update.ALL_TYPES
+            for update_type in update_types:
+                if update_type not in allowed:
+                    allowed.append(update_type)
+    return allowed
+
+
+async def backfill_admin_usernames(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: запросить недостающие имена администраторов"""
+    await admin_directory.backfill_usernames(outbox)
+
+
+async def forecast_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: пересчитать прогноз спроса (в отдельном потоке)"""
+    await asyncio.to_thread(forecaster.refresh, report_tz)
+
+
+async def close_day_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: закрыть прошедший день кассы и разослать Z-отчет администраторам"""
+    day = datetime.now(report_tz).date() - timedelta(days=1)
+    report = await asyncio.to_thread(db.close_day, day, report_tz)
+    logger.info(f"Закрыт день {report['day']}: выручка {format_money(report['revenue'])} руб.")
+    
+    text = format_daily_close(report)
+    for admin in admin_directory.admins():
+        outbox.send_message(admin['user_id'], text)
+
+
+async def on_startup(application: Application):
+    """Запуск фоновых служб после инициализации бота"""
+    outbox.start(application.bot)
+    audit_log.start()
+    # Справочник читается из памяти; загружаем его здесь, а не при первой
+    # проверке прав в обработчике
+    await asyncio.to_thread(admin_directory.reload)
+    logger.info(f"Запуск занял {(time.perf_counter() - STARTED_AT) * 1000:.0f} мс")
+
+
+async def on_stop(application: Application):
+    """Отправка оставшихся сообщений и записей журнала перед остановкой"""
+    await outbox.stop()
+    await audit_log.stop()
+    db.close()
+
+
 def main():
     """Главная функция запуска бота"""
+    global db, admin_directory, audit_log, report_tz, forecaster
+    
+    load_environment()
     token = os.getenv("BOT_TOKEN")
     
     # Отладочная информация
-    logger.info(f"Текущая рабочая директория: {os.getcwd()}")
-    logger.info(f"Путь к скрипту: {os.path.dirname(__file__)}")
-    logger.info(f"BOT_TOKEN из окружения: {'установлен' if token else 'не найден'}")
-    if token:
-        logger.info(f"Длина токена: {len(token)} символов")
+    logger.debug(f"Текущая рабочая директория: {os.getcwd()}")
+    logger.debug(f"Путь к скрипту: {os.path.dirname(__file__)}")
+    logger.debug(f"BOT_TOKEN из окружения: {'установлен' if token else 'не найден'}")
     
     if not token or token == "your_telegram_bot_token_here":
         logger.error("=" * 60)
@@ -1505,25 +2365,96 @@ def main():
         logger.error("=" * 60)
         return
     
+    # Инициализация хранилища: SQLite (warehouse.db) или PostgreSQL по DATABASE_URL
+    db = open_storage(
+        os.getenv("DATABASE_URL"),
+        pool_size=env_int("DATABASE_POOL_SIZE", 10),
+        busy_timeout=env_float("SQLITE_BUSY_TIMEOUT", 5.0),
+        lock_retries=env_int("SQLITE_LOCK_RETRIES", 3),
+    )
+    admin_directory = AdminDirectory(db, username_ttl=env_int("ADMIN_USERNAME_TTL", 24 * 3600))
+    audit_log = AuditLog(db.add_audit_entries, flush_interval=env_float("AUDIT_FLUSH_INTERVAL", 1.0))
+    db.audit_sink = audit_log.record
+    report_tz = timezone(timedelta(hours=env_float("REPORT_UTC_OFFSET", 3)))
+    # NumPy импортируется при первом пересчете прогноза, а не при запуске
+    from forecast import DemandForecaster, numpy_available
+    if numpy_available():
+        forecaster = DemandForecaster(
+            db,
+            history_days=env_int("FORECAST_HISTORY_DAYS", 90),
+            lead_time=env_int("FORECAST_LEAD_TIME", 7),
+            cover_days=env_int("FORECAST_COVER_DAYS", 14),
+        )
+    else:
+        logger.info("NumPy не установлен, прогноз спроса (/forecast) отключен")
+    
+    # Клиент Bot API: пул соединений, HTTP/2, keep-alive и JSON-кодек.
+    # getUpdates идет через отдельный клиент с одним соединением
+    from transport import build_request, json_codec_name
+    http_version = os.getenv("TELEGRAM_HTTP_VERSION", "1.1")
+    keepalive = env_float("TELEGRAM_KEEPALIVE", 30.0)
+    fast_json = os.getenv("TELEGRAM_JSON", "orjson").lower() != "json"
+    request = build_request(
+        pool_size=env_int("TELEGRAM_POOL_SIZE", 256),
+        http_version=http_version,
+        keepalive=keepalive,
+        fast_json=fast_json,
+    )
+    get_updates_request = build_request(
+        pool_size=1, http_version=http_version, keepalive=keepalive, fast_json=fast_json
+    )
+    logger.info(f"HTTP {request.http_version}, JSON: {json_codec_name(request)}")
+    
     # Создание приложения
-    application = Application.builder().token(token).build()
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(PerUserUpdateProcessor(env_int("CONCURRENT_UPDATES", 32)))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+    )
     
-    # Регистрация обработчиков команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("products", products_command))
-    application.add_handler(CommandHandler("cashbox", cashbox_command))
-    application.add_handler(CommandHandler("admin", admin_command))
+    # Адрес Bot API можно переопределить (локальный сервер Bot API или тестовый стенд)
+    api_url = os.getenv("TELEGRAM_API_URL")
+    if api_url:
+        builder = builder.base_url(f"{api_url.rstrip('/')}/bot").base_file_url(f"{api_url.rstrip('/')}/file/bot")
+        logger.info(f"Используется Bot API: {api_url}")
     
-    # Регистрация обработчика кнопок
-    application.add_handler(CallbackQueryHandler(button_handler))
+    application = builder.build()
     
-    # Регистрация обработчика текстовых сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    register_handlers(application)
+    
+    # Фоновое обновление имен администраторов
+    application.job_queue.run_repeating(
+        backfill_admin_usernames,
+        interval=env_int("ADMIN_USERNAME_REFRESH", 600),
+        first=5
+    )
+    
+    # Пересчет прогноза спроса
+    if forecaster is not None:
+        application.job_queue.run_repeating(
+            forecast_job,
+            interval=env_int("FORECAST_INTERVAL", 3600),
+            first=10
+        )
+    
+    # Закрытие дня кассы и рассылка Z-отчета
+    application.job_queue.run_daily(
+        close_day_job,
+        time=dtime(hour=0, minute=5, tzinfo=report_tz)
+    )
     
     # Запуск бота
-    logger.info("Бот запущен")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    allowed_updates = get_allowed_updates(application)
+    logger.info(f"Бот запущен, типы обновлений: {', '.join(allowed_updates)}")
+    application.run_polling(
+        allowed_updates=allowed_updates,
+        timeout=env_int("POLL_TIMEOUT", 30),
+        poll_interval=env_float("POLL_INTERVAL", 0.0)
+    )
 
 
 if __name__ == "__main__":
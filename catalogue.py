@@ -0,0 +1,205 @@
+"""
+Каталог товаров в памяти
+
+Держит записи товаров с индексами по ID и по наименованию. Вместо повторного
+чтения всей таблицы при каждом просмотре списка каталог сверяет счетчик
+изменений товаров (таблица counters) и дочитывает только изменившиеся записи.
+Счетчик хранится в базе данных, поэтому изменения, сделанные другими
+процессами, тоже подхватываются.
+
+Для поиска по началу слов (inline-режим) каталог держит отсортированный
+список пар (слово, ID товара): поиск - это bisect по префиксу. Список строится
+один раз и дополняется при появлении и переименовании товаров. Результаты
+поиска кэшируются до следующего изменения товаров.
+
+Поиск вызывается на каждое нажатие клавиши в inline-режиме, поэтому счетчик
+изменений перед поиском сверяется не чаще раза в search_refresh_interval
+секунд: результаты поиска могут отставать от базы на это время. Остальные
+методы сверяют счетчик при каждом вызове.
+
+Каталог читают обработчики в цикле событий и фоновые задачи в отдельных
+потоках (прогноз спроса), поэтому обновление и чтение индексов идут под
+блокировкой. Записи товаров, которые каталог отдает наружу, общие для всех
+вызовов: изменять их нельзя.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+# Слово наименования - последовательность букв и цифр
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def name_words(name: str) -> List[str]:
+    """Слова наименования в нижнем регистре (ключи индекса поиска)"""
+    return WORD_PATTERN.findall(name.lower())
+
+
+class Catalogue:
+    """Каталог товаров с инкрементальным обновлением"""
+
+    def __init__(self, db, search_cache_size: int = 256, search_refresh_interval: float = 1.0):
+        """
+        Args:
+            db: База данных (Database)
+            search_cache_size: Сколько результатов поиска держать в кэше
+            search_refresh_interval: Как часто (в секундах) поиск проверяет
+                изменения товаров в базе
+        """
+        self.db = db
+        self._by_id: Dict[int, "Product"] = {}
+        self._by_name: Dict[str, "Product"] = {}
+        self._sorted: Optional[List["Product"]] = None
+        self._seq = 0
+        # Индекс поиска: отсортированные пары (слово, ID товара); None - еще не построен
+        self._words: Optional[List[Tuple[str, int]]] = None
+        # Слова наименования каждого товара (для проверки остальных слов запроса)
+        self._product_words: Dict[int, List[str]] = {}
+        self._search_cache: "OrderedDict[Tuple[str, int], List[Product]]" = OrderedDict()
+        self.search_cache_size = search_cache_size
+        self.search_refresh_interval = search_refresh_interval
+        # Момент последней сверки счетчика изменений (time.monotonic)
+        self._checked_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def refresh(self, max_age: float = 0.0):
+        """
+        Подтянуть изменения товаров из базы данных
+
+        Args:
+            max_age: Не обращаться к базе, если изменения проверялись
+                меньше max_age секунд назад
+        """
+        with self._lock:
+            now = time.monotonic()
+            if max_age and self._checked_at is not None and now - self._checked_at < max_age:
+                return
+            self._checked_at = now
+            seq = self.db.get_products_seq()
+            if seq == self._seq:
+                return
+
+            for product in self.db.get_products_changed_since(self._seq):
+                current = self._by_id.get(product.id)
+                if current is None:
+                    self._by_id[product.id] = product
+                    self._by_name[product.name] = product
+                    self._sorted = None
+                    self._index_words(product.id, product.name)
+                else:
+                    if current.name != product.name:
+                        del self._by_name[current.name]
+                        self._by_name[product.name] = current
+                        self._sorted = None
+                        self._unindex_words(current.id, current.name)
+                        self._index_words(product.id, product.name)
+                    # Запись обновляется на месте, поэтому отсортированный список
+                    # остается актуальным, пока не меняются наименования
+                    current.update_from(product)
+                seq = max(seq, product.updated_seq)
+            self._seq = seq
+            # Цены и остатки в найденных записях могли измениться
+            self._search_cache.clear()
+
+    def products(self) -> List["Product"]:
+        """Все товары, отсортированные по наименованию"""
+        with self._lock:
+            self.refresh()
+            if self._sorted is None:
+                self._sorted = sorted(self._by_id.values(), key=lambda product: product.name)
+            return self._sorted
+
+    def get(self, product_id: int) -> Optional["Product"]:
+        """Товар по ID"""
+        with self._lock:
+            self.refresh()
+            return self._by_id.get(product_id)
+
+    def find(self, name: str) -> Optional["Product"]:
+        """Товар по наименованию"""
+        with self._lock:
+            self.refresh()
+            return self._by_name.get(name)
+
+    def search(self, query: str, limit: int = 50) -> List["Product"]:
+        """
+        Товары, в наименовании которых каждое слово запроса - начало какого-то слова
+
+        Например, «мол 3» найдет «Молоко 3.2%». Найденные товары отсортированы
+        по наименованию; если совпадений больше limit, возвращаются первые
+        limit в порядке индекса.
+
+        Args:
+            query: Строка поиска
+            limit: Максимальное количество товаров
+        """
+        with self._lock:
+            self.refresh(max_age=self.search_refresh_interval)
+            terms = name_words(query)
+            if not terms:
+                return []
+
+            key = (" ".join(terms), limit)
+            cached = self._search_cache.get(key)
+            if cached is not None:
+                self._search_cache.move_to_end(key)
+                metrics.inc("search_cache_hits")
+                return cached
+
+            if self._words is None:
+                self._build_index()
+
+            # Диапазон индекса для каждого слова запроса считается двумя bisect;
+            # кандидаты берутся из самого узкого диапазона, остальные слова
+            # проверяются у кандидатов
+            ranges = []
+            for term in terms:
+                start = bisect.bisect_left(self._words, (term,))
+                end = bisect.bisect_left(self._words, (term + "\uffff",))
+                ranges.append((end - start, start, end, term))
+            _, start, end, narrowest = min(ranges)
+            other_terms = [term for term in terms if term != narrowest]
+
+            found = []
+            seen = set()
+            for position in range(start, end):
+                product_id = self._words[position][1]
+                if product_id in seen:
+                    continue
+                seen.add(product_id)
+                words = self._product_words[product_id]
+                if all(any(word.startswith(term) for word in words) for term in other_terms):
+                    found.append(self._by_id[product_id])
+                    if len(found) >= limit:
+                        break
+            found.sort(key=lambda product: product.name)
+
+            self._search_cache[key] = found
+            if len(self._search_cache) > self.search_cache_size:
+                self._search_cache.popitem(last=False)
+            return found
+
+    def _build_index(self):
+        """Построить индекс поиска по всем товарам каталога"""
+        self._product_words = {product.id: name_words(product.name) for product in self._by_id.values()}
+        self._words = sorted(
+            (word, product_id) for product_id, words in self._product_words.items() for word in words
+        )
+
+    def _index_words(self, product_id: int, name: str):
+        if self._words is not None:
+            words = self._product_words[product_id] = name_words(name)
+            for word in words:
+                bisect.insort(self._words, (word, product_id))
+
+    def _unindex_words(self, product_id: int, name: str):
+        if self._words is not None:
+            for word in self._product_words.pop(product_id, ()):
+                position = bisect.bisect_left(self._words, (word, product_id))
+                if position < len(self._words) and self._words[position] == (word, product_id):
+                    del self._words[position]
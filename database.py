@@ -1,27 +1,152 @@
 """
 Модуль для работы с базой данных складского учета
+
+Все денежные суммы (цены, операции кассы) хранятся целым числом копеек.
 """
+import functools
+import random
 import sqlite3
+import threading
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from time import monotonic, sleep
 from typing import List, Dict, Optional, Tuple
 
+from product_cache import ProductCache
+from reprice import RepriceRule
+from storage import Storage
+import metrics
+
+
+def is_lock_error(error: sqlite3.OperationalError) -> bool:
+    """Временная ошибка блокировки (SQLITE_BUSY / SQLITE_LOCKED), которую можно повторить"""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(error)
+
+
+# Соединения, открытые текущей попыткой retry_on_lock в этом потоке
+_attempt_connections = threading.local()
+
+
+def retry_on_lock(method):
+    """
+    Повторять изменяющий метод Database, если база заблокирована другим процессом
 
-class Database:
-    """Класс для управления базой данных склада"""
+    Каждый такой метод - одна транзакция, и до коммита он ничего не меняет
+    вне БД. Соединения, открытые попыткой через get_connection, закрываются
+    после каждой попытки, в том числе неудачной: незавершенная транзакция
+    откатывается, и метод выполняется заново целиком. Остальные ошибки не
+    повторяются.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = monotonic()
+        for attempt in range(self.lock_retries + 1):
+            outer = getattr(_attempt_connections, "opened", None)
+            _attempt_connections.opened = []
+            try:
+                result = method(self, *args, **kwargs)
+            except sqlite3.OperationalError as error:
+                if not is_lock_error(error):
+                    raise
+                if attempt == self.lock_retries:
+                    metrics.inc("db_lock_failures")
+                    metrics.inc("db_lock_wait_ms", int((monotonic() - started) * 1000))
+                    raise
+                metrics.inc("db_lock_retries")
+            else:
+                if attempt:
+                    metrics.inc("db_lock_wait_ms", int((monotonic() - started) * 1000))
+                return result
+            finally:
+                # Без этого соединение с открытой транзакцией живет, пока жива
+                # трассировка исключения, и держит блокировку во время паузы
+                for conn in _attempt_connections.opened:
+                    conn.close()
+                _attempt_connections.opened = outer
+            sleep(self.lock_retry_delay * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
+
+
+class Product:
+    """Запись о товаре (компактная, без словаря атрибутов)"""
+    
+    __slots__ = ("id", "name", "quantity", "price", "sku", "created_at", "updated_seq", "category_id")
+    
+    # Колонки products в порядке полей записи
+    COLUMNS = "id, name, quantity, price, sku, created_at, updated_seq, category_id"
+    
+    def __init__(self, id: int, name: str, quantity: int, price: int,
+                 sku: Optional[str], created_at: str, updated_seq: int,
+                 category_id: Optional[int] = None):
+        self.id = id
+        self.name = name
+        self.quantity = quantity
+        self.price = price
+        self.sku = sku
+        self.created_at = created_at
+        self.updated_seq = updated_seq
+        self.category_id = category_id
+    
+    @staticmethod
+    def row_factory(cursor: sqlite3.Cursor, row: tuple) -> "Product":
+        """Фабрика строк sqlite3: строка выборки Product.COLUMNS -> Product"""
+        return Product(*row)
+    
+    def update_from(self, other: "Product"):
+        """Обновить запись на месте данными более новой версии"""
+        for field in self.__slots__:
+            setattr(self, field, getattr(other, field))
     
-    def __init__(self, db_path: str = "warehouse.db"):
+    def __repr__(self) -> str:
+        return f"Product(id={self.id}, name={self.name!r}, quantity={self.quantity}, price={self.price})"
+
+
+class Database(Storage):
+    """Хранилище склада в SQLite"""
+    
+    # Версия схемы БД (PRAGMA user_version). Увеличивается при каждом
+    # изменении init_database, чтобы при запуске не проверять схему заново.
+    SCHEMA_VERSION = 12
+    
+    def __init__(self, db_path: str = "warehouse.db", product_cache_size: int = 512,
+                 busy_timeout: float = 5.0, lock_retries: int = 3, lock_retry_delay: float = 0.05):
         """
         Инициализация базы данных
         
         Args:
             db_path: Путь к файлу базы данных
+            product_cache_size: Сколько товаров держать в кэше get_product
+            busy_timeout: Сколько секунд SQLite ждет снятия блокировки
+                другим соединением, прежде чем вернуть «database is locked»
+            lock_retries: Сколько раз повторять изменяющую операцию после
+                «database is locked» (см. retry_on_lock)
+            lock_retry_delay: Начальная пауза между повторами (секунды)
         """
         self.db_path = db_path
-        self.init_database()
+        self.busy_timeout = busy_timeout
+        self.lock_retries = lock_retries
+        self.lock_retry_delay = lock_retry_delay
+        super().__init__()
+        self.product_cache = ProductCache(product_cache_size)
+        # Отдельное соединение для PRAGMA data_version: значение меняется, когда
+        # базу данных изменило любое другое соединение, в том числе другой процесс
+        self._version_conn = sqlite3.connect(db_path, timeout=busy_timeout, check_same_thread=False)
+        self._version_lock = threading.Lock()
+        self._data_version: Optional[int] = None
+        self._cache_seq: Optional[int] = None
     
     def get_connection(self) -> sqlite3.Connection:
         """Получить соединение с базой данных"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
         conn.row_factory = sqlite3.Row
+        # LIKE в SQLite без учета регистра только для латиницы, поэтому
+        # наименования сравниваются через casefold() из Python
+        conn.create_function("casefold", 1, str.casefold, deterministic=True)
+        opened = getattr(_attempt_connections, "opened", None)
+        if opened is not None:
+            opened.append(conn)
         return conn
     
     def init_database(self):
@@ -29,13 +154,19 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Схема актуальна - ничего не делаем
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= self.SCHEMA_VERSION:
+            conn.close()
+            return
+        
         # Таблица товаров
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS products (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL UNIQUE,
                 quantity INTEGER NOT NULL DEFAULT 0,
-                price REAL NOT NULL DEFAULT 0.0,
+                price INTEGER NOT NULL DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -44,7 +175,7 @@ class Database:
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS cashbox (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                amount REAL NOT NULL DEFAULT 0.0,
+                amount INTEGER NOT NULL DEFAULT 0,
                 transaction_type TEXT NOT NULL,
                 description TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -61,194 +192,1324 @@ class Database:
             )
         """)
         
-        # Инициализация кассы, если её нет
-        cursor.execute("SELECT COUNT(*) FROM cashbox")
-        if cursor.fetchone()[0] == 0:
+        # Штрихкод / артикул товара (добавлен позже, поэтому через ALTER TABLE)
+        self._ensure_column(cursor, "products", "sku", "TEXT")
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku
+            ON products (sku)
+        """)
+        
+        # Счетчик изменений товаров: каждая вставка или изменение товара
+        # получает следующий номер, по нему каталог в памяти забирает только
+        # изменившиеся записи
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('products', 0)")
+        self._ensure_column(cursor, "products", "updated_seq", "INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_updated_seq
+            ON products (updated_seq)
+        """)
+        # Товары, созданные до появления счетчика, получают номера по порядку
+        cursor.execute("UPDATE products SET updated_seq = id WHERE updated_seq = 0")
+        cursor.execute("""
+            UPDATE counters SET value = (SELECT COALESCE(MAX(updated_seq), 0) FROM products)
+            WHERE name = 'products' AND value = 0
+        """)
+        # Счетчик ведут триггеры, чтобы его не мог пропустить ни один путь изменения
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_seq_insert
+            AFTER INSERT ON products
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'products';
+                UPDATE products SET updated_seq = (SELECT value FROM counters WHERE name = 'products')
+                WHERE id = NEW.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_seq_update
+            AFTER UPDATE ON products
+            WHEN NEW.updated_seq = OLD.updated_seq
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'products';
+                UPDATE products SET updated_seq = (SELECT value FROM counters WHERE name = 'products')
+                WHERE id = NEW.id;
+            END
+        """)
+        
+        # Дерево категорий. category_paths - все пары (предок, потомок), включая
+        # саму категорию: поддерево выбирается одним поиском по индексу, а
+        # счетчики товаров предков обновляются триггерами без рекурсивных
+        # запросов (WITH в триггерах SQLite не поддерживается).
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                parent_id INTEGER REFERENCES categories(id),
+                product_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_categories_parent
+            ON categories (parent_id, name)
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS category_paths (
+                ancestor_id INTEGER NOT NULL REFERENCES categories(id),
+                descendant_id INTEGER NOT NULL REFERENCES categories(id),
+                PRIMARY KEY (descendant_id, ancestor_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_category_paths_ancestor
+            ON category_paths (ancestor_id, descendant_id)
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS categories_paths_insert
+            AFTER INSERT ON categories
+            BEGIN
+                INSERT INTO category_paths (ancestor_id, descendant_id)
+                SELECT ancestor_id, NEW.id FROM category_paths WHERE descendant_id = NEW.parent_id;
+                INSERT INTO category_paths (ancestor_id, descendant_id) VALUES (NEW.id, NEW.id);
+            END
+        """)
+        
+        # Категория товара; product_count категории - число товаров в ее поддереве
+        self._ensure_column(cursor, "products", "category_id", "INTEGER REFERENCES categories(id)")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_category
+            ON products (category_id, name)
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_category_insert
+            AFTER INSERT ON products
+            WHEN NEW.category_id IS NOT NULL
+            BEGIN
+                UPDATE categories SET product_count = product_count + 1
+                WHERE id IN (SELECT ancestor_id FROM category_paths WHERE descendant_id = NEW.category_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_category_update
+            AFTER UPDATE OF category_id ON products
+            WHEN OLD.category_id IS NOT NEW.category_id
+            BEGIN
+                UPDATE categories SET product_count = product_count - 1
+                WHERE id IN (SELECT ancestor_id FROM category_paths WHERE descendant_id = OLD.category_id);
+                UPDATE categories SET product_count = product_count + 1
+                WHERE id IN (SELECT ancestor_id FROM category_paths WHERE descendant_id = NEW.category_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_category_delete
+            AFTER DELETE ON products
+            WHEN OLD.category_id IS NOT NULL
+            BEGIN
+                UPDATE categories SET product_count = product_count - 1
+                WHERE id IN (SELECT ancestor_id FROM category_paths WHERE descendant_id = OLD.category_id);
+            END
+        """)
+        
+        # Журнал движения товара (приход, продажа, корректировка)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stock_moves (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL REFERENCES products(id),
+                delta INTEGER NOT NULL,
+                move_type TEXT NOT NULL,
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_stock_moves_product
+            ON stock_moves (product_id, id)
+        """)
+        
+        # Снимки остатков для быстрого восстановления истории
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stock_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL REFERENCES products(id),
+                quantity INTEGER NOT NULL,
+                move_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_stock_snapshots_product
+            ON stock_snapshots (product_id, created_at)
+        """)
+        # Последний снимок товара - для подсчета движений после него
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_stock_snapshots_move
+            ON stock_snapshots (product_id, move_id)
+        """)
+        
+        # История цен: цена действует с момента valid_from до следующей записи.
+        # Индекс покрывающий: текущая цена находится одним поиском по индексу.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS prices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL REFERENCES products(id),
+                price INTEGER NOT NULL,
+                user_id INTEGER,
+                valid_from TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+            )
+        """)
+        # Продажи с ценой, по которой товар был продан
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id INTEGER NOT NULL REFERENCES products(id),
+                quantity INTEGER NOT NULL,
+                price INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                cashbox_id INTEGER REFERENCES cashbox(id),
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sales_product
+            ON sales (product_id, created_at)
+        """)
+        # Продажи по дням для прогноза спроса (get_daily_sales) - без обращения к таблице
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sales_created
+            ON sales (created_at, product_id, quantity)
+        """)
+        
+        # Журнал аудита: кто, что и когда изменил (пишется пачками, см. audit.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS audit_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                action TEXT NOT NULL,
+                target TEXT,
+                before TEXT,
+                after TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_audit_log_user
+            ON audit_log (user_id, id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_audit_log_target
+            ON audit_log (target, id)
+        """)
+        
+        # Ключи идемпотентности: повторно доставленное обновление или двойное
+        # нажатие кнопки получает сохраненный результат вместо повторной операции
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                success INTEGER,
+                amount INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Итоги дня кассы (Z-отчет), считаются фоновой задачей после закрытия дня
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS daily_close (
+                day TEXT PRIMARY KEY,
+                sales_count INTEGER NOT NULL,
+                revenue INTEGER NOT NULL,
+                deposits INTEGER NOT NULL,
+                withdrawals INTEGER NOT NULL,
+                opening_balance INTEGER NOT NULL,
+                closing_balance INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Денежные суммы раньше хранились в рублях (REAL) - переводим в копейки
+        if self._column_type(cursor, "prices", "price") == "REAL":
+            # Колонку, входящую в индекс, удалить нельзя
+            cursor.execute("DROP INDEX IF EXISTS idx_prices_product")
+        for table, column in (("products", "price"), ("cashbox", "amount"), ("prices", "price"),
+                              ("sales", "price"), ("sales", "amount")):
+            self._migrate_money_column(cursor, table, column)
+        
+        # Сводка по складу (стоимость остатков, товары без остатка).
+        # Поддерживается триггерами при каждом изменении товаров, поэтому
+        # чтение сводки - одна строка, а не проход по всем товарам.
+        # Триггеры и индекс ссылаются на price, поэтому создаются после
+        # перевода сумм в копейки: колонку, на которую они ссылаются, удалить
+        # нельзя, а сводка пересчитывается уже в копейках.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS inventory_summary (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                product_count INTEGER NOT NULL DEFAULT 0,
+                total_quantity INTEGER NOT NULL DEFAULT 0,
+                total_value INTEGER NOT NULL DEFAULT 0,
+                out_of_stock INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO inventory_summary (id) VALUES (1)")
+        # Полный пересчет выполняется только при обновлении схемы
+        cursor.execute("""
+            UPDATE inventory_summary SET
+                product_count = (SELECT COUNT(*) FROM products),
+                total_quantity = (SELECT COALESCE(SUM(quantity), 0) FROM products),
+                total_value = (SELECT COALESCE(SUM(quantity * price), 0) FROM products),
+                out_of_stock = (SELECT COUNT(*) FROM products WHERE quantity <= 0)
+            WHERE id = 1
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS inventory_summary_insert
+            AFTER INSERT ON products
+            BEGIN
+                UPDATE inventory_summary SET
+                    product_count = product_count + 1,
+                    total_quantity = total_quantity + NEW.quantity,
+                    total_value = total_value + NEW.quantity * NEW.price,
+                    out_of_stock = out_of_stock + (NEW.quantity <= 0)
+                WHERE id = 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS inventory_summary_update
+            AFTER UPDATE OF quantity, price ON products
+            BEGIN
+                UPDATE inventory_summary SET
+                    total_quantity = total_quantity + NEW.quantity - OLD.quantity,
+                    total_value = total_value + NEW.quantity * NEW.price - OLD.quantity * OLD.price,
+                    out_of_stock = out_of_stock + (NEW.quantity <= 0) - (OLD.quantity <= 0)
+                WHERE id = 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS inventory_summary_delete
+            AFTER DELETE ON products
+            BEGIN
+                UPDATE inventory_summary SET
+                    product_count = product_count - 1,
+                    total_quantity = total_quantity - OLD.quantity,
+                    total_value = total_value - OLD.quantity * OLD.price,
+                    out_of_stock = out_of_stock - (OLD.quantity <= 0)
+                WHERE id = 1;
+            END
+        """)
+        # Индекс по стоимости остатка - для списка самых дорогих позиций
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_stock_value
+            ON products (quantity * price)
+        """)
+        
+        # Покрывающий индекс для итогов кассы за период (выборка по диапазону дат).
+        # Создается после перевода сумм в копейки: колонку в индексе удалить нельзя.
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cashbox_created
+            ON cashbox (created_at, transaction_type, amount)
+        """)
+        
+        # Индексы для постраничной истории кассы (ключ страницы - (created_at, id)),
+        # в том числе с отбором по типу операции
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cashbox_history
+            ON cashbox (created_at, id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cashbox_type_history
+            ON cashbox (transaction_type, created_at, id)
+        """)
+        
+        # id в индексе упорядочивает цены, заданные в одну и ту же миллисекунду
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_prices_product
+            ON prices (product_id, valid_from, id, price)
+        """)
+        
+        # Товары, созданные до появления истории цен, получают начальную цену
+        cursor.execute("SELECT COUNT(*) FROM prices")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("""
+                INSERT INTO prices (product_id, price, valid_from)
+                SELECT id, price, created_at FROM products
+            """)
+        
+        # Товары, созданные до появления журнала, получают начальное движение
+        cursor.execute("SELECT COUNT(*) FROM stock_moves")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("""
+                INSERT INTO stock_moves (product_id, delta, move_type, created_at)
+                SELECT id, quantity, 'initial', created_at FROM products
+            """)
+        
+        # Инициализация кассы, если её нет
+        cursor.execute("SELECT COUNT(*) FROM cashbox")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("""
+                INSERT INTO cashbox (amount, transaction_type, description)
+                VALUES (0, 'initial', 'Начальный баланс')
+            """)
+        
+        cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def _ensure_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+        """Добавить колонку в существующую таблицу, если её еще нет"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row['name'] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    @staticmethod
+    def _column_type(cursor: sqlite3.Cursor, table: str, column: str) -> Optional[str]:
+        """Тип колонки таблицы или None, если колонки нет"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        for row in cursor.fetchall():
+            if row['name'] == column:
+                return row['type'].upper()
+        return None
+    
+    def _migrate_money_column(self, cursor: sqlite3.Cursor, table: str, column: str):
+        """Перевести денежную колонку из REAL (рубли) в INTEGER (копейки)"""
+        if self._column_type(cursor, table, column) != "REAL":
+            return
+        
+        minor_column = f"{column}_minor"
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {minor_column} INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f"UPDATE {table} SET {minor_column} = CAST(ROUND({column} * 100) AS INTEGER)")
+        cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+        cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {minor_column} TO {column}")
+    
+    def _claim_idempotency_key(self, cursor: sqlite3.Cursor, key: str) -> Optional[sqlite3.Row]:
+        """
+        Занять ключ идемпотентности в текущей транзакции
+        
+        Returns:
+            None если ключ новый, иначе сохраненный результат (success, amount)
+        """
+        try:
+            cursor.execute("INSERT INTO idempotency_keys (key) VALUES (?)", (key,))
+        except sqlite3.IntegrityError:
+            cursor.execute("SELECT success, amount FROM idempotency_keys WHERE key = ?", (key,))
+            metrics.inc("idempotent_replays")
+            return cursor.fetchone()
+        
+        # Храним только последние ключи: удаление по диапазону первичного ключа
+        key_id = cursor.lastrowid
+        if key_id % self.IDEMPOTENCY_PRUNE_EVERY == 0:
+            cursor.execute("""
+                DELETE FROM idempotency_keys WHERE id <= ?
+            """, (key_id - self.IDEMPOTENCY_KEYS_LIMIT,))
+        return None
+    
+    @staticmethod
+    def _store_idempotent_result(cursor: sqlite3.Cursor, key: Optional[str],
+                                 success: bool, amount: Optional[int] = None):
+        """Сохранить результат операции для повторов с тем же ключом"""
+        if key is not None:
+            cursor.execute("""
+                UPDATE idempotency_keys SET success = ?, amount = ? WHERE key = ?
+            """, (int(success), amount, key))
+    
+    # === Управление товарами ===
+    
+    @retry_on_lock
+    def add_product(self, name: str, quantity: int = 0, price: int = 0,
+                    user_id: Optional[int] = None) -> bool:
+        """
+        Добавить новый товар
+        
+        Args:
+            name: Наименование товара
+            quantity: Количество
+            price: Цена в копейках
+            user_id: ID пользователя, выполнившего операцию
+            
+        Returns:
+            True если успешно, False если товар уже существует
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("""
+                INSERT INTO products (name, quantity, price)
+                VALUES (?, ?, ?)
+            """, (name, quantity, price))
+            product_id = cursor.lastrowid
+            self._record_price(cursor, product_id, price, user_id)
+            self._record_stock_move(cursor, product_id, quantity, 'initial', user_id)
+            conn.commit()
+            self._audit(user_id, 'product_add', name, None, quantity)
+            self._audit(user_id, 'price', name, None, price)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            conn.close()
+    
+    def _sync_product_cache(self):
+        """
+        Вытеснить из кэша товары, изменившиеся после прошлой проверки
+        
+        Пока data_version не изменился, базу данных никто не менял и проверка
+        не читает таблиц. Иначе по счетчику изменений товаров вытесняются
+        только изменившиеся товары: операции кассы и журналы кэш не сбрасывают.
+        """
+        with self._version_lock:
+            version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_version:
+                return
+            self._data_version = version
+            
+            seq = self._version_conn.execute(
+                "SELECT value FROM counters WHERE name = 'products'"
+            ).fetchone()[0]
+            if self._cache_seq is not None and seq != self._cache_seq:
+                changed = [row[0] for row in self._version_conn.execute("""
+                    SELECT id FROM products WHERE updated_seq > ? LIMIT ?
+                """, (self._cache_seq, self.product_cache.size + 1))]
+                if len(changed) > self.product_cache.size:
+                    self.product_cache.clear()
+                else:
+                    self.product_cache.invalidate(product_ids=changed)
+            self._cache_seq = seq
+    
+    def get_product(self, name: str) -> Optional[Product]:
+        """
+        Получить товар по наименованию
+        
+        Запись может быть взята из кэша и общая для всех вызовов -
+        изменять ее нельзя.
+        """
+        self._sync_product_cache()
+        product = self.product_cache.get(name=name)
+        if product is not None:
+            return product
+        
+        generation = self.product_cache.generation
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = Product.row_factory
+        
+        cursor.execute(f"""
+            SELECT {Product.COLUMNS} FROM products WHERE name = ?
+        """, (name,))
+        
+        product = cursor.fetchone()
+        conn.close()
+        
+        if product is not None:
+            self.product_cache.put(product, generation)
+        return product
+    
+    def get_product_by_id(self, product_id: int) -> Optional[Product]:
+        """Получить товар по ID (см. get_product)"""
+        self._sync_product_cache()
+        product = self.product_cache.get(product_id=product_id)
+        if product is not None:
+            return product
+        
+        generation = self.product_cache.generation
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = Product.row_factory
+        
+        cursor.execute(f"SELECT {Product.COLUMNS} FROM products WHERE id = ?", (product_id,))
+        
+        product = cursor.fetchone()
+        conn.close()
+        
+        if product is not None:
+            self.product_cache.put(product, generation)
+        return product
+    
+    def get_product_id_by_sku(self, sku: str) -> Optional[int]:
+        """Найти ID товара по штрихкоду / артикулу (поиск по уникальному индексу)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id FROM products WHERE sku = ?", (sku,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        return row['id'] if row else None
+    
+    @retry_on_lock
+    def update_product_sku(self, name: str, sku: Optional[str],
+                           user_id: Optional[int] = None) -> bool:
+        """
+        Назначить товару штрихкод / артикул
+        
+        Args:
+            name: Наименование товара
+            sku: Штрихкод или артикул (None - убрать)
+            user_id: ID пользователя, выполнившего операцию
+            
+        Returns:
+            True если успешно, False если товар не найден или код уже занят
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("SELECT id, sku FROM products WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            cursor.execute("""
+                UPDATE products SET sku = ? WHERE id = ?
+            """, (sku, row['id']))
+            conn.commit()
+            self.product_cache.invalidate(names=(name,))
+            self._audit(user_id, 'sku', name, row['sku'], sku)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            conn.close()
+    
+    def get_products_seq(self) -> int:
+        """Номер последнего изменения товаров"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT value FROM counters WHERE name = 'products'")
+        result = cursor.fetchone()[0]
+        conn.close()
+        
+        return result
+    
+    def get_products_changed_since(self, seq: int) -> List[Product]:
+        """Получить товары, изменившиеся после изменения с номером seq"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = Product.row_factory
+        
+        cursor.execute(f"""
+            SELECT {Product.COLUMNS} FROM products
+            WHERE updated_seq > ?
+            ORDER BY updated_seq
+        """, (seq,))
+        products = cursor.fetchall()
+        conn.close()
+        
+        return products
+    
+    @retry_on_lock
+    def update_product_quantity(self, name: str, quantity: int,
+                                user_id: Optional[int] = None) -> bool:
+        """
+        Обновить количество товара (ручная корректировка)
+        
+        Args:
+            name: Наименование товара
+            quantity: Новое количество
+            user_id: ID пользователя, выполнившего операцию
+            
+        Returns:
+            True если успешно, False если товар не найден
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Запись блокируется до чтения: параллельная продажа не успеет изменить
+        # остаток между чтением и записью, и движение в журнале будет верным
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT id, quantity FROM products WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return False
+        
+        cursor.execute("""
+            UPDATE products SET quantity = ? WHERE id = ?
+        """, (quantity, row['id']))
+        self._record_stock_move(cursor, row['id'], quantity - row['quantity'], 'correction', user_id)
+        
+        conn.commit()
+        conn.close()
+        self.product_cache.invalidate(names=(name,))
+        self._audit(user_id, 'quantity', name, row['quantity'], quantity)
+        
+        return True
+    
+    @retry_on_lock
+    def update_product_price(self, name: str, price: int,
+                             user_id: Optional[int] = None) -> bool:
+        """
+        Обновить цену товара
+        
+        Прежние цены не перезаписываются, а остаются в истории цен.
+        
+        Args:
+            name: Наименование товара
+            price: Новая цена в копейках
+            user_id: ID пользователя, выполнившего операцию
+            
+        Returns:
+            True если успешно, False если товар не найден
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Прежняя цена для журнала аудита читается в той же транзакции
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT id, price FROM products WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return False
+        
+        cursor.execute("""
+            UPDATE products SET price = ? WHERE id = ?
+        """, (price, row['id']))
+        self._record_price(cursor, row['id'], price, user_id)
+        
+        conn.commit()
+        conn.close()
+        self.product_cache.invalidate(names=(name,))
+        self._audit(user_id, 'price', name, row['price'], price)
+        
+        return True
+    
+    @retry_on_lock
+    def add_product_quantity(self, name: str, quantity: int,
+                             user_id: Optional[int] = None) -> bool:
+        """
+        Добавить количество к существующему товару (приход)
+        
+        Args:
+            name: Наименование товара
+            quantity: Количество для добавления
+            user_id: ID пользователя, выполнившего операцию
+            
+        Returns:
+            True если успешно, False если товар не найден
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Как в update_product_quantity: блокировка до чтения остатка
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT id, quantity FROM products WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return False
+        
+        cursor.execute("""
+            UPDATE products SET quantity = quantity + ? WHERE id = ?
+        """, (quantity, row['id']))
+        self._record_stock_move(cursor, row['id'], quantity, 'receipt', user_id)
+        
+        conn.commit()
+        conn.close()
+        self.product_cache.invalidate(names=(name,))
+        self._audit(user_id, 'receipt', name, row['quantity'], row['quantity'] + quantity)
+        
+        return True
+    
+    # === Продажа товара ===
+    
+    @retry_on_lock
+    def sell_product(self, name: str, quantity: int, user_id: Optional[int] = None,
+                     idempotency_key: Optional[str] = None) -> Tuple[bool, Optional[int]]:
+        """
+        Продать товар
+        
+        Args:
+            name: Наименование товара
+            quantity: Количество для продажи
+            user_id: ID пользователя, выполнившего операцию
+            idempotency_key: Ключ операции; повтор с тем же ключом возвращает
+                сохраненный результат и ничего не меняет
+            
+        Returns:
+            (success, total_price) - успех операции и общая стоимость в копейках
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Блокировка записи берется до чтения остатка: параллельная продажа
+        # дождется коммита и увидит уже уменьшенный остаток, а повтор с тем же
+        # ключом - сохраненный результат
+        cursor.execute("BEGIN IMMEDIATE")
+        if idempotency_key is not None:
+            stored = self._claim_idempotency_key(cursor, idempotency_key)
+            if stored is not None:
+                conn.close()
+                return (bool(stored['success']), stored['amount'])
+        
+        # Получить товар
+        cursor.execute("SELECT id, quantity, price FROM products WHERE name = ?", (name,))
+        product = cursor.fetchone()
+        if not product or product['quantity'] < quantity:
+            self._store_idempotent_result(cursor, idempotency_key, False)
+            conn.commit()
+            conn.close()
+            return (False, None)
+        
+        # Обновить количество
+        cursor.execute("""
+            UPDATE products SET quantity = quantity - ? WHERE id = ?
+        """, (quantity, product['id']))
+        self._record_stock_move(cursor, product['id'], -quantity, 'sale', user_id)
+        
+        # Рассчитать стоимость по действующей цене
+        price = self._current_price(cursor, product['id'])
+        if price is None:
+            price = product['price']
+        total_price = price * quantity
+        
+        # Добавить в кассу
+        cursor.execute("""
+            INSERT INTO cashbox (amount, transaction_type, description)
+            VALUES (?, 'sale', ?)
+        """, (total_price, f"Продажа: {name} x{quantity}"))
+        
+        # Запомнить цену продажи
+        cursor.execute("""
+            INSERT INTO sales (product_id, quantity, price, amount, cashbox_id, user_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (product['id'], quantity, price, total_price, cursor.lastrowid, user_id))
+        self._store_idempotent_result(cursor, idempotency_key, True, total_price)
+        
+        conn.commit()
+        conn.close()
+        self.product_cache.invalidate(names=(name,))
+        self._audit(user_id, 'sale', name, product['quantity'], product['quantity'] - quantity)
+        
+        return (True, total_price)
+    
+    # === Категории ===
+    
+    def get_category(self, category_id: int) -> Optional[Dict]:
+        """Получить категорию по ID (id, name, parent_id, product_count)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT id, name, parent_id, product_count FROM categories WHERE id = ?
+        """, (category_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        return dict(row) if row else None
+    
+    def get_child_categories(self, parent_id: Optional[int] = None) -> List[Dict]:
+        """
+        Получить подкатегории одной категории (поиск по индексу parent_id)
+        
+        Args:
+            parent_id: ID категории (None - категории верхнего уровня)
+            
+        Returns:
+            id, name, parent_id, product_count (товаров во всем поддереве)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT id, name, parent_id, product_count FROM categories
+            WHERE parent_id IS ?
+            ORDER BY name
+        """, (parent_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    def get_category_products(self, category_id: Optional[int]) -> List[Product]:
+        """
+        Получить товары, лежащие непосредственно в категории, по наименованию
+        
+        Args:
+            category_id: ID категории (None - товары без категории)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = Product.row_factory
+        
+        cursor.execute(f"""
+            SELECT {Product.COLUMNS} FROM products
+            WHERE category_id IS ?
+            ORDER BY name
+        """, (category_id,))
+        products = cursor.fetchall()
+        conn.close()
+        
+        return products
+    
+    def count_uncategorized_products(self) -> int:
+        """Количество товаров без категории"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT COUNT(*) FROM products WHERE category_id IS NULL")
+        result = cursor.fetchone()[0]
+        conn.close()
+        
+        return result
+    
+    def get_category_path(self, category_id: int) -> List[str]:
+        """Наименования категорий от верхнего уровня до указанной"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Предок с большим числом собственных предков лежит глубже
+        cursor.execute("""
+            SELECT c.name FROM category_paths p
+            JOIN categories c ON c.id = p.ancestor_id
+            WHERE p.descendant_id = ?
+            ORDER BY (SELECT COUNT(*) FROM category_paths WHERE descendant_id = p.ancestor_id)
+        """, (category_id,))
+        names = [row['name'] for row in cursor.fetchall()]
+        conn.close()
+        
+        return names
+    
+    @retry_on_lock
+    def find_category(self, names: List[str], create: bool = False) -> Optional[int]:
+        """
+        Найти (или создать) цепочку категорий
+        
+        Args:
+            names: Наименования от верхнего уровня, например ["Молочка", "Сыры"]
+            create: Создать недостающие категории
+            
+        Returns:
+            ID последней категории цепочки или None, если она не найдена
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        parent_id = None
+        for name in names:
             cursor.execute("""
-                INSERT INTO cashbox (amount, transaction_type, description)
-                VALUES (0.0, 'initial', 'Начальный баланс')
-            """)
+                SELECT id FROM categories WHERE parent_id IS ? AND name = ?
+            """, (parent_id, name))
+            row = cursor.fetchone()
+            if row:
+                parent_id = row['id']
+            elif create:
+                cursor.execute("""
+                    INSERT INTO categories (name, parent_id) VALUES (?, ?)
+                """, (name, parent_id))
+                parent_id = cursor.lastrowid
+            else:
+                conn.close()
+                return None
         
         conn.commit()
         conn.close()
+        
+        return parent_id
     
-    # === Управление товарами ===
-    
-    def add_product(self, name: str, quantity: int = 0, price: float = 0.0) -> bool:
+    @retry_on_lock
+    def update_product_category(self, name: str, category_id: Optional[int],
+                                user_id: Optional[int] = None) -> bool:
         """
-        Добавить новый товар
+        Перенести товар в категорию (счетчики категорий обновляют триггеры)
         
         Args:
             name: Наименование товара
-            quantity: Количество
-            price: Цена
+            category_id: ID категории (None - убрать из категории)
+            user_id: ID пользователя, выполнившего операцию
             
         Returns:
-            True если успешно, False если товар уже существует
+            True если успешно, False если товар или категория не найдены
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        try:
-            cursor.execute("""
-                INSERT INTO products (name, quantity, price)
-                VALUES (?, ?, ?)
-            """, (name, quantity, price))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-        finally:
+        if category_id is not None:
+            cursor.execute("SELECT 1 FROM categories WHERE id = ?", (category_id,))
+            if not cursor.fetchone():
+                conn.close()
+                return False
+        
+        cursor.execute("SELECT category_id FROM products WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if not row:
             conn.close()
-    
-    def get_product(self, name: str) -> Optional[Dict]:
-        """Получить товар по наименованию"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+            return False
         
         cursor.execute("""
-            SELECT * FROM products WHERE name = ?
-        """, (name,))
+            UPDATE products SET category_id = ? WHERE name = ?
+        """, (category_id, name))
         
-        row = cursor.fetchone()
+        conn.commit()
         conn.close()
+        self.product_cache.invalidate(names=(name,))
+        if self.audit_sink is not None:
+            before = " / ".join(self.get_category_path(row['category_id'])) if row['category_id'] else None
+            after = " / ".join(self.get_category_path(category_id)) if category_id else None
+            self._audit(user_id, 'category', name, before, after)
         
-        if row:
-            return dict(row)
-        return None
+        return True
+    
+    # === Массовое изменение цен ===
+    
+    @staticmethod
+    def _reprice_query(rule: RepriceRule, name_filter: Optional[str],
+                       category_id: Optional[int]) -> Tuple[str, tuple, str, list]:
+        """Выражение новой цены с параметрами и условие отбора товаров с параметрами"""
+        expression, expression_params = rule.sql()
+        conditions = [f"{expression} != price"]
+        params = list(expression_params)
+        if category_id is not None:
+            conditions.append("""
+                category_id IN (SELECT descendant_id FROM category_paths WHERE ancestor_id = ?)
+            """)
+            params.append(category_id)
+        if name_filter:
+            escaped = name_filter.casefold().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("casefold(name) LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        return expression, expression_params, " AND ".join(conditions), params
     
-    def get_all_products(self) -> List[Dict]:
-        """Получить все товары"""
+    def preview_reprice(self, rule: RepriceRule, name_filter: Optional[str] = None,
+                        limit: int = 5, category_id: Optional[int] = None) -> Dict:
+        """
+        Предпросмотр массового изменения цен
+        
+        Args:
+            rule: Правило изменения цены
+            name_filter: Только товары, в наименовании которых есть эта строка
+            limit: Сколько товаров показать в примере
+            category_id: Только товары этой категории и ее подкатегорий
+            
+        Returns:
+            count - сколько цен изменится, samples - примеры (name, price, new_price)
+        """
+        expression, expression_params, where, params = self._reprice_query(rule, name_filter, category_id)
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT * FROM products ORDER BY name")
-        rows = cursor.fetchall()
+        cursor.execute(f"SELECT COUNT(*) FROM products WHERE {where}", params)
+        count = cursor.fetchone()[0]
+        cursor.execute(f"""
+            SELECT name, price, {expression} AS new_price FROM products
+            WHERE {where}
+            ORDER BY name
+            LIMIT ?
+        """, (*expression_params, *params, limit))
+        samples = [dict(row) for row in cursor.fetchall()]
         conn.close()
         
-        return [dict(row) for row in rows]
+        return {'count': count, 'samples': samples}
     
-    def update_product_quantity(self, name: str, quantity: int) -> bool:
+    @retry_on_lock
+    def bulk_reprice(self, rule: RepriceRule, name_filter: Optional[str] = None,
+                     user_id: Optional[int] = None, category_id: Optional[int] = None) -> int:
         """
-        Обновить количество товара
+        Изменить цены всех подходящих товаров по правилу одной транзакцией
+        
+        История цен пишется одним INSERT ... SELECT, цены меняются одним
+        UPDATE с тем же выражением - без запроса на каждый товар.
         
         Args:
-            name: Наименование товара
-            quantity: Новое количество
+            rule: Правило изменения цены
+            name_filter: Только товары, в наименовании которых есть эта строка
+            user_id: ID пользователя, выполнившего операцию
+            category_id: Только товары этой категории и ее подкатегорий
             
         Returns:
-            True если успешно, False если товар не найден
+            Количество товаров, цена которых изменилась
         """
+        expression, expression_params, where, params = self._reprice_query(rule, name_filter, category_id)
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            UPDATE products SET quantity = ? WHERE name = ?
-        """, (quantity, name))
+        cursor.execute(f"""
+            INSERT INTO prices (product_id, price, user_id)
+            SELECT id, {expression}, ? FROM products
+            WHERE {where}
+        """, (*expression_params, user_id, *params))
+        cursor.execute(f"""
+            UPDATE products SET price = {expression}
+            WHERE {where}
+        """, (*expression_params, *params))
+        count = cursor.rowcount
         
-        success = cursor.rowcount > 0
         conn.commit()
         conn.close()
+        self.product_cache.clear()
+        target = rule.describe()
+        if category_id is not None:
+            target += f" | #{' / '.join(self.get_category_path(category_id))}"
+        if name_filter:
+            target += f" | {name_filter}"
+        self._audit(user_id, 'reprice', target, None, count)
         
-        return success
+        return count
+    
+    # === Сводка по складу ===
     
-    def update_product_price(self, name: str, price: float) -> bool:
+    def get_inventory_summary(self) -> Dict:
         """
-        Обновить цену товара
+        Получить сводку по складу
         
-        Args:
-            name: Наименование товара
-            price: Новая цена
-            
         Returns:
-            True если успешно, False если товар не найден
+            product_count, total_quantity, total_value (в копейках), out_of_stock
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
-            UPDATE products SET price = ? WHERE name = ?
-        """, (price, name))
+            SELECT product_count, total_quantity, total_value, out_of_stock
+            FROM inventory_summary WHERE id = 1
+        """)
+        row = cursor.fetchone()
+        conn.close()
         
-        success = cursor.rowcount > 0
-        conn.commit()
+        return dict(row)
+    
+    def get_top_value_products(self, limit: int = 5) -> List[Product]:
+        """Получить товары с наибольшей стоимостью остатка"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = Product.row_factory
+        
+        cursor.execute(f"""
+            SELECT {Product.COLUMNS} FROM products
+            ORDER BY quantity * price DESC
+            LIMIT ?
+        """, (limit,))
+        products = cursor.fetchall()
         conn.close()
         
-        return success
+        return products
+    
+    # === История цен ===
+    
+    def _record_price(self, cursor: sqlite3.Cursor, product_id: int, price: int,
+                      user_id: Optional[int] = None):
+        """Добавить цену в историю (в рамках текущей транзакции)"""
+        cursor.execute("""
+            INSERT INTO prices (product_id, price, user_id)
+            VALUES (?, ?, ?)
+        """, (product_id, price, user_id))
+    
+    def _current_price(self, cursor: sqlite3.Cursor, product_id: int,
+                       at: Optional[str] = None) -> Optional[int]:
+        """Цена товара, действующая на момент at (по умолчанию - сейчас)"""
+        if at is None:
+            cursor.execute("""
+                SELECT price FROM prices
+                WHERE product_id = ?
+                ORDER BY valid_from DESC, id DESC
+                LIMIT 1
+            """, (product_id,))
+        else:
+            cursor.execute("""
+                SELECT price FROM prices
+                WHERE product_id = ? AND valid_from <= ?
+                ORDER BY valid_from DESC, id DESC
+                LIMIT 1
+            """, (product_id, at))
+        row = cursor.fetchone()
+        return row['price'] if row else None
     
-    def add_product_quantity(self, name: str, quantity: int) -> bool:
+    def get_price_at(self, name: str, at: str) -> Optional[int]:
         """
-        Добавить количество к существующему товару
+        Получить цену товара на момент времени (для переоценки прошлых продаж)
         
         Args:
             name: Наименование товара
-            quantity: Количество для добавления
+            at: Момент времени в формате 'YYYY-MM-DD HH:MM:SS' (UTC)
             
         Returns:
-            True если успешно, False если товар не найден
+            Цена в копейках или None, если товар не найден или еще не имел цены
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        cursor.execute("SELECT id FROM products WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        price = self._current_price(cursor, row['id'], at) if row else None
+        conn.close()
+        
+        return price
+    
+    def get_price_history(self, name: str, limit: int = 10) -> List[Dict]:
+        """Получить последние изменения цены товара"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
         cursor.execute("""
-            UPDATE products SET quantity = quantity + ? WHERE name = ?
-        """, (quantity, name))
+            SELECT pr.* FROM prices pr
+            JOIN products p ON p.id = pr.product_id
+            WHERE p.name = ?
+            ORDER BY pr.valid_from DESC, pr.id DESC
+            LIMIT ?
+        """, (name, limit))
         
-        success = cursor.rowcount > 0
-        conn.commit()
+        rows = cursor.fetchall()
         conn.close()
         
-        return success
+        return [dict(row) for row in rows]
     
-    # === Продажа товара ===
+    # === Журнал движения товара ===
     
-    def sell_product(self, name: str, quantity: int) -> Tuple[bool, Optional[float]]:
+    def _record_stock_move(self, cursor: sqlite3.Cursor, product_id: int, delta: int,
+                           move_type: str, user_id: Optional[int] = None):
         """
-        Продать товар
+        Записать движение товара в журнал (в рамках текущей транзакции)
+        
+        Остаток товара к этому моменту уже должен быть обновлен, чтобы
+        периодический снимок совпадал с журналом. Снимок делается только для
+        этого товара, когда после его прошлого снимка накопилось
+        SNAPSHOT_INTERVAL движений: цена снимка не зависит от размера каталога.
+        """
+        cursor.execute("""
+            INSERT INTO stock_moves (product_id, delta, move_type, user_id)
+            VALUES (?, ?, ?, ?)
+        """, (product_id, delta, move_type, user_id))
+        move_id = cursor.lastrowid
+        
+        # Счет идет по индексу (product_id, id) и не длиннее SNAPSHOT_INTERVAL
+        cursor.execute("""
+            SELECT COUNT(*) FROM stock_moves
+            WHERE product_id = ? AND id > COALESCE(
+                (SELECT MAX(move_id) FROM stock_snapshots WHERE product_id = ?), 0
+            )
+        """, (product_id, product_id))
+        if cursor.fetchone()[0] >= self.SNAPSHOT_INTERVAL:
+            cursor.execute("""
+                INSERT INTO stock_snapshots (product_id, quantity, move_id)
+                SELECT id, quantity, ? FROM products WHERE id = ?
+            """, (move_id, product_id))
+    
+    def _snapshot_stock(self, cursor: sqlite3.Cursor, move_id: int):
+        """Сохранить снимок остатков всех товаров на момент движения move_id"""
+        cursor.execute("""
+            INSERT INTO stock_snapshots (product_id, quantity, move_id)
+            SELECT id, quantity, ? FROM products
+        """, (move_id,))
+    
+    @retry_on_lock
+    def create_stock_snapshot(self):
+        """Сделать снимок остатков вне очереди (например, при закрытии дня)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_moves")
+        self._snapshot_stock(cursor, cursor.fetchone()[0])
+        
+        conn.commit()
+        conn.close()
+    
+    def get_stock_moves(self, name: str, limit: int = 10) -> List[Dict]:
+        """Получить последние движения товара"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT m.* FROM stock_moves m
+            JOIN products p ON p.id = m.product_id
+            WHERE p.name = ?
+            ORDER BY m.id DESC
+            LIMIT ?
+        """, (name, limit))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    def get_stock_at(self, name: str, at: str) -> Optional[int]:
+        """
+        Восстановить остаток товара на момент времени
+        
+        Берется последний снимок до указанного момента и к нему
+        прибавляются движения, сделанные после снимка.
         
         Args:
             name: Наименование товара
-            quantity: Количество для продажи
+            at: Момент времени в формате 'YYYY-MM-DD HH:MM:SS' (UTC)
             
         Returns:
-            (success, total_price) - успех операции и общая стоимость
+            Остаток товара или None, если товар не найден
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Получить товар
-        product = self.get_product(name)
-        if not product:
+        cursor.execute("SELECT id FROM products WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if not row:
             conn.close()
-            return (False, None)
+            return None
+        product_id = row['id']
         
-        if product['quantity'] < quantity:
-            conn.close()
-            return (False, None)
+        cursor.execute("""
+            SELECT quantity, move_id FROM stock_snapshots
+            WHERE product_id = ? AND created_at <= ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        """, (product_id, at))
+        snapshot = cursor.fetchone()
+        base, move_id = (snapshot['quantity'], snapshot['move_id']) if snapshot else (0, 0)
         
-        # Обновить количество
         cursor.execute("""
-            UPDATE products SET quantity = quantity - ? WHERE name = ?
-        """, (quantity, name))
+            SELECT COALESCE(SUM(delta), 0) FROM stock_moves
+            WHERE product_id = ? AND id > ? AND created_at <= ?
+        """, (product_id, move_id, at))
+        delta = cursor.fetchone()[0]
+        conn.close()
         
-        # Рассчитать стоимость
-        total_price = product['price'] * quantity
+        return base + delta
+    
+    # === Продажи по дням (прогноз спроса) ===
+    
+    def get_daily_sales(self, date_from: date, days: int,
+                        tz: tzinfo = timezone.utc) -> List[Tuple[int, int, int]]:
+        """
+        Продажи товаров по дням за период, одним запросом
         
-        # Добавить в кассу
-        cursor.execute("""
-            INSERT INTO cashbox (amount, transaction_type, description)
-            VALUES (?, 'sale', ?)
-        """, (total_price, f"Продажа: {name} x{quantity}"))
+        Строки не группируются: GROUP BY по товару и дню в SQLite идет через
+        сортировку всех продаж периода и на порядок медленнее самой выборки
+        по индексу idx_sales_created. Суммирует их получатель (прогноз спроса
+        складывает их в матрицу средствами NumPy).
         
-        conn.commit()
+        Args:
+            date_from: Первый день периода (по местному времени)
+            days: Длина периода в днях
+            tz: Часовой пояс, по которому определяются границы дней
+                (берется смещение на начало периода)
+            
+        Returns:
+            Список (product_id, номер дня от date_from, количество) - по строке
+            на продажу
+        """
+        start_at = datetime.combine(date_from, time.min, tz)
+        start = self._utc_timestamp(start_at)
+        end = self._utc_timestamp(datetime.combine(date_from + timedelta(days=days), time.min, tz))
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute("""
+            SELECT product_id, (CAST(strftime('%s', created_at) AS INTEGER) - ?) / 86400, quantity
+            FROM sales
+            WHERE created_at >= ? AND created_at < ?
+        """, (int(start_at.timestamp()), start, end))
+        rows = cursor.fetchall()
         conn.close()
         
-        return (True, total_price)
+        return rows
     
     # === Управление кассой ===
     
-    def get_cashbox_balance(self) -> float:
-        """Получить текущий баланс кассы"""
+    def get_cashbox_balance(self) -> int:
+        """Получить текущий баланс кассы в копейках"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -256,72 +1517,271 @@ class Database:
         result = cursor.fetchone()[0]
         conn.close()
         
-        return result if result else 0.0
+        return result if result else 0
     
-    def add_cash(self, amount: float, description: str = "") -> bool:
+    @retry_on_lock
+    def add_cash(self, amount: int, description: str = "",
+                 user_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> bool:
         """
         Добавить деньги в кассу
         
         Args:
-            amount: Сумма
+            amount: Сумма в копейках
             description: Описание операции
+            user_id: ID пользователя, выполнившего операцию
+            idempotency_key: Ключ операции (см. sell_product)
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        if idempotency_key is not None:
+            stored = self._claim_idempotency_key(cursor, idempotency_key)
+            if stored is not None:
+                conn.close()
+                return bool(stored['success'])
+        
         cursor.execute("""
             INSERT INTO cashbox (amount, transaction_type, description)
             VALUES (?, 'income', ?)
         """, (amount, description or "Пополнение кассы"))
+        self._store_idempotent_result(cursor, idempotency_key, True, amount)
         
         conn.commit()
         conn.close()
+        if self.audit_sink is not None:
+            balance = self.get_cashbox_balance()
+            self._audit(user_id, 'cash_income', None, balance - amount, balance)
         
         return True
     
-    def withdraw_cash(self, amount: float, description: str = "") -> bool:
+    @retry_on_lock
+    def withdraw_cash(self, amount: int, description: str = "",
+                      user_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> bool:
         """
         Снять деньги из кассы
         
         Args:
-            amount: Сумма
+            amount: Сумма в копейках
             description: Описание операции
+            user_id: ID пользователя, выполнившего операцию
+            idempotency_key: Ключ операции (см. sell_product)
             
         Returns:
             True если успешно, False если недостаточно средств
         """
-        balance = self.get_cashbox_balance()
-        if balance < amount:
-            return False
-        
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Два параллельных снятия не должны оба пройти проверку баланса
+        cursor.execute("BEGIN IMMEDIATE")
+        if idempotency_key is not None:
+            stored = self._claim_idempotency_key(cursor, idempotency_key)
+            if stored is not None:
+                conn.close()
+                return bool(stored['success'])
+        
+        cursor.execute("SELECT COALESCE(SUM(amount), 0) FROM cashbox")
+        balance = cursor.fetchone()[0]
+        if balance < amount:
+            self._store_idempotent_result(cursor, idempotency_key, False)
+            conn.commit()
+            conn.close()
+            return False
+        
         cursor.execute("""
             INSERT INTO cashbox (amount, transaction_type, description)
             VALUES (?, 'expense', ?)
         """, (-amount, description or "Снятие из кассы"))
+        self._store_idempotent_result(cursor, idempotency_key, True, amount)
         
         conn.commit()
         conn.close()
+        self._audit(user_id, 'cash_expense', None, balance, balance - amount)
         
         return True
     
-    def get_cashbox_history(self, limit: int = 10) -> List[Dict]:
-        """Получить историю операций кассы"""
+    def get_cashbox_history(self, limit: int = 10, transaction_type: Optional[str] = None,
+                            date_from: Optional[date] = None, date_to: Optional[date] = None,
+                            tz: tzinfo = timezone.utc, before_id: Optional[int] = None,
+                            after_id: Optional[int] = None) -> List[Dict]:
+        """
+        Получить страницу истории операций кассы, новые первыми
+        
+        Страницы листаются по ключу (created_at, id) последней показанной
+        операции, а не через OFFSET: любая страница - это один поиск по индексу
+        и чтение limit строк.
+        
+        Args:
+            limit: Количество операций на странице
+            transaction_type: Только операции этого типа (sale, income, expense)
+            date_from: Первый день периода (включительно, по местному времени)
+            date_to: Последний день периода (включительно, по местному времени)
+            tz: Часовой пояс, по которому определяются границы дней
+            before_id: Операции старше операции с этим ID (следующая страница)
+            after_id: Операции новее операции с этим ID (предыдущая страница)
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            SELECT * FROM cashbox 
-            ORDER BY created_at DESC 
+        conditions = []
+        params = []
+        if transaction_type is not None:
+            conditions.append("transaction_type = ?")
+            params.append(transaction_type)
+        if date_from is not None:
+            conditions.append("created_at >= ?")
+            params.append(self._utc_timestamp(datetime.combine(date_from, time.min, tz)))
+        if date_to is not None:
+            conditions.append("created_at < ?")
+            params.append(self._utc_timestamp(datetime.combine(date_to + timedelta(days=1), time.min, tz)))
+        
+        order = "DESC"
+        cursor_id = before_id if before_id is not None else after_id
+        if cursor_id is not None:
+            cursor.execute("SELECT created_at FROM cashbox WHERE id = ?", (cursor_id,))
+            row = cursor.fetchone()
+            if row is None:
+                conn.close()
+                return []
+            if before_id is not None:
+                conditions.append("(created_at, id) < (?, ?)")
+            else:
+                conditions.append("(created_at, id) > (?, ?)")
+                order = "ASC"
+            params.extend((row['created_at'], cursor_id))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        cursor.execute(f"""
+            SELECT * FROM cashbox {where}
+            ORDER BY created_at {order}, id {order}
             LIMIT ?
-        """, (limit,))
+        """, (*params, limit))
         
-        rows = cursor.fetchall()
+        rows = [dict(row) for row in cursor.fetchall()]
         conn.close()
         
-        return [dict(row) for row in rows]
+        if order == "ASC":
+            rows.reverse()
+        return rows
+    
+    # === Итоги дня (Z-отчет) ===
+    
+    @retry_on_lock
+    def close_day(self, day: date, tz: tzinfo = timezone.utc) -> Dict:
+        """
+        Посчитать и сохранить итоги дня кассы
+        
+        Операции дня выбираются одним проходом по диапазону индекса
+        (created_at, transaction_type, amount). Остаток на начало дня берется
+        из итогов предыдущего закрытого дня; операции между ним и этим днем
+        (если дни пропущены) досчитываются тем же диапазонным запросом.
+        Повторный вызов пересчитывает итоги; если после этого дня уже закрыты
+        другие, их остатки сдвигаются на изменение остатка этого дня.
+        
+        Args:
+            day: Дата (по местному времени)
+            tz: Часовой пояс, по которому определяются границы дня
+            
+        Returns:
+            Итоги дня (см. get_daily_close)
+        """
+        start = self._utc_timestamp(datetime.combine(day, time.min, tz))
+        end = self._utc_timestamp(datetime.combine(day + timedelta(days=1), time.min, tz))
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Остаток на начало дня
+        cursor.execute("""
+            SELECT day, closing_balance FROM daily_close
+            WHERE day < ? ORDER BY day DESC LIMIT 1
+        """, (day.isoformat(),))
+        previous = cursor.fetchone()
+        if previous:
+            previous_end = self._utc_timestamp(datetime.combine(
+                date.fromisoformat(previous['day']) + timedelta(days=1), time.min, tz
+            ))
+            cursor.execute("""
+                SELECT COALESCE(SUM(amount), 0) FROM cashbox
+                WHERE created_at >= ? AND created_at < ?
+            """, (previous_end, start))
+            opening_balance = previous['closing_balance'] + cursor.fetchone()[0]
+        else:
+            cursor.execute("""
+                SELECT COALESCE(SUM(amount), 0) FROM cashbox WHERE created_at < ?
+            """, (start,))
+            opening_balance = cursor.fetchone()[0]
+        
+        # Операции за день
+        cursor.execute("""
+            SELECT
+                COALESCE(SUM(transaction_type = 'sale'), 0) AS sales_count,
+                COALESCE(SUM(CASE WHEN transaction_type = 'sale' THEN amount END), 0) AS revenue,
+                COALESCE(SUM(CASE WHEN transaction_type = 'income' THEN amount END), 0) AS deposits,
+                COALESCE(SUM(CASE WHEN transaction_type = 'expense' THEN -amount END), 0) AS withdrawals,
+                COALESCE(SUM(amount), 0) AS net
+            FROM cashbox
+            WHERE created_at >= ? AND created_at < ?
+        """, (start, end))
+        totals = dict(cursor.fetchone())
+        net = totals.pop('net')
+        
+        report = {
+            'day': day.isoformat(),
+            **totals,
+            'opening_balance': opening_balance,
+            'closing_balance': opening_balance + net,
+        }
+        cursor.execute("""
+            INSERT OR REPLACE INTO daily_close
+                (day, sales_count, revenue, deposits, withdrawals, opening_balance, closing_balance)
+            VALUES (:day, :sales_count, :revenue, :deposits, :withdrawals, :opening_balance, :closing_balance)
+        """, report)
+        
+        # Остаток на начало следующего закрытого дня считался от прежних
+        # итогов; остатки всех последующих дней расходятся с ними на одну сумму
+        cursor.execute("""
+            SELECT day, opening_balance FROM daily_close
+            WHERE day > ? ORDER BY day LIMIT 1
+        """, (day.isoformat(),))
+        following = cursor.fetchone()
+        if following:
+            following_start = self._utc_timestamp(datetime.combine(
+                date.fromisoformat(following['day']), time.min, tz
+            ))
+            cursor.execute("""
+                SELECT COALESCE(SUM(amount), 0) FROM cashbox
+                WHERE created_at >= ? AND created_at < ?
+            """, (end, following_start))
+            shift = report['closing_balance'] + cursor.fetchone()[0] - following['opening_balance']
+            if shift:
+                cursor.execute("""
+                    UPDATE daily_close
+                    SET opening_balance = opening_balance + ?, closing_balance = closing_balance + ?
+                    WHERE day > ?
+                """, (shift, shift, day.isoformat()))
+        
+        conn.commit()
+        conn.close()
+        
+        return report
+    
+    def get_daily_close(self, day: date) -> Optional[Dict]:
+        """
+        Получить итоги дня (поиск по первичному ключу)
+        
+        Returns:
+            day, sales_count, revenue, deposits, withdrawals, opening_balance,
+            closing_balance (суммы в копейках) или None, если день не закрыт
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM daily_close WHERE day = ?", (day.isoformat(),))
+        row = cursor.fetchone()
+        conn.close()
+        
+        return dict(row) if row else None
     
     # === Управление администраторами ===
     
@@ -336,13 +1796,16 @@ class Database:
         
         return result
     
-    def add_admin(self, user_id: int, username: str = None) -> bool:
+    @retry_on_lock
+    def add_admin(self, user_id: int, username: str = None,
+                  added_by: Optional[int] = None) -> bool:
         """
         Добавить администратора
         
         Args:
             user_id: ID пользователя Telegram
             username: Имя пользователя (опционально)
+            added_by: ID администратора, выполнившего операцию
             
         Returns:
             True если успешно, False если уже является админом
@@ -356,18 +1819,21 @@ class Database:
                 VALUES (?, ?)
             """, (user_id, username))
             conn.commit()
+            self._audit(added_by, 'admin_add', user_id)
             return True
         except sqlite3.IntegrityError:
             return False
         finally:
             conn.close()
     
-    def remove_admin(self, user_id: int) -> bool:
+    @retry_on_lock
+    def remove_admin(self, user_id: int, removed_by: Optional[int] = None) -> bool:
         """
         Удалить администратора
         
         Args:
             user_id: ID пользователя Telegram
+            removed_by: ID администратора, выполнившего операцию
             
         Returns:
             True если успешно, False если не найден
@@ -379,9 +1845,29 @@ class Database:
         success = cursor.rowcount > 0
         conn.commit()
         conn.close()
+        if success:
+            self._audit(removed_by, 'admin_remove', user_id)
         
         return success
     
+    @retry_on_lock
+    def update_admin_usernames(self, usernames: List[Tuple[int, Optional[str]]]):
+        """
+        Обновить имена пользователей администраторов одной транзакцией
+        
+        Args:
+            usernames: Пары (user_id, username)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.executemany("""
+            UPDATE admins SET username = ? WHERE user_id = ?
+        """, [(username, user_id) for user_id, username in usernames])
+        
+        conn.commit()
+        conn.close()
+    
     def get_all_admins(self) -> List[Dict]:
         """Получить список всех администраторов"""
         conn = self.get_connection()
@@ -392,4 +1878,65 @@ class Database:
         conn.close()
         
         return [dict(row) for row in rows]
-
+    
+    # === Журнал аудита ===
+    
+    @retry_on_lock
+    def add_audit_entries(self, entries: List[Tuple]):
+        """
+        Записать пачку записей журнала аудита одной транзакцией
+        
+        Args:
+            entries: Кортежи (user_id, action, target, before, after, created_at)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.executemany("""
+            INSERT INTO audit_log (user_id, action, target, before, after, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, entries)
+        
+        conn.commit()
+        conn.close()
+    
+    def get_audit_log(self, limit: int = 20, user_id: Optional[int] = None,
+                      target: Optional[str] = None, before_id: Optional[int] = None) -> List[Dict]:
+        """
+        Получить записи журнала аудита, новые первыми
+        
+        Отбор по пользователю или объекту идет по индексу (user_id, id) или
+        (target, id); before_id - продолжить со записей старше указанной.
+        
+        Args:
+            limit: Количество записей
+            user_id: Только операции этого пользователя
+            target: Только операции над этим объектом
+            before_id: Только записи с id меньше указанного
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if target is not None:
+            conditions.append("target = ?")
+            params.append(target)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        cursor.execute(f"""
+            SELECT * FROM audit_log {where}
+            ORDER BY id DESC
+            LIMIT ?
+        """, (*params, limit))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
@@ -0,0 +1,198 @@
+"""
+Прогноз спроса и рекомендации по дозаказу
+
+Для каждого товара по продажам за последние history_days полных дней
+считаются:
+- скользящее среднее продаж в день за последние window дней;
+- экспоненциально сглаженные продажи в день (коэффициент alpha).
+Сглаженное значение - прогноз спроса в день. Рекомендуемый дозаказ -
+сколько докупить, чтобы остатка хватило на lead_time + cover_days дней
+(поставка едет lead_time дней и должна покрыть еще cover_days). Для
+товаров, которые начали продаваться позже начала периода, среднее и
+сглаживание считаются с первого дня продаж.
+
+Продажи читаются одним запросом (Storage.get_daily_sales) в матрицу
+«товар x день», дальше расчет идет операциями NumPy над всей матрицей, без
+циклов по товарам. NumPy - необязательная зависимость: без него прогноз
+недоступен, остальной бот работает.
+"""
+import importlib.util
+import logging
+import time
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def numpy_available() -> bool:
+    """Проверить, установлен ли NumPy (сам NumPy при этом не импортируется)"""
+    return importlib.util.find_spec("numpy") is not None
+
+
+class Forecast(NamedTuple):
+    """Прогноз по товару"""
+    name: str
+    stock: int
+    # Продаж в день: скользящее среднее и экспоненциальное сглаживание
+    moving_average: float
+    smoothed: float
+    # Рекомендуемый дозаказ, шт.
+    reorder: int
+    # На сколько дней хватит остатка (None - продаж не было)
+    days_left: Optional[float]
+
+
+def sales_matrix(product_ids: Sequence[int], sales: Sequence[tuple], days: int):
+    """
+    Матрица продаж «товар x день» (float64)
+
+    Args:
+        product_ids: ID товаров - порядок строк матрицы
+        sales: Строки Storage.get_daily_sales: (product_id, день, количество),
+            строки одной ячейки суммируются
+        days: Число дней (столбцов)
+    """
+    import numpy as np
+
+    ids = np.asarray(product_ids, dtype=np.int64)
+    if not len(ids) or not len(sales):
+        return np.zeros((len(ids), days))
+
+    data = np.asarray(sales, dtype=np.int64)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    positions = np.minimum(np.searchsorted(sorted_ids, data[:, 0]), len(ids) - 1)
+    # Продажи удаленных товаров и дней за границей периода пропускаются
+    known = (sorted_ids[positions] == data[:, 0]) & (data[:, 1] >= 0) & (data[:, 1] < days)
+    # Номер ячейки «товар x день»; повторы одной ячейки суммируются
+    cells = order[positions[known]] * days + data[known, 1]
+    return np.bincount(cells, weights=data[known, 2], minlength=len(ids) * days).reshape(len(ids), days)
+
+
+def forecast_arrays(matrix, stock, window: int, alpha: float, horizon: int):
+    """
+    Прогноз по матрице продаж
+
+    Args:
+        matrix: Продажи «товар x день» (sales_matrix), последний столбец - вчера
+        stock: Остатки товаров в порядке строк матрицы
+        window: Окно скользящего среднего в днях
+        alpha: Коэффициент экспоненциального сглаживания (0..1)
+        horizon: На сколько дней должно хватить остатка после дозаказа
+
+    Returns:
+        (moving_average, smoothed, reorder, days_left) - массивы по товарам;
+        days_left = inf для товаров без продаж
+    """
+    import numpy as np
+
+    days = matrix.shape[1]
+    stock = np.asarray(stock, dtype=np.float64)
+    sold = matrix > 0
+    # Первый день продаж (для товаров без продаж - 0, все значения там нулевые)
+    first = sold.argmax(axis=1)
+
+    # Скользящее среднее: дни до первой продажи в окно не входят
+    window_days = np.clip(days - first, 1, window)
+    moving_average = matrix[:, -window:].sum(axis=1) / window_days
+
+    # Экспоненциальное сглаживание s[t] = alpha * x[t] + (1 - alpha) * s[t - 1],
+    # s[0] = x[0], развернутое в сумму: последнее значение s - это матрица,
+    # умноженная на вектор весов (1 - alpha) ** (days - 1 - t)
+    decay = (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+    weights = alpha * decay
+    weights[0] = decay[0]
+    smoothed = matrix @ weights
+    # Сглаживание начинается с первого дня продаж: его вес - decay, а не alpha * decay
+    late = first > 0
+    smoothed[late] += matrix[late, first[late]] * (1 - alpha) ** (days - first[late])
+
+    reorder = np.maximum(np.ceil(smoothed * horizon - 1e-9) - stock, 0).astype(np.int64)
+    with np.errstate(divide='ignore'):
+        days_left = np.where(smoothed > 0, stock / smoothed, np.inf)
+    return moving_average, smoothed, reorder, days_left
+
+
+class DemandForecaster:
+    """Прогнозы по товарам, пересчитываемые фоновой задачей"""
+
+    def __init__(self, db, history_days: int = 90, window: int = 28, alpha: float = 0.3,
+                 lead_time: int = 7, cover_days: int = 14):
+        """
+        Args:
+            db: Хранилище (Storage)
+            history_days: За сколько последних дней брать продажи
+            window: Окно скользящего среднего в днях
+            alpha: Коэффициент экспоненциального сглаживания
+            lead_time: Сколько дней идет поставка
+            cover_days: На сколько дней после поставки должно хватить товара
+        """
+        self.db = db
+        self.history_days = history_days
+        self.window = window
+        self.alpha = alpha
+        self.lead_time = lead_time
+        self.cover_days = cover_days
+        self._forecasts: Dict[str, Forecast] = {}
+        self._reorder: List[Forecast] = []
+        # Момент последнего расчета (None - прогноз еще не считался)
+        self.computed_at: Optional[datetime] = None
+
+    def refresh(self, tz: tzinfo = timezone.utc) -> int:
+        """
+        Пересчитать прогнозы по всем товарам (выполняется в отдельном потоке)
+
+        Returns:
+            Количество товаров
+        """
+        started = time.monotonic()
+        # Каталог обновляет записи товаров на месте, поэтому наименования и
+        # остатки копируются один раз: расчет идет по одному срезу
+        products = [
+            (product.id, product.name, product.quantity)
+            for product in self.db.get_all_products()
+        ]
+        date_from = datetime.now(tz).date() - timedelta(days=self.history_days)
+        sales = self.db.get_daily_sales(date_from, self.history_days, tz)
+
+        matrix = sales_matrix([product_id for product_id, _, _ in products], sales, self.history_days)
+        moving_average, smoothed, reorder, days_left = forecast_arrays(
+            matrix, [quantity for _, _, quantity in products],
+            self.window, self.alpha, self.lead_time + self.cover_days
+        )
+
+        forecasts = {
+            name: Forecast(
+                name, quantity, average, level, amount,
+                None if left == float('inf') else left
+            )
+            for (_, name, quantity), average, level, amount, left in zip(
+                products, moving_average.tolist(), smoothed.tolist(),
+                reorder.tolist(), days_left.tolist()
+            )
+        }
+        # Словари заменяются целиком: обработчики читают их без блокировок
+        self._forecasts = forecasts
+        self._reorder = sorted(
+            (forecast for forecast in forecasts.values() if forecast.reorder > 0),
+            key=lambda forecast: (forecast.days_left, -forecast.reorder)
+        )
+        self.computed_at = datetime.now(tz)
+        logger.info(
+            f"Прогноз спроса: {len(forecasts)} товаров, {len(sales)} строк продаж, "
+            f"{time.monotonic() - started:.2f} с"
+        )
+        return len(forecasts)
+
+    def get(self, name: str) -> Optional[Forecast]:
+        """Прогноз по товару"""
+        return self._forecasts.get(name)
+
+    def reorder_list(self, limit: int = 20) -> List[Forecast]:
+        """Товары, которые пора дозаказать: сначала те, что закончатся раньше"""
+        return self._reorder[:limit]
+
+    def reorder_count(self) -> int:
+        """Сколько товаров пора дозаказать"""
+        return len(self._reorder)
@@ -0,0 +1,30 @@
+"""
+Счетчики работы бота
+
+Значения хранятся в памяти процесса и сбрасываются при перезапуске.
+Просмотр - командой /metrics (только для админов).
+"""
+import threading
+from collections import Counter
+from typing import Dict
+
+_counters: Counter = Counter()
+# Счетчики увеличиваются и из потоков пула (методы базы данных)
+_lock = threading.Lock()
+
+
+def inc(name: str, value: int = 1):
+    """Увеличить счетчик"""
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> int:
+    """Получить значение счетчика"""
+    return _counters[name]
+
+
+def snapshot() -> Dict[str, int]:
+    """Получить копию всех счетчиков"""
+    with _lock:
+        return dict(_counters)
@@ -0,0 +1,43 @@
+"""
+Денежные суммы
+
+В базе данных все суммы хранятся целым числом копеек, поэтому сложение и
+SUM() в SQL точные. Decimal используется только на границе с пользователем:
+при разборе введенной суммы и при выводе.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Копеек в рубле
+MINOR_UNITS = 100
+
+
+def parse_money(text: str) -> int:
+    """
+    Разобрать сумму в рублях, введенную пользователем
+    
+    Args:
+        text: Сумма, например "55", "55.5" или "55,50"
+        
+    Returns:
+        Сумма в копейках
+        
+    Raises:
+        ValueError: если строка не является суммой
+    """
+    try:
+        value = Decimal(text.strip().replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"Некорректная сумма: {text!r}")
+    if not value.is_finite():
+        raise ValueError(f"Некорректная сумма: {text!r}")
+    return int((value * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_decimal(minor: int) -> Decimal:
+    """Перевести копейки в рубли"""
+    return Decimal(minor) / MINOR_UNITS
+
+
+def format_money(minor: int) -> str:
+    """Сумма в копейках в виде строки рублей с двумя знаками: 5550 -> '55.50'"""
+    return f"{to_decimal(minor):.2f}"
@@ -0,0 +1,275 @@
+"""
+Очередь исходящих сообщений Telegram
+
+Обработчики не обращаются к Bot API напрямую, а ставят сообщения в очередь.
+Отправка идет в фоне с учетом ограничений Telegram:
+- общий лимит на все чаты (около 30 сообщений в секунду);
+- лимит на каждый чат (около 1 сообщения в секунду с небольшим запасом).
+
+Повторные правки одного и того же сообщения, которые еще не отправлены,
+склеиваются: уходит только последняя версия. Правка, совпадающая с последним
+содержимым сообщения, не отправляется вовсе. Ошибки 429 (RetryAfter) и
+сетевые сбои повторяются с задержкой, не задерживая обработчик.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from typing import Deque, Dict, Optional, Tuple
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты по алгоритму «ведро токенов»"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Максимальный запас токенов (допустимый всплеск)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Дождаться свободного токена и забрать его"""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Приостановить выдачу токенов (после ответа 429)"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def render_digest(text: str, reply_markup=None) -> bytes:
+    """Хэш отображаемого содержимого сообщения (текст и кнопки)"""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16)
+    if reply_markup is not None:
+        digest.update(reply_markup.to_json().encode("utf-8"))
+    return digest.digest()
+
+
+class OutgoingMessage:
+    """Сообщение в очереди: новое (message_id is None) или правка существующего"""
+
+    __slots__ = ("chat_id", "message_id", "text", "reply_markup")
+
+    def __init__(self, chat_id: int, message_id: Optional[int], text: str, reply_markup=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+class Outbox:
+    """Планировщик исходящих сообщений с лимитами и повторами"""
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0,
+                 chat_burst: float = 3.0, max_retries: int = 5, base_delay: float = 0.5,
+                 rendered_cache_size: int = 1000):
+        """
+        Args:
+            global_rate: Лимит сообщений в секунду на всех
+            chat_rate: Лимит сообщений в секунду на один чат
+            chat_burst: Допустимый всплеск сообщений в один чат
+            max_retries: Сколько раз повторять отправку при сбоях
+            base_delay: Начальная задержка между повторами (секунды)
+            rendered_cache_size: Для скольких сообщений помнить последнее содержимое
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.bot = None
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[OutgoingMessage]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # Правки, ожидающие отправки: (chat_id, message_id) -> сообщение
+        self._pending_edits: Dict[Tuple[int, int], OutgoingMessage] = {}
+        # Последнее содержимое сообщений: (chat_id, message_id) -> хэш
+        self._rendered: "OrderedDict[Tuple[int, int], bytes]" = OrderedDict()
+        self.rendered_cache_size = rendered_cache_size
+
+    def start(self, bot):
+        """Подключить бота, через которого идет отправка"""
+        self.bot = bot
+
+    async def stop(self):
+        """Дождаться отправки всех сообщений из очереди"""
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def send_message(self, chat_id: int, text: str, reply_markup=None):
+        """Поставить в очередь новое сообщение"""
+        self._enqueue(OutgoingMessage(chat_id, None, text, reply_markup))
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str, reply_markup=None):
+        """Поставить в очередь правку сообщения (склеивается с неотправленной правкой)"""
+        key = (chat_id, message_id)
+        digest = render_digest(text, reply_markup)
+        if self._rendered.get(key) == digest:
+            # Telegram все равно ответил бы «message is not modified»
+            self._rendered.move_to_end(key)
+            metrics.inc("edits_skipped_unchanged")
+            return
+        self._rendered[key] = digest
+        self._rendered.move_to_end(key)
+        if len(self._rendered) > self.rendered_cache_size:
+            self._rendered.popitem(last=False)
+
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            pending.text = text
+            pending.reply_markup = reply_markup
+            metrics.inc("edits_coalesced")
+            return
+
+        message = OutgoingMessage(chat_id, message_id, text, reply_markup)
+        self._pending_edits[key] = message
+        self._enqueue(message)
+
+    def _enqueue(self, message: OutgoingMessage):
+        self._queues.setdefault(message.chat_id, deque()).append(message)
+        # Каждый чат обслуживается своим обработчиком, чтобы медленный чат
+        # не задерживал остальные
+        if message.chat_id not in self._workers:
+            self._workers[message.chat_id] = asyncio.create_task(self._drain(message.chat_id))
+
+    async def _drain(self, chat_id: int):
+        """Отправить все сообщения из очереди чата"""
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        queue = self._queues[chat_id]
+
+        try:
+            while queue:
+                message = queue.popleft()
+                if message.message_id is not None:
+                    # С этого момента новые правки пойдут отдельным сообщением
+                    self._pending_edits.pop((chat_id, message.message_id), None)
+                await self._deliver(message, bucket)
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+                # Неиспользуемые ограничители не храним, если они полностью восстановились
+                bucket._refill()
+                if bucket.tokens >= bucket.capacity:
+                    self._buckets.pop(chat_id, None)
+
+    async def _deliver(self, message: OutgoingMessage, bucket: TokenBucket):
+        """Отправить одно сообщение с повторами"""
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                await self._call(message)
+                metrics.inc("messages_sent")
+                return
+            except RetryAfter as e:
+                metrics.inc("retry_after")
+                retry_after = self._retry_after_seconds(e)
+                logger.warning(f"Лимит Telegram для чата {message.chat_id}, пауза {retry_after} с")
+                bucket.pause(retry_after)
+                # 429 может означать и общий лимит бота: остальные чаты тоже ждут,
+                # как и в request()
+                self._global.pause(retry_after)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    logger.error(f"Сообщение в чат {message.chat_id} отклонено: {e}")
+                    self._forget_rendered(message)
+                return
+            except (TimedOut, NetworkError) as e:
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"Сетевая ошибка при отправке в чат {message.chat_id}: {e}, повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"Ошибка отправки в чат {message.chat_id}: {e}")
+                self._forget_rendered(message)
+                return
+
+        logger.error(f"Сообщение в чат {message.chat_id} не отправлено после {self.max_retries} повторов")
+        self._forget_rendered(message)
+
+    async def request(self, method: str, **kwargs):
+        """
+        Выполнить прочий запрос к Bot API (например, get_chat) в рамках общего лимита
+
+        Ответы 429 и сетевые сбои повторяются, остальные ошибки передаются
+        вызывающему.
+
+        Args:
+            method: Имя метода telegram.Bot
+            **kwargs: Параметры метода
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._global.acquire()
+            try:
+                return await getattr(self.bot, method)(**kwargs)
+            except RetryAfter as e:
+                metrics.inc("retry_after")
+                self._global.pause(self._retry_after_seconds(e))
+                if attempt == self.max_retries:
+                    raise
+            except BadRequest:
+                # BadRequest - тоже NetworkError, но повторять его бессмысленно
+                raise
+            except (TimedOut, NetworkError):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Задержка перед повтором: экспоненциальная со случайным разбросом"""
+        return self.base_delay * (2 ** attempt) * (0.5 + random.random())
+
+    @staticmethod
+    def _retry_after_seconds(error: RetryAfter) -> float:
+        retry_after = error.retry_after
+        if isinstance(retry_after, timedelta):
+            retry_after = retry_after.total_seconds()
+        return retry_after
+
+    def _forget_rendered(self, message: OutgoingMessage):
+        """Забыть содержимое сообщения, которое не удалось отправить"""
+        if message.message_id is not None:
+            self._rendered.pop((message.chat_id, message.message_id), None)
+
+    async def _call(self, message: OutgoingMessage):
+        if message.message_id is None:
+            await self.bot.send_message(
+                chat_id=message.chat_id,
+                text=message.text,
+                reply_markup=message.reply_markup
+            )
+        else:
+            await self.bot.edit_message_text(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                text=message.text,
+                reply_markup=message.reply_markup
+            )
@@ -0,0 +1,90 @@
+"""
+Кэш записей товаров
+
+Ограниченный по размеру LRU-кэш записей Product по ID и наименованию для
+Database.get_product / get_product_by_id. Записи вытесняются изменяющими
+методами базы данных, а изменения из других процессов база данных
+отслеживает по PRAGMA data_version и счетчику изменений товаров
+(см. Database._sync_product_cache).
+
+Записи из кэша общие для всех вызовов - изменять их нельзя.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import metrics
+
+
+class ProductCache:
+    """LRU-кэш товаров с индексами по ID и наименованию"""
+
+    def __init__(self, size: int = 512):
+        """
+        Args:
+            size: Сколько товаров держать в кэше
+        """
+        self.size = size
+        self._by_id: "OrderedDict[int, Product]" = OrderedDict()
+        self._by_name: Dict[str, int] = {}
+        # Номер поколения растет при каждом вытеснении: запись, прочитанная
+        # из базы до вытеснения, в кэш уже не попадет
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, product_id: Optional[int] = None, name: Optional[str] = None) -> Optional["Product"]:
+        """Найти товар по ID или по наименованию"""
+        with self._lock:
+            if product_id is None:
+                product_id = self._by_name.get(name)
+            product = self._by_id.get(product_id) if product_id is not None else None
+            if product is None:
+                metrics.inc("product_cache_misses")
+                return None
+            self._by_id.move_to_end(product_id)
+        metrics.inc("product_cache_hits")
+        return product
+
+    def put(self, product: "Product", generation: int):
+        """
+        Положить товар в кэш
+
+        Args:
+            product: Запись, прочитанная из базы данных
+            generation: Значение generation до чтения записи
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(product.id)
+            self._by_id[product.id] = product
+            self._by_name[product.name] = product.id
+            if len(self._by_id) > self.size:
+                _, evicted = self._by_id.popitem(last=False)
+                del self._by_name[evicted.name]
+
+    def invalidate(self, product_ids: Iterable[int] = (), names: Iterable[str] = ()):
+        """Вытеснить товары по ID и наименованиям"""
+        with self._lock:
+            self.generation += 1
+            for product_id in product_ids:
+                self._remove(product_id)
+            for name in names:
+                product_id = self._by_name.get(name)
+                if product_id is not None:
+                    self._remove(product_id)
+
+    def clear(self):
+        """Вытеснить все товары"""
+        with self._lock:
+            self.generation += 1
+            self._by_id.clear()
+            self._by_name.clear()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def _remove(self, product_id: int):
+        product = self._by_id.pop(product_id, None)
+        if product is not None:
+            del self._by_name[product.name]
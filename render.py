@@ -0,0 +1,140 @@
+"""
+Сборка сообщений и клавиатур
+
+Кнопки и клавиатуры Telegram неизменяемы после создания, поэтому
+повторяющиеся клавиатуры («🏠 Главное меню», «◀️ Назад», навигация
+«Назад + Главное меню») создаются один раз: постоянные - при импорте,
+с переменной кнопкой «Назад» - при первом использовании (кэш по адресу
+кнопки). Длинные тексты собираются из строк через join, а не
+конкатенацией в цикле.
+"""
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from money import format_money
+
+# Сколько клавиатур и строк кнопок с переменными данными держать в кэше
+TEMPLATE_CACHE_SIZE = 4096
+
+BACK_LABEL = "◀️ Назад"
+
+MAIN_MENU_BUTTON = InlineKeyboardButton("🏠 Главное меню", callback_data="back_main")
+MAIN_MENU_ROW = (MAIN_MENU_BUTTON,)
+MAIN_MENU_MARKUP = InlineKeyboardMarkup((MAIN_MENU_ROW,))
+
+# Строка товара в списках: наименование, остаток и цена
+PRODUCT_LINE = "• {name}\n  Количество: {quantity} | Цена: {price} руб.\n\n"
+# Подписи кнопок выбора товара: для изменения количества, цены и для продажи
+PICK_QUANTITY_LABEL = "📦 {name} (текущее: {quantity})"
+PICK_PRICE_LABEL = "📦 {name} (текущая: {price} руб.)"
+PICK_SELL_LABEL = "📦 {name} ({quantity} шт.)"
+# Строка операции кассы в истории
+CASHBOX_LINE = "{sign}{amount} руб. - {description}\n  {created_at}\n\n"
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def back_row(callback_data: str, label: str = BACK_LABEL) -> Tuple[InlineKeyboardButton]:
+    """Строка с кнопкой «Назад»"""
+    return (InlineKeyboardButton(label, callback_data=callback_data),)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def back_markup(callback_data: str, label: str = BACK_LABEL) -> InlineKeyboardMarkup:
+    """Клавиатура из одной кнопки «Назад»"""
+    return InlineKeyboardMarkup((back_row(callback_data, label),))
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def nav_markup(callback_data: str, label: str = BACK_LABEL) -> InlineKeyboardMarkup:
+    """Клавиатура «Назад» + «Главное меню»"""
+    return InlineKeyboardMarkup((back_row(callback_data, label), MAIN_MENU_ROW))
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def nav_row(callback_data: str, label: str = BACK_LABEL) -> Tuple[InlineKeyboardButton, ...]:
+    """Одна строка «Назад» + «Главное меню»"""
+    return back_row(callback_data, label) + MAIN_MENU_ROW
+
+
+BACK_MAIN_MARKUP = back_markup("back_main")
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def product_rows(name: str, admin: bool) -> Tuple[Tuple[InlineKeyboardButton, ...], ...]:
+    """Кнопки товара в списке: карточка и быстрые действия (не зависят от остатка и цены)"""
+    encoded = name.replace(" ", "_")
+    view_row = (InlineKeyboardButton(f"📦 {name}", callback_data=f"product_view_{encoded}"),)
+    sell_button = InlineKeyboardButton("🛒 Продать", callback_data=f"product_sell_{encoded}")
+    if admin:
+        actions_row = (
+            InlineKeyboardButton("📝 Кол-во", callback_data=f"product_qty_{encoded}"),
+            InlineKeyboardButton("💵 Цена", callback_data=f"product_price_{encoded}"),
+            sell_button,
+        )
+    else:
+        actions_row = (sell_button,)
+    return (view_row, actions_row)
+
+
+def products_list(products: Sequence, admin: bool,
+                  footer: Optional[Sequence[InlineKeyboardButton]] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Список товаров с кнопками
+
+    Args:
+        products: Товары (Product)
+        admin: Показывать кнопки изменения количества и цены
+        footer: Последняя строка кнопок (навигация)
+    """
+    lines = ["📦 Список товаров:\n\n"]
+    rows: List[Sequence[InlineKeyboardButton]] = []
+    for product in products:
+        lines.append(PRODUCT_LINE.format(
+            name=product.name, quantity=product.quantity, price=format_money(product.price)
+        ))
+        rows.extend(product_rows(product.name, admin))
+    if footer is not None:
+        rows.append(footer)
+    return "".join(lines), InlineKeyboardMarkup(rows)
+
+
+def product_picker(products: Sequence, label: str, callback_prefix: str,
+                   back_callback: str) -> Optional[InlineKeyboardMarkup]:
+    """
+    Клавиатура выбора товара: кнопка на товар и строка навигации
+
+    Args:
+        products: Товары (Product)
+        label: Шаблон подписи кнопки (PICK_*_LABEL) с полями name, quantity, price
+        callback_prefix: Начало callback_data, к нему добавляется наименование
+        back_callback: callback_data кнопки «Назад»
+
+    Returns:
+        Клавиатура или None, если товаров нет
+    """
+    rows: List[Sequence[InlineKeyboardButton]] = [
+        (InlineKeyboardButton(
+            label.format(name=product.name, quantity=product.quantity, price=format_money(product.price)),
+            callback_data=callback_prefix + product.name.replace(" ", "_"),
+        ),)
+        for product in products
+    ]
+    if not rows:
+        return None
+    rows.append(nav_row(back_callback))
+    return InlineKeyboardMarkup(rows)
+
+
+def cashbox_lines(history: Sequence[dict]) -> str:
+    """Операции кассы, по две строки на операцию, через пустую строку"""
+    return "".join(
+        CASHBOX_LINE.format(
+            sign="+" if record['amount'] > 0 else "",
+            amount=format_money(record['amount']),
+            description=record['description'],
+            created_at=record['created_at'],
+        )
+        for record in history
+    )
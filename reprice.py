@@ -0,0 +1,113 @@
+"""
+Правила массового изменения цен
+
+Правило задается строкой, например:
+- "+7%" - поднять цены на 7%;
+- "-2.50" - снизить цены на 2.50 руб.;
+- "+7% ~10" - поднять на 7% и округлить до 10 руб.;
+- "+5% +1 ~0.10" - процент, надбавка и округление вместе.
+
+Правило переводится в одно выражение SQL над колонкой price (копейки),
+чтобы новые цены считались одним UPDATE, а не по товару.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Tuple
+
+from money import format_money, parse_money
+
+# Множитель процента в базисных пунктах: 100% = 10000
+BASIS_POINTS = 10000
+
+
+class RepriceRule:
+    """Правило изменения цены: процент, надбавка и шаг округления"""
+
+    __slots__ = ("percent_bp", "delta", "step")
+
+    def __init__(self, percent_bp: int = 0, delta: int = 0, step: int = 1):
+        """
+        Args:
+            percent_bp: Изменение в сотых долях процента (+7% = 700)
+            delta: Надбавка в копейках (после процента)
+            step: Шаг округления в копейках (1 - без округления)
+        """
+        self.percent_bp = percent_bp
+        self.delta = delta
+        self.step = step
+
+    def sql(self, column: str = "price", placeholder: str = "?",
+            greatest: str = "MAX") -> Tuple[str, tuple]:
+        """
+        Выражение SQL для новой цены и его параметры
+
+        Процент округляется до копейки, затем добавляется надбавка, затем
+        цена округляется до шага (половина вверх). Цена не становится
+        отрицательной.
+
+        Args:
+            column: Колонка с текущей ценой
+            placeholder: Знак параметра драйвера ("?" - sqlite3, "%s" - psycopg)
+            greatest: Функция максимума из двух чисел (MAX в SQLite, GREATEST в PostgreSQL)
+        """
+        p = placeholder
+        expression = (
+            f"{greatest}(0, ((({column} * {p} + {BASIS_POINTS // 2}) / {BASIS_POINTS} + {p}) + {p}) / {p} * {p})"
+        )
+        params = (BASIS_POINTS + self.percent_bp, self.delta, self.step // 2, self.step, self.step)
+        return expression, params
+
+    def describe(self) -> str:
+        """Описание правила для пользователя"""
+        parts = []
+        if self.percent_bp:
+            percent = Decimal(self.percent_bp) / 100
+            parts.append(f"{'+' if percent > 0 else ''}{percent.normalize():f}%")
+        if self.delta:
+            parts.append(f"{'+' if self.delta > 0 else ''}{format_money(self.delta)} руб.")
+        if self.step > 1:
+            parts.append(f"округление до {format_money(self.step)} руб.")
+        return ", ".join(parts) or "без изменений"
+
+
+def parse_reprice_rule(text: str) -> RepriceRule:
+    """
+    Разобрать правило изменения цен
+
+    Args:
+        text: Правило, например "+7% ~10" (см. описание модуля)
+
+    Raises:
+        ValueError: если строка не является правилом
+    """
+    rule = RepriceRule()
+    tokens = text.split()
+    if not tokens:
+        raise ValueError("Пустое правило")
+
+    seen = set()
+    for token in tokens:
+        if token.endswith("%"):
+            kind = "percent"
+            try:
+                percent = Decimal(token[:-1].replace(",", "."))
+            except InvalidOperation:
+                raise ValueError(f"Некорректный процент: {token!r}")
+            if not percent.is_finite() or percent <= -100:
+                raise ValueError(f"Некорректный процент: {token!r}")
+            rule.percent_bp = int((percent * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        elif token.startswith("~"):
+            kind = "step"
+            rule.step = parse_money(token[1:])
+            if rule.step <= 0:
+                raise ValueError(f"Некорректный шаг округления: {token!r}")
+        elif token[0] in "+-":
+            kind = "delta"
+            rule.delta = parse_money(token)
+        else:
+            raise ValueError(f"Непонятная часть правила: {token!r}")
+
+        if kind in seen:
+            raise ValueError(f"Повторяется часть правила: {token!r}")
+        seen.add(kind)
+
+    return rule
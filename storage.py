@@ -0,0 +1,284 @@
+"""
+Интерфейс хранилища данных склада
+
+Бот работает с хранилищем только через методы Storage. Реализации:
+- Database (database.py) - SQLite, файл warehouse.db (по умолчанию);
+- PostgresDatabase (postgres_storage.py) - PostgreSQL через пул соединений.
+
+Хранилище выбирается по переменной окружения DATABASE_URL (см. open_storage).
+Подробное описание каждого метода - в реализации SQLite; реализации
+обязаны возвращать одинаковые значения (bool/None вместо исключений,
+суммы в копейках, время строкой 'YYYY-MM-DD HH:MM:SS' в UTC).
+"""
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timezone, tzinfo
+from typing import Callable, Dict, List, Optional, Tuple
+
+from catalogue import Catalogue
+from reprice import RepriceRule
+
+
+class Storage(ABC):
+    """Хранилище склада: товары, категории, касса, администраторы, журналы"""
+
+    # Через сколько движений товара делается снимок остатков
+    SNAPSHOT_INTERVAL = 1000
+
+    # Сколько последних ключей идемпотентности хранить и как часто чистить старые
+    IDEMPOTENCY_KEYS_LIMIT = 10000
+    IDEMPOTENCY_PRUNE_EVERY = 100
+
+    def __init__(self):
+        self.init_database()
+        # Каталог товаров в памяти, обновляется по счетчику изменений
+        self.catalogue = Catalogue(self)
+        # Приемник записей журнала аудита (AuditLog.record); None - аудит выключен
+        self.audit_sink: Optional[Callable] = None
+
+    @abstractmethod
+    def init_database(self):
+        """Создать или обновить схему хранилища"""
+
+    def close(self):
+        """Освободить ресурсы хранилища (пул соединений и т.п.)"""
+
+    def _audit(self, user_id: Optional[int], action: str, target=None, before=None, after=None):
+        """Передать запись об операции в журнал аудита (после успешного коммита)"""
+        if self.audit_sink is not None:
+            self.audit_sink(user_id, action, target, before, after)
+
+    @staticmethod
+    def _utc_timestamp(moment: datetime) -> str:
+        """Момент времени в формате CURRENT_TIMESTAMP (UTC)"""
+        return moment.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    # === Товары ===
+
+    @abstractmethod
+    def add_product(self, name: str, quantity: int = 0, price: int = 0,
+                    user_id: Optional[int] = None) -> bool:
+        """Добавить новый товар (False - товар уже существует)"""
+
+    @abstractmethod
+    def get_product(self, name: str):
+        """Получить товар (Product) по наименованию"""
+
+    @abstractmethod
+    def get_product_by_id(self, product_id: int):
+        """Получить товар (Product) по ID"""
+
+    @abstractmethod
+    def get_product_id_by_sku(self, sku: str) -> Optional[int]:
+        """Найти ID товара по штрихкоду / артикулу"""
+
+    @abstractmethod
+    def update_product_sku(self, name: str, sku: Optional[str],
+                           user_id: Optional[int] = None) -> bool:
+        """Назначить товару штрихкод (False - товар не найден или код занят)"""
+
+    def get_all_products(self) -> List:
+        """
+        Получить все товары, отсортированные по наименованию
+
+        Список берется из каталога в памяти и общий для всех вызовов -
+        изменять его нельзя.
+        """
+        return self.catalogue.products()
+
+    @abstractmethod
+    def get_products_seq(self) -> int:
+        """Номер последнего изменения товаров"""
+
+    @abstractmethod
+    def get_products_changed_since(self, seq: int) -> List:
+        """Товары, изменившиеся после изменения с номером seq, по возрастанию номера"""
+
+    @abstractmethod
+    def update_product_quantity(self, name: str, quantity: int,
+                                user_id: Optional[int] = None) -> bool:
+        """Установить количество товара (ручная корректировка)"""
+
+    @abstractmethod
+    def update_product_price(self, name: str, price: int,
+                             user_id: Optional[int] = None) -> bool:
+        """Установить цену товара с записью в историю цен"""
+
+    @abstractmethod
+    def add_product_quantity(self, name: str, quantity: int,
+                             user_id: Optional[int] = None) -> bool:
+        """Добавить количество к товару (приход)"""
+
+    @abstractmethod
+    def sell_product(self, name: str, quantity: int, user_id: Optional[int] = None,
+                     idempotency_key: Optional[str] = None) -> Tuple[bool, Optional[int]]:
+        """Продать товар: (успех, стоимость в копейках)"""
+
+    # === Категории ===
+
+    @abstractmethod
+    def get_category(self, category_id: int) -> Optional[Dict]:
+        """Категория по ID (id, name, parent_id, product_count)"""
+
+    @abstractmethod
+    def get_child_categories(self, parent_id: Optional[int] = None) -> List[Dict]:
+        """Подкатегории категории (None - верхний уровень) по наименованию"""
+
+    @abstractmethod
+    def get_category_products(self, category_id: Optional[int]) -> List:
+        """Товары, лежащие непосредственно в категории (None - без категории)"""
+
+    @abstractmethod
+    def count_uncategorized_products(self) -> int:
+        """Количество товаров без категории"""
+
+    @abstractmethod
+    def get_category_path(self, category_id: int) -> List[str]:
+        """Наименования категорий от верхнего уровня до указанной"""
+
+    @abstractmethod
+    def find_category(self, names: List[str], create: bool = False) -> Optional[int]:
+        """Найти (или создать) цепочку категорий, вернуть ID последней"""
+
+    @abstractmethod
+    def update_product_category(self, name: str, category_id: Optional[int],
+                                user_id: Optional[int] = None) -> bool:
+        """Перенести товар в категорию"""
+
+    # === Массовое изменение цен ===
+
+    @abstractmethod
+    def preview_reprice(self, rule: RepriceRule, name_filter: Optional[str] = None,
+                        limit: int = 5, category_id: Optional[int] = None) -> Dict:
+        """Предпросмотр массового изменения цен: count и samples"""
+
+    @abstractmethod
+    def bulk_reprice(self, rule: RepriceRule, name_filter: Optional[str] = None,
+                     user_id: Optional[int] = None, category_id: Optional[int] = None) -> int:
+        """Изменить цены подходящих товаров одной транзакцией, вернуть их количество"""
+
+    # === Сводка, история цен и движения товара ===
+
+    @abstractmethod
+    def get_inventory_summary(self) -> Dict:
+        """product_count, total_quantity, total_value, out_of_stock"""
+
+    @abstractmethod
+    def get_top_value_products(self, limit: int = 5) -> List:
+        """Товары с наибольшей стоимостью остатка"""
+
+    @abstractmethod
+    def get_price_at(self, name: str, at: str) -> Optional[int]:
+        """Цена товара на момент времени (UTC)"""
+
+    @abstractmethod
+    def get_price_history(self, name: str, limit: int = 10) -> List[Dict]:
+        """Последние изменения цены товара"""
+
+    @abstractmethod
+    def create_stock_snapshot(self):
+        """Сделать снимок остатков вне очереди"""
+
+    @abstractmethod
+    def get_stock_moves(self, name: str, limit: int = 10) -> List[Dict]:
+        """Последние движения товара"""
+
+    @abstractmethod
+    def get_stock_at(self, name: str, at: str) -> Optional[int]:
+        """Остаток товара на момент времени (UTC)"""
+
+    # === Продажи по дням ===
+
+    @abstractmethod
+    def get_daily_sales(self, date_from: date, days: int,
+                        tz: tzinfo = timezone.utc) -> List[Tuple[int, int, int]]:
+        """
+        Продажи за период: (product_id, номер дня от date_from, количество)
+
+        Строки с одинаковыми товаром и днем могут повторяться - их нужно суммировать.
+        """
+
+    # === Касса ===
+
+    @abstractmethod
+    def get_cashbox_balance(self) -> int:
+        """Текущий баланс кассы в копейках"""
+
+    @abstractmethod
+    def add_cash(self, amount: int, description: str = "",
+                 user_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> bool:
+        """Добавить деньги в кассу"""
+
+    @abstractmethod
+    def withdraw_cash(self, amount: int, description: str = "",
+                      user_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> bool:
+        """Снять деньги из кассы (False - недостаточно средств)"""
+
+    @abstractmethod
+    def get_cashbox_history(self, limit: int = 10, transaction_type: Optional[str] = None,
+                            date_from: Optional[date] = None, date_to: Optional[date] = None,
+                            tz: tzinfo = timezone.utc, before_id: Optional[int] = None,
+                            after_id: Optional[int] = None) -> List[Dict]:
+        """Страница истории операций кассы, новые первыми"""
+
+    @abstractmethod
+    def close_day(self, day: date, tz: tzinfo = timezone.utc) -> Dict:
+        """Посчитать и сохранить итоги дня кассы"""
+
+    @abstractmethod
+    def get_daily_close(self, day: date) -> Optional[Dict]:
+        """Итоги дня или None, если день не закрыт"""
+
+    # === Администраторы ===
+
+    @abstractmethod
+    def is_admin(self, user_id: int) -> bool:
+        """Является ли пользователь администратором"""
+
+    @abstractmethod
+    def add_admin(self, user_id: int, username: str = None,
+                  added_by: Optional[int] = None) -> bool:
+        """Добавить администратора (False - уже администратор)"""
+
+    @abstractmethod
+    def remove_admin(self, user_id: int, removed_by: Optional[int] = None) -> bool:
+        """Удалить администратора (False - не найден)"""
+
+    @abstractmethod
+    def update_admin_usernames(self, usernames: List[Tuple[int, Optional[str]]]):
+        """Обновить имена пользователей администраторов одной транзакцией"""
+
+    @abstractmethod
+    def get_all_admins(self) -> List[Dict]:
+        """Список всех администраторов"""
+
+    # === Журнал аудита ===
+
+    @abstractmethod
+    def add_audit_entries(self, entries: List[Tuple]):
+        """Записать пачку записей журнала аудита одной транзакцией"""
+
+    @abstractmethod
+    def get_audit_log(self, limit: int = 20, user_id: Optional[int] = None,
+                      target: Optional[str] = None, before_id: Optional[int] = None) -> List[Dict]:
+        """Записи журнала аудита, новые первыми"""
+
+
+def open_storage(url: Optional[str] = None, pool_size: int = 10,
+                 busy_timeout: float = 5.0, lock_retries: int = 3) -> Storage:
+    """
+    Открыть хранилище по адресу
+
+    Args:
+        url: postgresql://... - PostgreSQL, иначе путь к файлу SQLite
+            (None или пустая строка - warehouse.db)
+        pool_size: Наибольшее число соединений (PostgreSQL)
+        busy_timeout: Ожидание блокировки базы в секундах (SQLite)
+        lock_retries: Повторы операции при «database is locked» (SQLite)
+    """
+    if url and url.startswith(("postgresql://", "postgres://")):
+        # Драйвер PostgreSQL - необязательная зависимость
+        from postgres_storage import PostgresDatabase
+        return PostgresDatabase(url, pool_size=pool_size)
+
+    from database import Database
+    return Database(url or "warehouse.db", busy_timeout=busy_timeout, lock_retries=lock_retries)
@@ -0,0 +1,49 @@
+"""
+Общие фикстуры тестов
+
+Модули бота лежат в корне репозитория, поэтому корень добавляется в sys.path.
+Тесты хранилища идут на временном файле SQLite; тесты, которым нужен
+python-telegram-bot или PostgreSQL, пропускаются, если их нет.
+
+Фикстура storage прогоняет тест на обоих хранилищах: на SQLite и на
+PostgreSQL из TEST_DATABASE_URL. Перед каждым тестом схема public этой базы
+пересоздается - не указывайте рабочую базу.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "warehouse.db")
+
+
+@pytest.fixture
+def db(db_path):
+    storage = Database(db_path)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, db_path):
+    if request.param == "sqlite":
+        storage = Database(db_path)
+    else:
+        url = os.environ.get("TEST_DATABASE_URL")
+        if not url:
+            pytest.skip("TEST_DATABASE_URL не задан")
+        psycopg = pytest.importorskip("psycopg")
+        with psycopg.connect(url, autocommit=True) as conn:
+            conn.execute("DROP SCHEMA IF EXISTS public CASCADE")
+            conn.execute("CREATE SCHEMA public")
+        from postgres_storage import PostgresDatabase
+        storage = PostgresDatabase(url, pool_size=4)
+    yield storage
+    storage.close()
@@ -0,0 +1,61 @@
+"""Справочник администраторов: изменения из потоков и вывод имен"""
+import threading
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from admin_directory import AdminDirectory, UNKNOWN_USERNAME  # noqa: E402
+
+
+def test_reload_started_before_add_does_not_lose_new_admin(db, monkeypatch):
+    db.add_admin(100, "boss")
+    directory = AdminDirectory(db)
+    directory.reload()
+
+    read_old_list = threading.Event()
+    proceed = threading.Event()
+    get_all_admins = db.get_all_admins
+    calls = []
+
+    def stalled_get_all_admins():
+        admins = get_all_admins()
+        calls.append(len(admins))
+        if len(calls) == 1:
+            # Перечитывание прочитало старый список и еще не сохранило его
+            read_old_list.set()
+            proceed.wait(timeout=5)
+        return admins
+
+    monkeypatch.setattr(db, "get_all_admins", stalled_get_all_admins)
+    reload_thread = threading.Thread(target=directory.reload)
+    reload_thread.start()
+    read_old_list.wait(timeout=5)
+
+    add_thread = threading.Thread(target=directory.add, args=(200, "cashier", 100))
+    add_thread.start()
+    add_thread.join(timeout=0.2)
+    proceed.set()
+    reload_thread.join()
+    add_thread.join()
+
+    assert directory.is_admin(200)
+    assert [admin['user_id'] for admin in directory.admins()] == [100, 200]
+
+
+def test_note_username_replaces_snapshot(db):
+    db.add_admin(100, UNKNOWN_USERNAME)
+    directory = AdminDirectory(db)
+    before = directory.admins()
+
+    directory.note_username(100, "boss")
+
+    assert before[0]['username'] == UNKNOWN_USERNAME
+    assert directory.admins()[0]['username'] == "boss"
+    assert db.get_all_admins()[0]['username'] == "boss"
+
+
+def test_display_name():
+    assert AdminDirectory.display_name({'user_id': 1, 'username': "boss"}) == "@boss"
+    assert AdminDirectory.display_name({'user_id': 1, 'username': None}) == UNKNOWN_USERNAME
+    assert AdminDirectory.display_name({'user_id': 1, 'username': UNKNOWN_USERNAME}) == UNKNOWN_USERNAME
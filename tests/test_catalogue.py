@@ -0,0 +1,93 @@
+"""Каталог товаров в памяти: чтение из нескольких потоков во время обновления"""
+import threading
+
+
+def test_reader_waits_for_refresh_in_another_thread(db, monkeypatch):
+    db.add_product("Молоко", 10, 100)
+    db.get_all_products()
+    db.add_product("Хлеб", 5, 40)
+
+    # Первое обновление каталога останавливается посреди применения изменений
+    entered = threading.Event()
+    release = threading.Event()
+    changed_since = db.get_products_changed_since
+
+    def slow_changed_since(seq):
+        if not entered.is_set():
+            entered.set()
+            release.wait(5)
+        return changed_since(seq)
+
+    monkeypatch.setattr(db, "get_products_changed_since", slow_changed_since)
+
+    background = threading.Thread(target=db.catalogue.refresh)
+    background.start()
+    assert entered.wait(5)
+
+    seen = []
+    reader = threading.Thread(target=lambda: seen.append([p.name for p in db.get_all_products()]))
+    reader.start()
+    reader.join(0.2)
+    # Пока обновление не закончено, чтение каталога ждет
+    assert reader.is_alive()
+
+    release.set()
+    background.join(5)
+    reader.join(5)
+    assert seen == [["Молоко", "Хлеб"]]
+
+
+def test_readers_in_threads_see_consistent_catalogue(db):
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            for number in range(300):
+                db.add_product(f"Товар {number}", number, 100)
+                db.update_product_quantity(f"Товар {number // 2}", number)
+        finally:
+            done.set()
+
+    def read():
+        # Так каталог читает фоновая задача прогноза спроса
+        try:
+            while not done.is_set():
+                products = db.get_all_products()
+                snapshot = [(product.id, product.name, product.quantity) for product in products]
+                assert len({name for _, name, _ in snapshot}) == len(snapshot)
+                db.catalogue.search("товар 1")
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(db.get_all_products()) == 300
+    assert [product.name for product in db.catalogue.search("товар 29")][:2] == ["Товар 29", "Товар 290"]
+
+
+def test_search_checks_changes_at_most_once_per_interval(db, monkeypatch):
+    db.add_product("Молоко 3.2%", 10, 100)
+    calls = []
+    products_seq = db.get_products_seq
+
+    def counted_seq():
+        calls.append(1)
+        return products_seq()
+
+    monkeypatch.setattr(db, "get_products_seq", counted_seq)
+    db.catalogue.search_refresh_interval = 60
+    for query in ("м", "мо", "мол", "моло", "молок"):
+        assert [product.name for product in db.catalogue.search(query)] == ["Молоко 3.2%"]
+    assert len(calls) == 1
+
+    # Список товаров сверяет счетчик всегда, и поиск видит новый товар
+    db.add_product("Молоко 1.5%", 5, 90)
+    assert len(db.get_all_products()) == 2
+    assert len(db.catalogue.search("молок")) == 2
+    assert len(calls) == 2
@@ -0,0 +1,106 @@
+"""Идемпотентные операции: повтор с тем же ключом дает один эффект"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+REPLAYS = 1000
+
+
+def replay(operation, times=REPLAYS, workers=32):
+    """Выполнить одну и ту же операцию times раз параллельно"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda _: operation(), range(times)))
+
+
+def cashbox_rows(db, transaction_type):
+    conn = db.get_connection()
+    rows = conn.execute(
+        "SELECT amount FROM cashbox WHERE transaction_type = ?", (transaction_type,)
+    ).fetchall()
+    conn.close()
+    return [row['amount'] for row in rows]
+
+
+def test_sell_replayed_concurrently_sells_once(db):
+    db.add_product("Молоко", 5000, 8990)
+
+    results = replay(lambda: db.sell_product("Молоко", 2, user_id=1, idempotency_key="cb:4217"))
+
+    assert set(results) == {(True, 17980)}
+    assert db.get_product("Молоко").quantity == 4998
+    assert cashbox_rows(db, 'sale') == [17980]
+    assert [move['delta'] for move in db.get_stock_moves("Молоко")] == [-2, 5000]
+
+
+def test_add_cash_replayed_concurrently_adds_once(db):
+    balance = db.get_cashbox_balance()
+
+    results = replay(lambda: db.add_cash(50000, "Размен", idempotency_key="msg:1:10"))
+
+    assert set(results) == {True}
+    assert db.get_cashbox_balance() == balance + 50000
+    assert cashbox_rows(db, 'income') == [50000]
+
+
+def test_withdraw_cash_replayed_concurrently_withdraws_once(db):
+    db.add_cash(100000, "Размен")
+
+    results = replay(lambda: db.withdraw_cash(30000, "Инкассация", idempotency_key="msg:1:11"))
+
+    assert set(results) == {True}
+    assert db.get_cashbox_balance() == 70000
+    assert cashbox_rows(db, 'expense') == [-30000]
+
+
+def test_replay_returns_stored_failure(db):
+    db.add_product("Хлеб", 1, 4000)
+
+    assert db.withdraw_cash(10 ** 9, idempotency_key="msg:1:12") is False
+    assert db.sell_product("Хлеб", 5, idempotency_key="msg:1:13") == (False, None)
+
+    # Повтор возвращает сохраненный отказ, даже если теперь операция прошла бы
+    db.add_cash(10 ** 9)
+    db.add_product_quantity("Хлеб", 10)
+    assert db.withdraw_cash(10 ** 9, idempotency_key="msg:1:12") is False
+    assert db.sell_product("Хлеб", 5, idempotency_key="msg:1:13") == (False, None)
+    assert db.get_product("Хлеб").quantity == 11
+
+
+def test_different_keys_are_separate_operations(db):
+    db.add_product("Молоко", 10, 8990)
+
+    for key in ("cb:1", "cb:2", "cb:3"):
+        assert db.sell_product("Молоко", 1, idempotency_key=key) == (True, 8990)
+    assert db.get_product("Молоко").quantity == 7
+
+
+def test_callback_key_is_the_pressed_message_version(db):
+    pytest.importorskip("telegram")
+    from datetime import datetime, timedelta, timezone
+
+    from telegram import CallbackQuery, Chat, Message, User
+
+    import bot
+
+    user = User(1, "Кассир", False)
+    sent = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+    message = Message(42, sent, Chat(7, Chat.PRIVATE))
+    # Двойное нажатие: два запроса с разными ID к одной версии сообщения
+    first_tap = CallbackQuery("4217", user, "chat", message=message, data="sell_qty_Молоко_1")
+    double_tap = CallbackQuery("4218", user, "chat", message=message, data="sell_qty_Молоко_1")
+    redelivered = CallbackQuery("4217", user, "chat", message=message, data="sell_qty_Молоко_1")
+    # После продажи сообщение отредактировано - следующее нажатие новое
+    edited = Message(42, sent, Chat(7, Chat.PRIVATE), edit_date=sent + timedelta(seconds=5))
+    after_edit = CallbackQuery("4219", user, "chat", message=edited, data="sell_qty_Молоко_1")
+
+    key = bot.callback_idempotency_key(first_tap)
+    assert bot.callback_idempotency_key(double_tap) == key
+    assert bot.callback_idempotency_key(redelivered) == key
+    assert bot.callback_idempotency_key(after_edit) != key
+
+    db.add_product("Молоко", 10, 8990)
+    for query in (first_tap, double_tap, redelivered):
+        assert db.sell_product("Молоко", 1, idempotency_key=bot.callback_idempotency_key(query)) == (True, 8990)
+    assert db.get_product("Молоко").quantity == 9
+    db.sell_product("Молоко", 1, idempotency_key=bot.callback_idempotency_key(after_edit))
+    assert db.get_product("Молоко").quantity == 8
@@ -0,0 +1,92 @@
+"""Повтор изменяющих операций при блокировке базы другим процессом"""
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+
+import metrics
+from database import Database, retry_on_lock
+
+PROCESSES = 16
+OPERATIONS = 50
+
+
+def worker(db_path, barrier, results):
+    """Чередовать продажи и приходы; вернуть число ошибок и повторов"""
+    db = Database(db_path, busy_timeout=0.5, lock_retries=10, lock_retry_delay=0.01)
+    barrier.wait()
+    errors = 0
+    for n in range(OPERATIONS):
+        try:
+            if n % 2:
+                db.add_product_quantity("Молоко", 1)
+            else:
+                db.sell_product("Молоко", 1)
+        except sqlite3.OperationalError:
+            errors += 1
+    db.close()
+    counters = metrics.snapshot()
+    results.put((errors, counters.get("db_lock_retries", 0)))
+
+
+def blocker(db_path, barrier):
+    """Сторонний процесс (например, резервное копирование), захватывающий базу дольше busy_timeout"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    barrier.wait()
+    for _ in range(3):
+        conn.execute("BEGIN EXCLUSIVE")
+        time.sleep(1.0)
+        conn.execute("COMMIT")
+        time.sleep(0.3)
+    conn.close()
+
+
+def test_processes_contending_for_the_database(db_path):
+    db = Database(db_path)
+    db.add_product("Молоко", 10000, 8990)
+    db.close()
+
+    results = multiprocessing.Queue()
+    # Все открывают базу до начала нагрузки: открытие не повторяется
+    barrier = multiprocessing.Barrier(PROCESSES + 1)
+    locker = multiprocessing.Process(target=blocker, args=(db_path, barrier))
+    workers = [multiprocessing.Process(target=worker, args=(db_path, barrier, results)) for _ in range(PROCESSES)]
+    locker.start()
+    for process in workers:
+        process.start()
+    outcomes = [results.get(timeout=60) for _ in workers]
+    for process in workers:
+        process.join()
+    locker.join()
+
+    assert sum(errors for errors, _ in outcomes) == 0
+    assert sum(retries for _, retries in outcomes) > 0
+    db = Database(db_path)
+    try:
+        # Продаж и приходов поровну, и ни одна операция не выполнена дважды
+        assert db.get_product("Молоко").quantity == 10000
+        assert len(db.get_stock_moves("Молоко", limit=10 ** 6)) == 1 + PROCESSES * OPERATIONS
+    finally:
+        db.close()
+
+
+def test_failed_attempt_connection_is_closed(db):
+    opened = []
+
+    @retry_on_lock
+    def operation(self):
+        conn = self.get_connection()
+        opened.append(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        if len(opened) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        conn.commit()
+        conn.close()
+        return True
+
+    assert operation(db)
+    assert len(opened) == 2
+    # Соединение неудачной попытки закрыто, его транзакция откатилась
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].execute("SELECT 1")
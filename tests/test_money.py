@@ -0,0 +1,121 @@
+"""
+Денежные суммы в копейках: свойства на случайных суммах
+
+Суммы генерируются random с фиксированным зерном, поэтому прогон
+воспроизводим. Ожидаемые значения считаются через Decimal.
+
+Баланс кассы сверяется с журналом после LEDGER_OPERATIONS (1 млн) случайных
+операций: они пишутся в кассу одной пачкой, а не через add_cash по одной
+(миллион отдельных транзакций шел бы десятки минут). Свойства функций
+проверяются на CASES сумм на тест: каждая проверка - отдельная ветка
+разбора или округления, и больший объем только удлиняет прогон.
+"""
+import random
+import sqlite3
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+from money import format_money, parse_money, to_decimal
+from reprice import BASIS_POINTS, RepriceRule
+
+SEED = 20240601
+CASES = 2000
+LEDGER_OPERATIONS = 1_000_000
+
+
+@pytest.fixture
+def rng():
+    return random.Random(SEED)
+
+
+def random_minor(rng):
+    # Мелкие суммы, суммы около границ рубля и крупные суммы
+    return rng.choice([
+        rng.randint(-199, 199),
+        rng.randint(-10 ** 6, 10 ** 6),
+        rng.randint(-10 ** 15, 10 ** 15),
+    ])
+
+
+def test_format_then_parse_round_trips(rng):
+    for _ in range(CASES):
+        minor = random_minor(rng)
+        text = format_money(minor)
+        assert parse_money(text) == minor
+        assert parse_money(text.replace(".", ",")) == minor
+        assert Decimal(text) * 100 == minor
+
+
+def test_parse_matches_decimal_with_half_up_rounding(rng):
+    for _ in range(CASES):
+        rubles = rng.randint(0, 10 ** 9)
+        fraction = rng.randint(0, 999)
+        sign = rng.choice(["", "-"])
+        text = f"{sign}{rubles}.{fraction:03d}"
+        expected = (Decimal(text) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+        assert parse_money(text) == int(expected)
+
+
+def test_sums_and_products_have_no_float_drift(rng):
+    # 0.10 + 0.20 в float не равно 0.30; в копейках равно
+    assert parse_money("0.10") + parse_money("0.20") == parse_money("0.30")
+    assert format_money(sum(parse_money("0.10") for _ in range(10))) == "1.00"
+
+    for _ in range(CASES):
+        price = rng.randint(1, 10 ** 7)
+        quantity = rng.randint(1, 10 ** 4)
+        # Сумма продажи: цена в копейках на количество
+        assert format_money(price * quantity) == f"{to_decimal(price) * quantity:.2f}"
+
+        amounts = [random_minor(rng) for _ in range(rng.randint(1, 50))]
+        assert to_decimal(sum(amounts)) == sum((to_decimal(amount) for amount in amounts), Decimal(0))
+
+
+def test_reprice_sql_matches_decimal_reference(rng):
+    conn = sqlite3.connect(":memory:")
+    for _ in range(CASES):
+        price = rng.randint(0, 10 ** 8)
+        rule = RepriceRule(
+            percent_bp=rng.randint(-9999, 50000),
+            delta=rng.randint(-10 ** 4, 10 ** 4),
+            step=rng.choice([1, 10, 50, 100, 1000]),
+        )
+        expression, params = rule.sql(column="?")
+        new_price = conn.execute(f"SELECT {expression}", (price,) + params).fetchone()[0]
+
+        # Процент до копейки, надбавка, затем шаг округления (половина вверх)
+        scaled = (Decimal(price) * (BASIS_POINTS + rule.percent_bp) / BASIS_POINTS).quantize(
+            Decimal(1), rounding=ROUND_HALF_UP
+        )
+        stepped = ((scaled + rule.delta) / rule.step).quantize(Decimal(1), rounding=ROUND_HALF_UP) * rule.step
+        assert new_price == max(0, int(stepped)), (price, rule.percent_bp, rule.delta, rule.step)
+    conn.close()
+
+
+def test_cashbox_balance_is_exact(db, rng):
+    expected = Decimal(0)
+    for _ in range(200):
+        text = f"{rng.randint(0, 999)}.{rng.randint(0, 99):02d}"
+        db.add_cash(parse_money(text), "Взнос")
+        expected += Decimal(text)
+    assert format_money(db.get_cashbox_balance()) == f"{expected:.2f}"
+
+
+def test_cashbox_balance_matches_ledger_after_million_operations(db, rng):
+    expected = to_decimal(db.get_cashbox_balance())
+    operations = []
+    for _ in range(LEDGER_OPERATIONS):
+        transaction_type = rng.choice(["sale", "income", "expense"])
+        text = f"{'-' if transaction_type == 'expense' else ''}{rng.randint(0, 99999)}.{rng.randint(0, 99):02d}"
+        operations.append((parse_money(text), transaction_type))
+        expected += Decimal(text)
+
+    conn = db.get_connection()
+    conn.executemany(
+        "INSERT INTO cashbox (amount, transaction_type, description) VALUES (?, ?, 'Операция')", operations
+    )
+    conn.commit()
+    conn.close()
+
+    assert format_money(db.get_cashbox_balance()) == f"{expected:.2f}"
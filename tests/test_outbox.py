@@ -0,0 +1,152 @@
+"""Очередь исходящих сообщений с заглушкой Bot API"""
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import BadRequest, NetworkError, RetryAfter  # noqa: E402
+
+from outbox import Outbox  # noqa: E402
+
+
+class FakeBot:
+    """Заглушка telegram.Bot: запоминает вызовы и выдает заданные ошибки по порядку"""
+
+    def __init__(self, failures=()):
+        self.calls = []
+        self.failures = list(failures)
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        return self._call("send_message", chat_id, None, text)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        return self._call("edit_message_text", chat_id, message_id, text)
+
+    def _call(self, method, chat_id, message_id, text):
+        self.calls.append((method, chat_id, message_id, text, time.monotonic()))
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def sent(self):
+        return [(method, chat_id, message_id, text) for method, chat_id, message_id, text, _ in self.calls]
+
+    def times(self):
+        return [call[-1] for call in self.calls]
+
+
+def run(outbox, bot, enqueue):
+    """Поставить сообщения в очередь и дождаться их отправки"""
+    async def main():
+        outbox.start(bot)
+        enqueue()
+        await outbox.stop()
+
+    asyncio.run(main())
+
+
+def test_chat_rate_limit():
+    bot = FakeBot()
+    outbox = Outbox(global_rate=1000, chat_rate=10, chat_burst=1)
+
+    run(outbox, bot, lambda: [outbox.send_message(1, f"Сообщение {n}") for n in range(4)])
+
+    assert [text for *_, text in bot.sent()] == [f"Сообщение {n}" for n in range(4)]
+    times = bot.times()
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+
+
+def test_global_rate_limit():
+    bot = FakeBot()
+    outbox = Outbox(global_rate=10, chat_rate=1000, chat_burst=1000)
+
+    run(outbox, bot, lambda: [outbox.send_message(chat_id, "Отчет") for chat_id in range(15)])
+
+    times = bot.times()
+    assert len(times) == 15
+    # Запас общего лимита - 10 сообщений, остальные 5 ждут пополнения
+    assert times[-1] - times[0] >= 0.45
+
+
+def test_pending_edits_are_coalesced():
+    bot = FakeBot()
+    outbox = Outbox()
+
+    def enqueue():
+        for n in range(3):
+            outbox.edit_message_text(1, 10, f"Остаток: {n}")
+
+    run(outbox, bot, enqueue)
+
+    assert bot.sent() == [("edit_message_text", 1, 10, "Остаток: 2")]
+
+
+def test_unchanged_edit_is_skipped():
+    bot = FakeBot()
+    outbox = Outbox()
+
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 5"))
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 5"))
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 4"))
+
+    assert [text for *_, text in bot.sent()] == ["Остаток: 5", "Остаток: 4"]
+
+
+def test_retry_after_pauses_chat_and_global_limit():
+    bot = FakeBot(failures=[RetryAfter(timedelta(seconds=0.3))])
+    outbox = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+    def enqueue():
+        outbox.send_message(1, "Первый чат")
+        outbox.send_message(2, "Второй чат")
+
+    run(outbox, bot, enqueue)
+
+    assert bot.sent() == [
+        ("send_message", 1, None, "Первый чат"),
+        ("send_message", 2, None, "Второй чат"),
+        ("send_message", 1, None, "Первый чат"),
+    ]
+    first, second, retry = bot.times()
+    # Лимит 429 общий для бота: другой чат тоже ждет
+    assert second - first >= 0.25
+    assert retry - first >= 0.25
+
+
+def test_network_error_is_retried_with_backoff():
+    bot = FakeBot(failures=[NetworkError("Connection reset")])
+    outbox = Outbox(base_delay=0.1)
+
+    run(outbox, bot, lambda: outbox.send_message(1, "Чек"))
+
+    assert len(bot.calls) == 2
+    first, retry = bot.times()
+    assert retry - first >= 0.05
+
+
+def test_failed_edit_forgets_rendered_content():
+    bot = FakeBot(failures=[NetworkError("Connection reset")] * 2)
+    outbox = Outbox(max_retries=1, base_delay=0.01)
+
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 5"))
+    assert len(bot.calls) == 2
+
+    # Содержимое не дошло до Telegram, поэтому та же правка отправляется снова
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 5"))
+    assert len(bot.calls) == 3
+
+
+def test_rejected_edit_forgets_rendered_content_but_not_modified_keeps_it():
+    bot = FakeBot(failures=[BadRequest("Message to edit not found")])
+    outbox = Outbox()
+
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 5"))
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 10, "Остаток: 5"))
+    assert len(bot.calls) == 2
+
+    bot.failures.append(BadRequest("Message is not modified"))
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 11, "Остаток: 7"))
+    run(outbox, bot, lambda: outbox.edit_message_text(1, 11, "Остаток: 7"))
+    assert len(bot.calls) == 3
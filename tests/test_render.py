@@ -0,0 +1,30 @@
+"""Клавиатуры выбора товара из render"""
+import pytest
+
+pytest.importorskip("telegram")
+
+import render  # noqa: E402
+
+
+def button_rows(markup):
+    return [[(button.text, button.callback_data) for button in row] for row in markup.inline_keyboard]
+
+
+def test_product_picker_rows(db):
+    db.add_product("Молоко 3.2%", 10, 8990)
+    db.add_product("Хлеб", 0, 4000)
+    products = db.get_all_products()
+
+    markup = render.product_picker(products, render.PICK_PRICE_LABEL, "product_price_", "menu_products")
+    assert button_rows(markup) == [
+        [("📦 Молоко 3.2% (текущая: 89.90 руб.)", "product_price_Молоко_3.2%")],
+        [("📦 Хлеб (текущая: 40.00 руб.)", "product_price_Хлеб")],
+        [("◀️ Назад", "menu_products"), ("🏠 Главное меню", "back_main")],
+    ]
+
+    markup = render.product_picker(products, render.PICK_QUANTITY_LABEL, "product_qty_", "menu_products")
+    assert button_rows(markup)[1] == [("📦 Хлеб (текущее: 0)", "product_qty_Хлеб")]
+
+
+def test_product_picker_without_products():
+    assert render.product_picker([], render.PICK_SELL_LABEL, "product_sell_", "menu_products") is None
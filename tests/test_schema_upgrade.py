@@ -0,0 +1,82 @@
+"""Обновление схемы: база первой версии бота (суммы в рублях, REAL) открывается и переводится"""
+import sqlite3
+
+from database import Database
+
+# Схема первой версии бота
+BASELINE_SCHEMA = """
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        price REAL NOT NULL DEFAULT 0.0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE cashbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount REAL NOT NULL DEFAULT 0.0,
+        transaction_type TEXT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE admins (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL UNIQUE,
+        username TEXT,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT INTO cashbox (amount, transaction_type, description) VALUES (0.0, 'initial', 'Начальный баланс');
+"""
+
+
+def make_baseline_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany("INSERT INTO products (name, quantity, price) VALUES (?, ?, ?)", [
+        ("Молоко 3.2%", 10, 89.9),
+        ("Хлеб", 0, 40.0),
+        ("Сыр", 2, 500.55),
+    ])
+    conn.executemany("INSERT INTO cashbox (amount, transaction_type, description) VALUES (?, ?, ?)", [
+        (1000.1, 'income', "Размен"),
+        (179.8, 'sale', "Продажа: Молоко 3.2% x2"),
+        (-200.2, 'expense', "Инкассация"),
+    ])
+    conn.execute("INSERT INTO admins (user_id, username) VALUES (100, 'boss')")
+    conn.commit()
+    conn.close()
+
+
+def test_baseline_database_is_upgraded(db_path):
+    make_baseline_database(db_path)
+
+    db = Database(db_path)
+    try:
+        assert [(p.name, p.quantity, p.price) for p in db.get_all_products()] == [
+            ("Молоко 3.2%", 10, 8990), ("Сыр", 2, 50055), ("Хлеб", 0, 4000)
+        ]
+        assert db.get_cashbox_balance() == 100010 + 17980 - 20020
+        assert db.is_admin(100)
+        # Сводка пересчитана в копейках, триггеры и индекс стоимости работают
+        assert db.get_inventory_summary() == {
+            'product_count': 3, 'total_quantity': 12, 'total_value': 10 * 8990 + 2 * 50055, 'out_of_stock': 1,
+        }
+        assert [p.name for p in db.get_top_value_products(2)] == ["Сыр", "Молоко 3.2%"]
+        assert db.get_stock_at("Молоко 3.2%", "2999-01-01 00:00:00") == 10
+        assert db.get_price_at("Сыр", "2999-01-01 00:00:00") == 50055
+
+        assert db.sell_product("Молоко 3.2%", 1) == (True, 8990)
+        assert db.get_inventory_summary()['total_value'] == 9 * 8990 + 2 * 50055
+
+        conn = db.get_connection()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == Database.SCHEMA_VERSION
+        conn.close()
+    finally:
+        db.close()
+
+    # Повторное открытие обновленной базы ничего не меняет
+    db = Database(db_path)
+    try:
+        assert db.get_product("Молоко 3.2%").price == 8990
+    finally:
+        db.close()
@@ -0,0 +1,48 @@
+"""Журнал движения товара: остаток по журналу совпадает с текущим остатком"""
+import threading
+
+
+def journal_total(db, name):
+    return sum(move['delta'] for move in db.get_stock_moves(name, limit=10 ** 6))
+
+
+def test_concurrent_corrections_and_sales_keep_journal_consistent(db):
+    db.add_product("Молоко", 1000, 100)
+
+    def sell():
+        for _ in range(50):
+            db.sell_product("Молоко", 1)
+
+    def correct():
+        for quantity in range(500, 550):
+            db.update_product_quantity("Молоко", quantity)
+            db.add_product_quantity("Молоко", 3)
+
+    threads = [threading.Thread(target=sell) for _ in range(4)] + [threading.Thread(target=correct)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    product = db.get_product("Молоко")
+    assert journal_total(db, "Молоко") == product.quantity
+    assert db.get_stock_at("Молоко", "2999-01-01 00:00:00") == product.quantity
+
+
+def test_snapshot_covers_only_moved_product(db):
+    db.SNAPSHOT_INTERVAL = 5
+    db.add_product("Молоко", 100, 100)
+    db.add_product("Хлеб", 50, 40)
+    for _ in range(12):
+        db.sell_product("Молоко", 1)
+
+    conn = db.get_connection()
+    snapshots = conn.execute("""
+        SELECT p.name, s.quantity, s.move_id FROM stock_snapshots s
+        JOIN products p ON p.id = s.product_id ORDER BY s.id
+    """).fetchall()
+    conn.close()
+    # Начальное движение + 12 продаж: снимки после 5-го и 10-го движения молока
+    assert [(row['name'], row['quantity']) for row in snapshots] == [("Молоко", 96), ("Молоко", 91)]
+    assert db.get_stock_at("Молоко", "2999-01-01 00:00:00") == 88
+    assert db.get_stock_at("Хлеб", "2999-01-01 00:00:00") == 50
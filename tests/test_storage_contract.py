@@ -0,0 +1,268 @@
+"""
+Контракт хранилища: одни и те же тесты для Database (SQLite) и PostgresDatabase
+
+PostgreSQL проверяется, если задан TEST_DATABASE_URL (см. conftest.py).
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from reprice import RepriceRule
+
+FAR_FUTURE = "2999-01-01 00:00:00"
+
+
+def names(products):
+    return [product.name for product in products]
+
+
+def test_products(storage):
+    assert storage.add_product("Молоко", 10, 8990)
+    assert storage.add_product("Хлеб", 0, 4000)
+    assert not storage.add_product("Молоко", 1, 1)
+
+    product = storage.get_product("Молоко")
+    assert (product.name, product.quantity, product.price) == ("Молоко", 10, 8990)
+    assert storage.get_product_by_id(product.id).name == "Молоко"
+    assert storage.get_product("Кефир") is None
+    assert names(storage.get_all_products()) == ["Молоко", "Хлеб"]
+
+    assert storage.update_product_quantity("Молоко", 25)
+    assert storage.add_product_quantity("Молоко", 5)
+    assert storage.update_product_price("Молоко", 9500)
+    assert not storage.update_product_quantity("Кефир", 1)
+    assert not storage.add_product_quantity("Кефир", 1)
+    assert not storage.update_product_price("Кефир", 1)
+    product = storage.get_product("Молоко")
+    assert (product.quantity, product.price) == (30, 9500)
+    # Каталог в памяти видит изменения
+    assert [(p.name, p.quantity, p.price) for p in storage.get_all_products()] == [
+        ("Молоко", 30, 9500), ("Хлеб", 0, 4000)
+    ]
+
+
+def test_products_seq(storage):
+    storage.add_product("Молоко", 10, 8990)
+    seq = storage.get_products_seq()
+    assert storage.get_products_changed_since(seq) == []
+
+    storage.update_product_price("Молоко", 9000)
+    changed = storage.get_products_changed_since(seq)
+    assert [(product.name, product.price) for product in changed] == [("Молоко", 9000)]
+    assert storage.get_products_seq() > seq
+
+
+def test_sku(storage):
+    storage.add_product("Молоко", 10, 8990)
+    assert storage.update_product_sku("Молоко", "4600000000017")
+    assert storage.get_product_id_by_sku("4600000000017") == storage.get_product("Молоко").id
+    assert storage.get_product_id_by_sku("0000") is None
+    assert not storage.update_product_sku("Кефир", "1")
+    assert storage.update_product_sku("Молоко", None)
+    assert storage.get_product_id_by_sku("4600000000017") is None
+
+
+def test_sales_and_stock_journal(storage):
+    storage.add_product("Молоко", 10, 8990)
+
+    assert storage.sell_product("Молоко", 3, user_id=7) == (True, 26970)
+    assert storage.sell_product("Молоко", 30) == (False, None)
+    assert storage.sell_product("Кефир", 1) == (False, None)
+    assert storage.get_product("Молоко").quantity == 7
+    assert storage.get_cashbox_balance() == 26970
+
+    storage.add_product_quantity("Молоко", 4)
+    storage.update_product_quantity("Молоко", 20)
+    moves = storage.get_stock_moves("Молоко")
+    assert [(move['delta'], move['move_type']) for move in moves] == [
+        (9, 'correction'), (4, 'receipt'), (-3, 'sale'), (10, 'initial')
+    ]
+    assert storage.get_stock_at("Молоко", FAR_FUTURE) == 20
+    assert storage.get_stock_at("Молоко", "2000-01-01 00:00:00") == 0
+
+    storage.create_stock_snapshot()
+    storage.sell_product("Молоко", 2)
+    assert storage.get_stock_at("Молоко", FAR_FUTURE) == 18
+
+
+def test_idempotent_operations(storage):
+    storage.add_product("Молоко", 10, 8990)
+
+    for _ in range(3):
+        assert storage.sell_product("Молоко", 2, idempotency_key="cb:1") == (True, 17980)
+        assert storage.add_cash(10000, "Размен", idempotency_key="msg:1:1")
+        assert storage.withdraw_cash(5000, "Инкассация", idempotency_key="msg:1:2")
+        assert not storage.withdraw_cash(10 ** 9, idempotency_key="msg:1:3")
+
+    assert storage.get_product("Молоко").quantity == 8
+    assert storage.get_cashbox_balance() == 17980 + 10000 - 5000
+
+
+def test_prices(storage):
+    storage.add_product("Молоко", 10, 8990)
+    storage.update_product_price("Молоко", 9500, user_id=7)
+
+    history = storage.get_price_history("Молоко")
+    assert [(record['price'], record['user_id']) for record in history] == [(9500, 7), (8990, None)]
+    assert storage.get_price_at("Молоко", FAR_FUTURE) == 9500
+    assert storage.get_price_at("Молоко", "2000-01-01 00:00:00") is None
+    assert storage.get_price_at("Кефир", FAR_FUTURE) is None
+
+
+def test_reprice(storage):
+    storage.add_product("Молоко 3.2%", 1, 8990)
+    storage.add_product("Молоко 1.5%", 1, 7990)
+    storage.add_product("Хлеб", 1, 4000)
+    rule = RepriceRule(percent_bp=700, step=100)
+
+    preview = storage.preview_reprice(rule, "молоко")
+    assert preview['count'] == 2
+    assert [(s['name'], s['price'], s['new_price']) for s in preview['samples']] == [
+        ("Молоко 1.5%", 7990, 8500), ("Молоко 3.2%", 8990, 9600)
+    ]
+
+    assert storage.bulk_reprice(rule, "молоко", user_id=7) == 2
+    assert [(p.name, p.price) for p in storage.get_all_products()] == [
+        ("Молоко 1.5%", 8500), ("Молоко 3.2%", 9600), ("Хлеб", 4000)
+    ]
+    assert storage.get_price_history("Молоко 3.2%")[0]['price'] == 9600
+    # Регистр кириллицы в фильтре не важен
+    assert storage.preview_reprice(rule, "МОЛОКО 3.2")['count'] == 1
+    assert storage.preview_reprice(rule, "хлеб")['count'] == 1
+    # Символы LIKE в фильтре - обычные символы
+    assert storage.preview_reprice(rule, "3.2%")['count'] == 1
+    assert storage.preview_reprice(rule, "_")['count'] == 0
+
+
+def test_categories(storage):
+    storage.add_product("Молоко", 10, 8990)
+    storage.add_product("Сыр", 2, 50000)
+    storage.add_product("Хлеб", 5, 4000)
+
+    dairy = storage.find_category(["Молочка"], create=True)
+    cheese = storage.find_category(["Молочка", "Сыры"], create=True)
+    assert storage.find_category(["Молочка", "Сыры"]) == cheese
+    assert storage.find_category(["Мясо"]) is None
+    assert storage.get_category_path(cheese) == ["Молочка", "Сыры"]
+
+    assert storage.update_product_category("Молоко", dairy)
+    assert storage.update_product_category("Сыр", cheese)
+    assert not storage.update_product_category("Кефир", dairy)
+
+    assert [(c['name'], c['product_count']) for c in storage.get_child_categories()] == [("Молочка", 2)]
+    assert [(c['name'], c['product_count']) for c in storage.get_child_categories(dairy)] == [("Сыры", 1)]
+    assert storage.get_category(cheese)['parent_id'] == dairy
+    assert names(storage.get_category_products(dairy)) == ["Молоко"]
+    assert names(storage.get_category_products(None)) == ["Хлеб"]
+    assert storage.count_uncategorized_products() == 1
+
+    rule = RepriceRule(delta=1000)
+    assert storage.bulk_reprice(rule, category_id=dairy) == 2
+    assert storage.get_product("Хлеб").price == 4000
+
+
+def test_inventory_summary(storage):
+    storage.add_product("Молоко", 10, 8990)
+    storage.add_product("Хлеб", 0, 4000)
+    storage.add_product("Сыр", 2, 50000)
+    storage.sell_product("Молоко", 4)
+
+    assert storage.get_inventory_summary() == {
+        'product_count': 3,
+        'total_quantity': 8,
+        'total_value': 6 * 8990 + 2 * 50000,
+        'out_of_stock': 1,
+    }
+    assert names(storage.get_top_value_products(2)) == ["Сыр", "Молоко"]
+
+
+def test_cashbox_history_pages(storage):
+    for amount in range(1, 8):
+        storage.add_cash(amount * 100, f"Взнос {amount}")
+    storage.withdraw_cash(50, "Снятие")
+
+    first = storage.get_cashbox_history(3)
+    assert [row['amount'] for row in first] == [-50, 700, 600]
+    second = storage.get_cashbox_history(3, before_id=first[-1]['id'])
+    assert [row['amount'] for row in second] == [500, 400, 300]
+    back = storage.get_cashbox_history(3, after_id=second[0]['id'])
+    assert [row['amount'] for row in back] == [-50, 700, 600]
+
+    expenses = storage.get_cashbox_history(10, transaction_type='expense')
+    assert [row['amount'] for row in expenses] == [-50]
+    today = datetime.now(timezone.utc).date()
+    assert len(storage.get_cashbox_history(10, 'income', date_from=today, date_to=today)) == 7
+    assert storage.get_cashbox_history(10, date_to=today - timedelta(days=1)) == []
+
+
+def test_close_day(storage):
+    storage.add_product("Молоко", 10, 8990)
+    storage.add_cash(100000, "Размен")
+    storage.sell_product("Молоко", 2)
+    storage.withdraw_cash(30000, "Инкассация")
+    today = datetime.now(timezone.utc).date()
+
+    assert storage.get_daily_close(today) is None
+    report = storage.close_day(today)
+    assert report == {
+        'day': today.isoformat(),
+        'sales_count': 1,
+        'revenue': 17980,
+        'deposits': 100000,
+        'withdrawals': 30000,
+        'opening_balance': 0,
+        'closing_balance': 87980,
+    }
+    stored = storage.get_daily_close(today)
+    assert {key: stored[key] for key in report} == report
+    tomorrow = today + timedelta(days=1)
+    assert storage.close_day(tomorrow)['opening_balance'] == 87980
+
+    # Повторное закрытие дня сдвигает остатки уже закрытых следующих дней
+    storage.add_cash(5000, "Размен")
+    assert storage.close_day(today)['closing_balance'] == 92980
+    later = storage.get_daily_close(tomorrow)
+    assert (later['opening_balance'], later['closing_balance']) == (92980, 92980)
+
+
+def test_daily_sales(storage):
+    storage.add_product("Молоко", 10, 8990)
+    storage.add_product("Хлеб", 10, 4000)
+    storage.sell_product("Молоко", 2)
+    storage.sell_product("Молоко", 1)
+    storage.sell_product("Хлеб", 4)
+    today = datetime.now(timezone.utc).date()
+    milk, bread = storage.get_product("Молоко").id, storage.get_product("Хлеб").id
+
+    totals = {}
+    for product_id, day, quantity in storage.get_daily_sales(today - timedelta(days=1), 2):
+        totals[(product_id, day)] = totals.get((product_id, day), 0) + quantity
+    assert totals == {(milk, 1): 3, (bread, 1): 4}
+    assert list(storage.get_daily_sales(date(2000, 1, 1), 2)) == []
+
+
+def test_admins(storage):
+    assert storage.add_admin(100, "boss")
+    assert not storage.add_admin(100, "boss")
+    assert storage.add_admin(200, None, added_by=100)
+    assert storage.is_admin(100) and not storage.is_admin(300)
+
+    storage.update_admin_usernames([(200, "cashier")])
+    assert [(a['user_id'], a['username']) for a in storage.get_all_admins()] == [
+        (100, "boss"), (200, "cashier")
+    ]
+    assert storage.remove_admin(200, removed_by=100)
+    assert not storage.remove_admin(200)
+    assert [a['user_id'] for a in storage.get_all_admins()] == [100]
+
+
+def test_audit_log(storage):
+    storage.add_audit_entries([
+        (7, 'price', "Молоко", "89.90", "95.00", "2026-01-01 10:00:00"),
+        (8, 'sale', "Хлеб", "5", "4", "2026-01-01 10:01:00"),
+        (7, 'sale', "Хлеб", "4", "3", "2026-01-01 10:02:00"),
+    ])
+
+    assert [e['action'] for e in storage.get_audit_log()] == ['sale', 'sale', 'price']
+    assert [e['target'] for e in storage.get_audit_log(user_id=7)] == ["Хлеб", "Молоко"]
+    entries = storage.get_audit_log(target="Хлеб")
+    assert [e['user_id'] for e in entries] == [7, 8]
+    assert [e['user_id'] for e in storage.get_audit_log(before_id=entries[0]['id'])] == [8, 7]
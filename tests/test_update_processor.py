@@ -0,0 +1,85 @@
+"""Параллельная обработка обновлений: разные пользователи - одновременно, один - по очереди"""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram import CallbackQuery, Update, User  # noqa: E402
+
+from update_processor import PerUserUpdateProcessor  # noqa: E402
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, f"user{user_id}", False)
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), user, "chat"))
+
+
+def test_users_overlap_and_each_user_keeps_order():
+    events = []
+
+    async def handler(name: str, storage_seconds: float):
+        events.append(("start", name))
+        # Обращение к хранилищу, как в обработчиках bot.py: блокирующий
+        # вызов идет в пуле потоков и не держит цикл событий
+        await asyncio.to_thread(time.sleep, storage_seconds)
+        events.append(("end", name))
+
+    async def run():
+        processor = PerUserUpdateProcessor(max_concurrent_updates=16)
+        await processor.initialize()
+        updates = [
+            (make_update(1, 100), handler("A1", 0.3)),
+            (make_update(2, 100), handler("A2", 0.01)),
+            (make_update(3, 200), handler("B1", 0.01)),
+            (make_update(4, 200), handler("B2", 0.01)),
+        ]
+        await asyncio.gather(*(processor.process_update(update, coroutine) for update, coroutine in updates))
+        await processor.shutdown()
+
+    asyncio.run(run())
+
+    position = {event: index for index, event in enumerate(events)}
+    # Обновления пользователя 200 обработаны, пока первое обновление
+    # пользователя 100 ждет хранилище
+    assert position[("end", "B2")] < position[("end", "A1")]
+    # Обновления одного пользователя не пересекаются и идут в порядке поступления
+    assert position[("end", "A1")] < position[("start", "A2")]
+    assert position[("end", "B1")] < position[("start", "B2")]
+
+
+def test_user_with_more_updates_than_slots_does_not_block_others():
+    slots = 4
+    order = []
+
+    async def run():
+        processor = PerUserUpdateProcessor(max_concurrent_updates=slots)
+        await processor.initialize()
+        released = asyncio.Event()
+
+        async def first():
+            # Первое обновление пользователя 100 ждет, пока обработают
+            # пользователя 200; если слоты заняты очередью 100, ожидание вечное
+            await released.wait()
+            order.append("A0")
+
+        async def queued(index: int):
+            order.append(f"A{index}")
+
+        async def other():
+            order.append("B")
+            released.set()
+
+        updates = [(make_update(1, 100), first())]
+        updates += [(make_update(1 + index, 100), queued(index)) for index in range(1, slots * 3)]
+        updates.append((make_update(100, 200), other()))
+        await asyncio.wait_for(
+            asyncio.gather(*(processor.process_update(update, coroutine) for update, coroutine in updates)),
+            timeout=5,
+        )
+        await processor.shutdown()
+
+    asyncio.run(run())
+
+    assert order == ["B"] + [f"A{index}" for index in range(slots * 3)]
@@ -0,0 +1,127 @@
+"""
+HTTP-транспорт бота
+
+Настройка клиента Bot API: размер пула соединений, HTTP/2 и время жизни
+простаивающих соединений (keep-alive). Ответы Telegram (в том числе пачки
+обновлений getUpdates) и параметры запросов (тексты, клавиатуры)
+разбираются и кодируются через orjson, если он установлен, иначе - через
+стандартный json.
+
+orjson и поддержка HTTP/2 (пакет h2, устанавливается как httpx[http2]) -
+необязательные зависимости: без них бот работает на стандартном json и
+HTTP/1.1.
+"""
+import json
+import logging
+from typing import Optional
+
+import httpx
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def http2_available() -> bool:
+    """Проверить, установлена ли поддержка HTTP/2 для httpx"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _dumps(value) -> str:
+    """JSON-значение параметра запроса"""
+    try:
+        return orjson.dumps(value).decode()
+    except TypeError:
+        # orjson не кодирует целые длиннее 64 бит и ключи-не-строки
+        return json.dumps(value)
+
+
+class _OrjsonRequestData:
+    """Параметры запроса (RequestData) с кодированием значений через orjson"""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    @property
+    def json_parameters(self):
+        # Как RequestData.json_parameters: строки передаются как есть
+        return {
+            name: value if isinstance(value, str) else _dumps(value)
+            for name, value in self._data.parameters.items()
+        }
+
+    @property
+    def multipart_data(self):
+        return self._data.multipart_data
+
+
+class FastJSONRequest(HTTPXRequest):
+    """HTTPXRequest, разбирающий ответы и кодирующий параметры через orjson"""
+
+    __slots__ = ()
+
+    @staticmethod
+    def parse_json_payload(payload: bytes):
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Некорректный UTF-8 или JSON: разбор как в HTTPXRequest
+            # (с заменой ошибочных байтов) или такая же ошибка
+            return HTTPXRequest.parse_json_payload(payload)
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        if request_data is not None:
+            request_data = _OrjsonRequestData(request_data)
+        return await super().do_request(url, method, request_data, *args, **kwargs)
+
+
+def build_request(pool_size: int = 256, http_version: str = "1.1",
+                  keepalive: float = 30.0, fast_json: bool = True,
+                  read_timeout: Optional[float] = 5.0) -> HTTPXRequest:
+    """
+    Создать клиент Bot API для Application.builder().request(...)
+
+    Args:
+        pool_size: Наибольшее число соединений (и простаивающих соединений,
+            которые держатся открытыми)
+        http_version: "1.1" или "2"; без пакета h2 используется HTTP/1.1
+        keepalive: Сколько секунд держать простаивающее соединение открытым
+        fast_json: Использовать orjson, если он установлен
+        read_timeout: Время ожидания ответа по умолчанию
+    """
+    if http_version not in ("1.1", "2", "2.0"):
+        logger.warning(f"Неизвестная версия HTTP {http_version!r}, используется HTTP/1.1")
+        http_version = "1.1"
+    elif http_version != "1.1" and not http2_available():
+        logger.warning("HTTP/2 недоступен (pip install 'httpx[http2]'), используется HTTP/1.1")
+        http_version = "1.1"
+
+    request_class = FastJSONRequest if fast_json and orjson is not None else HTTPXRequest
+    # Limits задаются целиком: по умолчанию httpx держит открытыми
+    # не больше 20 соединений и закрывает их через 5 секунд простоя
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=keepalive,
+    )
+    return request_class(
+        connection_pool_size=pool_size,
+        http_version=http_version,
+        read_timeout=read_timeout,
+        httpx_kwargs={"limits": limits},
+    )
+
+
+def json_codec_name(request: HTTPXRequest) -> str:
+    """Название JSON-кодека клиента (для журнала)"""
+    return "orjson" if isinstance(request, FastJSONRequest) else "json"
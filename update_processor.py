@@ -0,0 +1,78 @@
+"""
+Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+
+Обновления разных пользователей обрабатываются одновременно, чтобы долгий
+запрос одного администратора не задерживал кассиров. Обновления одного
+пользователя выполняются строго по очереди: от этого зависят пошаговые
+сценарии ввода (user_states в bot.py).
+
+Слот из max_concurrent_updates (семафор BaseUpdateProcessor.process_update)
+берется до вызова do_process_update, поэтому очередь пользователя ведется
+вне семафора: обновление, пришедшее, пока предыдущее обновление того же
+пользователя еще выполняется, ставится в очередь пользователя и сразу
+освобождает слот. Очередь выполняет то обновление, которое ее открыло, в
+своем слоте. Так пользователь, нажавший кнопку 50 раз подряд, занимает один
+слот, а не все, и не задерживает остальных.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений с очередью на каждого пользователя"""
+
+    def __init__(self, max_concurrent_updates: int):
+        """
+        Args:
+            max_concurrent_updates: Сколько обновлений обрабатывать одновременно
+        """
+        super().__init__(max_concurrent_updates)
+        # Обновления пользователей, ждущие выполнения. Очередь есть, пока
+        # выполняется хотя бы одно обновление пользователя
+        self._queues: Dict[int, Deque[Awaitable[Any]]] = {}
+
+    @staticmethod
+    def _user_key(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user_id = self._user_key(update)
+        if user_id is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(user_id)
+        if queue is not None:
+            # Обновление выполнит уже идущая обработка этого пользователя
+            queue.append(coroutine)
+            return
+
+        queue = self._queues[user_id] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception:
+                    # Ошибка одного обновления не отменяет следующие
+                    logger.exception("Ошибка обработки обновления пользователя %s", user_id)
+        finally:
+            del self._queues[user_id]
+            # Остаток очереди при отмене (остановка бота) не выполняется
+            for pending in queue:
+                if asyncio.iscoroutine(pending):
+                    pending.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass